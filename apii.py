@@ -1,12 +1,37 @@
-from flask import Flask, request, jsonify, g, send_from_directory
-from db import Cliente, Producto, NotaVenta, DetalleNotaVenta, Session
-from datetime import date, datetime
-from sqlalchemy import cast, String
-from sqlalchemy.orm import joinedload
+from flask import Flask, Response, request, jsonify, g, make_response, send_file, send_from_directory
+from db import Session, get_engine, estadisticas_pool, inicializar_esquema, version_catalogo
+from serializadores import ProveedorJSON, serializador_filas
+from compresion import instalar_compresion
+from cache import cache_productos
+from metricas import instalar_metricas
+from idempotencia import idempotente
+from reportes import iterar_reporte, fragmentos_csv, escribir_xlsx
+from operaciones import (
+    FILAS_POR_FRAGMENTO_NDJSON, validadores_catalogo, no_modificado, marcar_validadores,
+    filtros_notas, consulta_notas_filtradas, prefiere_ndjson, parametros_reporte
+)
+import operaciones
+from datetime import datetime
+from functools import wraps
 from flask_cors import CORS
+import tempfile
+
+# Variante WSGI de la API; apii_async.py expone las mismas rutas sobre ASGI.
+# La lógica de cada ruta está en operaciones.py: aquí solo se lee la petición y se arma la respuesta.
 
 app = Flask(__name__)
+# JSON con orjson cuando está instalado; Decimal -> float y fechas ISO en todas las respuestas
+app.json = ProveedorJSON(app)
 CORS(app)
+# gzip / brotli negociado para respuestas grandes y transmitidas (ver compresion.py)
+instalar_compresion(app)
+
+def engine_api():
+    """Engine con el que se atienden las peticiones: el de Session, o el de DATABASE_URL si Session no fija uno."""
+    return Session.kw.get('bind') or get_engine()
+
+# Latencia, SQL por petición, pool y cache en GET /api/metrics (formato Prometheus)
+instalar_metricas(app, lambda: engine_api().pool, cache_productos)
 
 # Función para obtener la sesión del contexto de la petición
 def get_db():
@@ -21,78 +46,79 @@ def teardown_db(exception=None):
     if db is not None:
         db.close()
 
-# Función auxiliar para serializar fechas
-def serialize_date(obj):
-    if isinstance(obj, date):
-        return obj.isoformat()
-    return obj
-
-# Función auxiliar para convertir objetos SQLAlchemy a diccionario
-def to_dict(obj):
-    result = {}
-    for column in obj.__table__.columns:
-        value = getattr(obj, column.name)
-        if isinstance(value, date):
-            result[column.name] = value.isoformat()
+def condicional_catalogo(vista):
+    """
+    GET condicional para el catálogo: ETag y Last-Modified salen de la versión del
+    catálogo (db.VersionCatalogo), que se lee antes que los productos. Si el cliente
+    ya tiene esa versión (If-None-Match / If-Modified-Since) se responde 304 sin
+    consultar la tabla de productos. La vista encuentra la versión en g.version_catalogo.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        version, actualizado = version_catalogo(get_db())
+        g.version_catalogo = version
+        etag, ultimo_cambio = validadores_catalogo(version, actualizado, request.full_path)
+        if no_modificado(request, etag, ultimo_cambio):
+            respuesta = Response(status=304)
         else:
-            result[column.name] = value
-    return result
+            respuesta = make_response(vista(*args, **kwargs))
+        return marcar_validadores(respuesta, etag, ultimo_cambio)
+    return envoltura
 
 @app.route('/api/productos', methods=['GET'])
+@condicional_catalogo
 def obtener_todos_los_productos():
     """
-    GET /api/productos
-    Retorna todos los productos ordenados por id_producto
+    GET /api/productos?limit=50&cursor=...&nombre=cami&stock_min=1&fields=id_producto,nombre,stock
+    Retorna una página de productos ordenados por id_producto.
+    
+    - limit: tamaño de página (por defecto 50, máximo 500)
+    - cursor: valor next_cursor de la respuesta anterior
+    - nombre: búsqueda por nombre del producto
+    - stock_min: solo productos con stock >= stock_min
+    - fields: columnas a devolver (id_producto se incluye siempre)
     """
-    try:
-        session = get_db()
-        productos = session.query(Producto).order_by(Producto.id_producto).all()
-        productos_dict = [to_dict(producto) for producto in productos]
-        
-        return jsonify({
-            'success': True,
-            'data': productos_dict,
-            'count': len(productos_dict)
-        }), 200
-        
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+    cuerpo, estado = operaciones.listar_productos(get_db(), request.args)
+    return jsonify(cuerpo), estado
 
 @app.route('/api/productos/<int:id_producto>', methods=['GET'])
+@condicional_catalogo
 def obtener_producto_por_id(id_producto):
     """
     GET /api/productos/{id}
     Retorna un producto específico por su ID
     """
+    cuerpo, estado = operaciones.producto_por_id(get_db(), id_producto, g.version_catalogo)
+    return jsonify(cuerpo), estado
+
+def _lineas_ndjson(filtros):
+    # Sesión propia: la respuesta se sigue generando después de que la vista retorna
+    session = Session()
     try:
-        session = get_db()
-        producto = session.query(Producto).filter_by(id_producto=id_producto).first()
-        
-        if not producto:
-            return jsonify({
-                'success': False,
-                'error': 'Producto no encontrado'
-            }), 404
-        
-        return jsonify({
-            'success': True,
-            'data': to_dict(producto)
-        }), 200
-        
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        query = consulta_notas_filtradas(session, filtros)
+        serializar = serializador_filas(query)
+        dumps = app.json.dumps
+        pendientes = []
+        enviadas = 0
+        for nota in query.yield_per(FILAS_POR_FRAGMENTO_NDJSON):
+            pendientes.append(dumps(serializar(nota)))
+            # La primera fila sale sola para que llegue al cliente sin esperar al resto del lote
+            if not enviadas or len(pendientes) >= FILAS_POR_FRAGMENTO_NDJSON:
+                yield "\n".join(pendientes) + "\n"
+                enviadas += len(pendientes)
+                pendientes = []
+        if pendientes:
+            yield "\n".join(pendientes) + "\n"
+    finally:
+        session.close()
 
 @app.route('/api/notas/filtradas', methods=['POST'])
 def obtener_notas_filtradas():
     """
     POST /api/notas/filtradas
-    Retorna notas filtradas según criterios específicos
+    Retorna notas filtradas según criterios específicos.
+    Con "Accept: application/x-ndjson" (o ?stream=1) transmite una nota JSON por línea
+    a medida que el cursor de la base entrega las filas, sin armar la lista completa.
     
     Body ejemplo:
     {
@@ -103,63 +129,25 @@ def obtener_notas_filtradas():
     }
     """
     try:
-        session = get_db()
-        filtros_activos = request.json or {}
-        
-        # Consulta base con join a Cliente
-        query = session.query(
-            NotaVenta.id_nota,
-            NotaVenta.fecha_venta,
-            NotaVenta.total,
-            Cliente.nombre.label("nombre_cliente")
-        ).join(Cliente, NotaVenta.id_cliente == Cliente.id_cliente, isouter=True)\
-         .filter(NotaVenta.estado.ilike('%cancelado%'))
-
-        # Aplicar filtros
-        if filtros_activos.get("ID Venta"):
-            query = query.filter(cast(NotaVenta.id_nota, String).ilike(f"%{filtros_activos['ID Venta']}%"))
-        
-        if filtros_activos.get("Cliente"):
-            query = query.filter(Cliente.nombre.ilike(f"%{filtros_activos['Cliente']}%"))
-        
-        if filtros_activos.get("Fecha Inicio"):
-            fecha_inicio = datetime.strptime(filtros_activos["Fecha Inicio"], "%Y-%m-%d").date()
-            query = query.filter(NotaVenta.fecha_venta >= fecha_inicio)
-        
-        if filtros_activos.get("Fecha Fin"):
-            fecha_fin = datetime.strptime(filtros_activos["Fecha Fin"], "%Y-%m-%d").date()
-            query = query.filter(NotaVenta.fecha_venta <= fecha_fin)
-
-        # Ejecutar consulta
-        notas = query.order_by(NotaVenta.fecha_venta.asc(), NotaVenta.id_nota.asc()).all()
-        
-        # Convertir resultados a diccionario
-        notas_dict = []
-        for nota in notas:
-            notas_dict.append({
-                'id_nota': nota.id_nota,
-                'fecha_venta': serialize_date(nota.fecha_venta),
-                'total': float(nota.total) if nota.total else 0,
-                'nombre_cliente': nota.nombre_cliente
-            })
-        
-        return jsonify({
-            'success': True,
-            'data': notas_dict,
-            'count': len(notas_dict)
-        }), 200
-        
+        filtros = filtros_notas(request.json or {})
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
+    
+    if prefiere_ndjson(request):
+        return Response(_lineas_ndjson(filtros), mimetype='application/x-ndjson')
+    cuerpo, estado = operaciones.notas_filtradas(get_db(), filtros)
+    return jsonify(cuerpo), estado
 
 @app.route('/api/notas', methods=['POST'])
+@idempotente(get_db)
 def crear_nota_venta():
     """
     POST /api/notas
-    Crea una nueva nota de venta
+    Crea una nueva nota de venta.
+    Con cabecera Idempotency-Key, un reintento con la misma clave devuelve la respuesta original.
     
     Body ejemplo:
     {
@@ -171,178 +159,107 @@ def crear_nota_venta():
         "observaciones": "Nota de prueba"
     }
     """
-    session = get_db()
-    try:
-        data = request.json
-        
-        if not data:
-            return jsonify({
-                'success': False,
-                'error': 'No se proporcionaron datos'
-            }), 400
-        
-        id_cliente = data.get('id_cliente')
-        productos_cantidades = data.get('productos_cantidades', [])
-        observaciones = data.get('observaciones')
-        
-        if not id_cliente:
-            return jsonify({
-                'success': False,
-                'error': 'id_cliente es requerido'
-            }), 400
-        
-        if not productos_cantidades:
-            return jsonify({
-                'success': False,
-                'error': 'productos_cantidades es requerido'
-            }), 400
-        
-        # Verificar que el cliente existe
-        cliente = session.query(Cliente).filter_by(id_cliente=id_cliente).first()
-        if not cliente:
-            return jsonify({
-                'success': False,
-                'error': 'El cliente no existe'
-            }), 404
-        
-        # Crear nueva nota de venta
-        nueva_nota = NotaVenta(
-            id_cliente=id_cliente,
-            fecha=date.today(),
-            total=0,
-            estado="Pendiente",
-            observaciones=observaciones,
-            estado_pedido="ABIERTO"
-        )
-        
-        session.add(nueva_nota)
-        session.flush()  # Para obtener el id_nota
-        
-        total_venta = 0
-        
-        # Procesar productos
-        for producto_data in productos_cantidades:
-            if len(producto_data) != 5:
-                session.rollback()
-                return jsonify({
-                    'success': False,
-                    'error': 'Cada producto debe tener: [id_producto, cantidad, precio_unitario, talla, color]'
-                }), 400
-            
-            id_producto, cantidad, precio_unitario, talla, color = producto_data
-            
-            # Verificar que el producto existe
-            producto = session.query(Producto).filter_by(id_producto=id_producto).first()
-            if not producto:
-                session.rollback()
-                return jsonify({
-                    'success': False,
-                    'error': f'El producto con ID {id_producto} no existe'
-                }), 404
-            
-            # Verificar stock
-            if producto.stock < cantidad:
-                session.rollback()
-                return jsonify({
-                    'success': False,
-                    'error': f'No hay suficiente stock para el producto {producto.nombre}. Stock disponible: {producto.stock}'
-                }), 400
-            
-            subtotal = round(precio_unitario * cantidad, 2)
-            
-            # Crear detalle de nota
-            detalle_nota = DetalleNotaVenta(
-                id_nota=nueva_nota.id_nota,
-                id_producto=id_producto,
-                cantidad=cantidad,
-                precio_unitario=precio_unitario,
-                talla=talla,
-                color=color,
-                subtotal=subtotal
-            )
-            session.add(detalle_nota)
-            total_venta += subtotal
-        
-        # Actualizar total de la nota
-        nueva_nota.total = round(total_venta, 2)
-        session.commit()
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'id_nota': nueva_nota.id_nota,
-                'total': total_venta
-            },
-            'message': f'Nota de venta creada exitosamente con ID: {nueva_nota.id_nota}'
-        }), 201
-        
-    except Exception as e:
-        session.rollback()
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+    cuerpo, estado = operaciones.crear_nota(get_db(), request.json)
+    return jsonify(cuerpo), estado
+
+@app.route('/api/notas/batch', methods=['POST'])
+@idempotente(get_db)
+def crear_notas_lote():
+    """
+    POST /api/notas/batch
+    Crea varias notas de venta (p. ej. las acumuladas por una terminal sin conexión).
+    Clientes y productos de todo el lote se validan con una consulta IN cada uno; las
+    notas se insertan en una sola transacción con un savepoint por nota, de modo que
+    una nota rechazada no impide guardar las demás.
+    
+    Body ejemplo:
+    {
+        "notas": [
+            {"id_cliente": 1, "productos_cantidades": [[1, 2, 50.0, "M", "Rojo"]]},
+            {"id_cliente": 2, "productos_cantidades": [[2, 1, 25.0, "L", "Azul"]], "observaciones": "..."}
+        ]
+    }
+    
+    Respuesta: un resultado por nota, en el mismo orden, con id_nota y total o
+    con el error y el código HTTP que habría devuelto POST /api/notas.
+    """
+    cuerpo, estado = operaciones.crear_notas_lote(get_db(), request.json)
+    return jsonify(cuerpo), estado
 
 @app.route('/api/notas/<int:id_nota>/confirmar-venta', methods=['POST'])
+@idempotente(get_db)
 def agregar_venta(id_nota):
     """
     POST /api/notas/{id}/confirmar-venta
     Confirma una venta (reduce stock y cambia estado a "Cancelado")
     """
-    session = get_db()
+    cuerpo, estado = operaciones.confirmar_venta(get_db(), id_nota)
+    return jsonify(cuerpo), estado
+
+@app.route('/api/notas/confirmar-venta', methods=['POST'])
+@idempotente(get_db)
+def confirmar_ventas_lote():
+    """
+    POST /api/notas/confirmar-venta
+    Confirma la venta de varias notas en una sola transacción (cierre del día).
+    Los productos se bloquean en orden de id y el stock se descuenta con un único UPDATE.
+    
+    Body ejemplo:
+    {
+        "ids_notas": [10, 11, 12],
+        "fecha_venta": "2024-03-01"
+    }
+    
+    Respuesta: un resultado por nota, en el orden recibido.
+    """
+    cuerpo, estado = operaciones.confirmar_ventas_lote(get_db(), request.json)
+    return jsonify(cuerpo), estado
+
+@app.route('/api/reportes/ventas', methods=['GET'])
+def exportar_reporte_ventas():
+    """
+    GET /api/reportes/ventas?formato=csv&mes=3&anio=2024
+    GET /api/reportes/ventas?formato=xlsx&desde=2024-01-01&hasta=2024-12-31
+    Descarga el reporte de ventas leyendo la base por lotes.
+    El CSV se transmite a medida que se generan las filas; el XLSX se arma
+    en un archivo temporal (modo write_only) y luego se envía.
+    """
     try:
-        # Verificar que la nota existe
-        nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-        if not nota:
-            return jsonify({
-                'success': False,
-                'error': 'La nota de venta no existe'
-            }), 404
-        
-        # Verificar stock antes de proceder
-        detalles = session.query(DetalleNotaVenta).filter_by(id_nota=id_nota).all()
-        
-        for detalle in detalles:
-            producto = session.query(Producto).filter_by(id_producto=detalle.id_producto).first()
-            if not producto:
-                return jsonify({
-                    'success': False,
-                    'error': f'El producto con ID {detalle.id_producto} no existe'
-                }), 404
-            
-            if producto.stock < detalle.cantidad:
-                return jsonify({
-                    'success': False,
-                    'error': f'El producto "{producto.nombre}" no tiene suficiente stock. Disponible: {producto.stock}, Requerido: {detalle.cantidad}'
-                }), 400
-        
-        # Reducir stock de los productos
-        for detalle in detalles:
-            producto = session.query(Producto).filter_by(id_producto=detalle.id_producto).first()
-            producto.stock -= detalle.cantidad
-        
-        # Cambiar estado de la nota
-        nota.estado = "Cancelado"
-        nota.fecha_venta = date.today()
-        
-        session.commit()
-        
+        formato, mes, anio, desde, hasta = parametros_reporte(request.args)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'message': f'Venta confirmada exitosamente para la Nota de Venta ID: {id_nota}',
-            'data': {
-                'id_nota': id_nota,
-                'estado': nota.estado,
-                'fecha_venta': serialize_date(nota.fecha_venta)
-            }
-        }), 200
-        
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    def filas():
+        # Sesión propia: la respuesta se sigue generando después de que la vista retorna
+        session = Session()
+        try:
+            yield from iterar_reporte(session, mes, anio, desde, hasta)
+        finally:
+            session.close()
+
+    if formato == 'csv':
+        return Response(fragmentos_csv(filas()), mimetype='text/csv', headers={
+            'Content-Disposition': 'attachment; filename=reporte_ventas.csv'
+        })
+    archivo = tempfile.TemporaryFile()
+    try:
+        escribir_xlsx(filas(), archivo)
     except Exception as e:
-        session.rollback()
+        archivo.close()
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
+    archivo.seek(0)
+    return send_file(
+        archivo,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name='reporte_ventas.xlsx'
+    )
 
 # Ruta de prueba para verificar que la API funciona
 @app.route('/api/health', methods=['GET'])
@@ -354,7 +271,9 @@ def health_check():
     return jsonify({
         'success': True,
         'message': 'API funcionando correctamente',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'pool': estadisticas_pool(engine_api()),
+        'cache_productos': cache_productos.estadisticas()
     }), 200
 
 # Manejo de errores globales
@@ -384,4 +303,7 @@ def index():
     return send_from_directory('.', 'frontend.html')
 
 if __name__ == '__main__':
+    # Solo para desarrollo; en producción: python servidor.py (gunicorn, varios workers)
+    # El esquema ya no se crea al importar db: el servidor de desarrollo lo inicializa al arrancar
+    inicializar_esquema()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
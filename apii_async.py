@@ -0,0 +1,369 @@
+from quart import Quart, Response, request, jsonify, g, make_response, send_from_directory
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from db import Session, SesionPerezosaAsync, get_engine_async, estadisticas_pool, inicializar_esquema, version_catalogo
+from serializadores import ProveedorJSON, serializador_filas
+from cache import cache_productos
+from metricas import CONTENT_TYPE, registro, exponer, ruta_peticion, server_timing, server_timing_activo
+from idempotencia import CABECERA_IDEMPOTENCIA, clave_invalida, huella_peticion, reservar_clave, completar_clave
+from reportes import consulta_reporte, iterar_reporte, fragmentos_csv, escribir_xlsx, TAMANIO_LOTE
+from operaciones import (
+    FILAS_POR_FRAGMENTO_NDJSON, validadores_catalogo, no_modificado, marcar_validadores,
+    filtros_notas, consulta_notas_filtradas, prefiere_ndjson, parametros_reporte
+)
+import operaciones
+from datetime import datetime
+from functools import wraps
+import asyncio
+import tempfile
+
+# Variante ASGI (Quart) de apii.py: mismas rutas, mismo contrato JSON y mismos códigos de error,
+# sobre el engine asíncrono de SQLAlchemy. Mientras una petición espera a la base de datos el
+# proceso sigue atendiendo a otras, sin ocupar un hilo por petición.
+#
+# Cada ruta ejecuta la operación de operaciones.py con AsyncSession.run_sync: el código ORM es
+# el mismo que el de la variante WSGI y cada consulta cede el event loop mientras espera.
+# Las respuestas transmitidas (NDJSON, CSV) leen la base con AsyncSession.stream.
+# El reporte XLSX (openpyxl, sin puntos de espera) se arma en un hilo con una sesión
+# sincrónica (db.Session, engine de DATABASE_URL) para no bloquear el event loop.
+#
+# Uso:
+#     hypercorn apii_async:app --bind 0.0.0.0:5000 --workers 1
+#
+# La compresión gzip / brotli de compresion.py es un hook de Flask: con esta variante se
+# delega en el proxy inverso.
+
+app = Quart(__name__)
+# JSON con orjson cuando está instalado; Decimal -> float y fechas ISO en todas las respuestas
+app.json = ProveedorJSON(app)
+
+SessionAsync = async_sessionmaker(sync_session_class=SesionPerezosaAsync)
+
+def engine_api():
+    """Engine (sincrónico) con el que se atienden las peticiones: el de SessionAsync, o el de DATABASE_URL."""
+    motor = SessionAsync.kw.get('bind') or get_engine_async()
+    return motor.sync_engine
+
+# Función para obtener la sesión del contexto de la petición
+def get_db():
+    if 'db' not in g:
+        g.db = SessionAsync()
+    return g.db
+
+# Cerrar la sesión al final de cada petición
+@app.teardown_appcontext
+async def teardown_db(exception=None):
+    db = g.pop('db', None)
+    if db is not None:
+        await db.close()
+
+@app.after_request
+async def permitir_cors(respuesta):
+    # Mismo comportamiento que CORS(app) en apii.py: cualquier origen, con preflight
+    respuesta.headers['Access-Control-Allow-Origin'] = '*'
+    if request.method == 'OPTIONS':
+        respuesta.headers['Access-Control-Allow-Methods'] = respuesta.headers.get('Allow', '')
+        pedidas = request.headers.get('Access-Control-Request-Headers')
+        if pedidas:
+            respuesta.headers['Access-Control-Allow-Headers'] = pedidas
+    return respuesta
+
+# Mismas métricas y Server-Timing que instalar_metricas en apii.py (ver metricas.py)
+ENVIAR_SERVER_TIMING = server_timing_activo()
+
+@app.before_request
+async def iniciar_medicion():
+    g._medicion = registro.iniciar(f'{request.method} {ruta_peticion(request.url_rule)}')
+
+@app.after_request
+async def registrar_estado(respuesta):
+    g._estado_medicion = respuesta.status_code
+    if ENVIAR_SERVER_TIMING and '_medicion' in g:
+        respuesta.headers['Server-Timing'] = server_timing(g._medicion[0])
+    return respuesta
+
+@app.teardown_request
+async def terminar_medicion(exception=None):
+    medicion = g.pop('_medicion', None)
+    if medicion is not None:
+        registro.terminar(*medicion, request.method, ruta_peticion(request.url_rule),
+                          g.pop('_estado_medicion', 500))
+
+def condicional_catalogo(vista):
+    """
+    GET condicional para el catálogo (ver apii.condicional_catalogo): 304 sin
+    consultar la tabla de productos si el cliente ya tiene la versión. La vista
+    encuentra la versión en g.version_catalogo.
+    """
+    @wraps(vista)
+    async def envoltura(*args, **kwargs):
+        version, actualizado = await get_db().run_sync(version_catalogo)
+        g.version_catalogo = version
+        etag, ultimo_cambio = validadores_catalogo(version, actualizado, request.full_path)
+        if no_modificado(request, etag, ultimo_cambio):
+            respuesta = Response('', status=304)
+        else:
+            respuesta = await make_response(await vista(*args, **kwargs))
+        return marcar_validadores(respuesta, etag, ultimo_cambio)
+    return envoltura
+
+def idempotente(vista):
+    """
+    Cabecera Idempotency-Key para las vistas POST (ver idempotencia.idempotente):
+    la clave se reserva en la sesión de la petición, la misma que usa la operación.
+    """
+    @wraps(vista)
+    async def envoltura(*args, **kwargs):
+        clave = request.headers.get(CABECERA_IDEMPOTENCIA)
+        if not clave:
+            return await vista(*args, **kwargs)
+        error = clave_invalida(clave)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+
+        session = get_db()
+        huella = huella_peticion(request.method, request.path, await request.get_data())
+        previa = await session.run_sync(reservar_clave, clave, huella)
+        if previa is not None:
+            cuerpo, estado, reproducida = previa
+            if not reproducida:
+                return jsonify(cuerpo), estado
+            respuesta = Response(cuerpo, status=estado, mimetype='application/json')
+            respuesta.headers['Idempotent-Replayed'] = 'true'
+            return respuesta
+
+        respuesta = await make_response(await vista(*args, **kwargs))
+        await session.run_sync(completar_clave, clave, respuesta.status_code, await respuesta.get_data(as_text=True))
+        return respuesta
+    return envoltura
+
+@app.route('/api/productos', methods=['GET'])
+@condicional_catalogo
+async def obtener_todos_los_productos():
+    """
+    GET /api/productos?limit=50&cursor=...&nombre=cami&stock_min=1&fields=id_producto,nombre,stock
+    Retorna una página de productos ordenados por id_producto.
+    """
+    cuerpo, estado = await get_db().run_sync(operaciones.listar_productos, request.args)
+    return jsonify(cuerpo), estado
+
+@app.route('/api/productos/<int:id_producto>', methods=['GET'])
+@condicional_catalogo
+async def obtener_producto_por_id(id_producto):
+    """
+    GET /api/productos/{id}
+    Retorna un producto específico por su ID
+    """
+    cuerpo, estado = await get_db().run_sync(operaciones.producto_por_id, id_producto, g.version_catalogo)
+    return jsonify(cuerpo), estado
+
+async def _lineas_ndjson(filtros):
+    # Sesión propia: la respuesta se sigue generando después de que la vista retorna
+    session = SessionAsync()
+    try:
+        def preparar(sesion):
+            query = consulta_notas_filtradas(sesion, filtros)
+            return query.statement, serializador_filas(query)
+        sentencia, serializar = await session.run_sync(preparar)
+        resultado = await session.stream(sentencia.execution_options(yield_per=FILAS_POR_FRAGMENTO_NDJSON))
+        dumps = app.json.dumps
+        primera = True
+        async for notas in resultado.partitions():
+            lineas = [dumps(serializar(nota)) for nota in notas]
+            if primera:
+                # La primera fila sale sola para que llegue al cliente sin esperar al resto del lote
+                yield lineas.pop(0) + "\n"
+                primera = False
+            if lineas:
+                yield "\n".join(lineas) + "\n"
+    finally:
+        await session.close()
+
+@app.route('/api/notas/filtradas', methods=['POST'])
+async def obtener_notas_filtradas():
+    """
+    POST /api/notas/filtradas
+    Retorna notas filtradas según criterios específicos; con "Accept: application/x-ndjson"
+    (o ?stream=1) las transmite una por línea (ver apii.obtener_notas_filtradas).
+    """
+    try:
+        filtros = filtros_notas(await request.get_json() or {})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+    if prefiere_ndjson(request):
+        return Response(_lineas_ndjson(filtros), mimetype='application/x-ndjson')
+    cuerpo, estado = await get_db().run_sync(operaciones.notas_filtradas, filtros)
+    return jsonify(cuerpo), estado
+
+@app.route('/api/notas', methods=['POST'])
+@idempotente
+async def crear_nota_venta():
+    """
+    POST /api/notas
+    Crea una nueva nota de venta (ver apii.crear_nota_venta).
+    """
+    cuerpo, estado = await get_db().run_sync(operaciones.crear_nota, await request.get_json())
+    return jsonify(cuerpo), estado
+
+@app.route('/api/notas/batch', methods=['POST'])
+@idempotente
+async def crear_notas_lote():
+    """
+    POST /api/notas/batch
+    Crea varias notas de venta con un savepoint por nota (ver apii.crear_notas_lote).
+    """
+    cuerpo, estado = await get_db().run_sync(operaciones.crear_notas_lote, await request.get_json())
+    return jsonify(cuerpo), estado
+
+@app.route('/api/notas/<int:id_nota>/confirmar-venta', methods=['POST'])
+@idempotente
+async def agregar_venta(id_nota):
+    """
+    POST /api/notas/{id}/confirmar-venta
+    Confirma una venta (reduce stock y cambia estado a "Cancelado")
+    """
+    cuerpo, estado = await get_db().run_sync(operaciones.confirmar_venta, id_nota)
+    return jsonify(cuerpo), estado
+
+@app.route('/api/notas/confirmar-venta', methods=['POST'])
+@idempotente
+async def confirmar_ventas_lote():
+    """
+    POST /api/notas/confirmar-venta
+    Confirma la venta de varias notas en una sola transacción (ver apii.confirmar_ventas_lote).
+    """
+    cuerpo, estado = await get_db().run_sync(operaciones.confirmar_ventas_lote, await request.get_json())
+    return jsonify(cuerpo), estado
+
+async def _fragmentos_csv(mes, anio, desde, hasta):
+    # Sesión propia: la respuesta se sigue generando después de que la vista retorna
+    session = SessionAsync()
+    try:
+        sentencia = await session.run_sync(
+            lambda sesion: consulta_reporte(sesion, mes, anio, desde, hasta).statement
+        )
+        resultado = await session.stream(sentencia.execution_options(yield_per=TAMANIO_LOTE))
+        encabezado = True
+        async for filas in resultado.partitions():
+            for fragmento in fragmentos_csv(filas, encabezado=encabezado):
+                yield fragmento
+            encabezado = False
+        if encabezado:
+            # Reporte vacío: solo el encabezado
+            for fragmento in fragmentos_csv([]):
+                yield fragmento
+    finally:
+        await session.close()
+
+def _reporte_xlsx(mes, anio, desde, hasta):
+    # En un hilo aparte: devuelve el archivo temporal con el reporte, posicionado al inicio
+    archivo = tempfile.TemporaryFile()
+    session = Session()
+    try:
+        escribir_xlsx(iterar_reporte(session, mes, anio, desde, hasta), archivo)
+    except Exception:
+        archivo.close()
+        raise
+    finally:
+        session.close()
+    archivo.seek(0)
+    return archivo
+
+async def _leer_archivo(archivo, tamanio=64 * 1024):
+    try:
+        while True:
+            fragmento = await asyncio.to_thread(archivo.read, tamanio)
+            if not fragmento:
+                break
+            yield fragmento
+    finally:
+        archivo.close()
+
+@app.route('/api/reportes/ventas', methods=['GET'])
+async def exportar_reporte_ventas():
+    """
+    GET /api/reportes/ventas?formato=csv&mes=3&anio=2024
+    GET /api/reportes/ventas?formato=xlsx&desde=2024-01-01&hasta=2024-12-31
+    Descarga el reporte de ventas leyendo la base por lotes (ver apii.exportar_reporte_ventas).
+    """
+    try:
+        formato, mes, anio, desde, hasta = parametros_reporte(request.args)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    if formato == 'csv':
+        return Response(_fragmentos_csv(mes, anio, desde, hasta), mimetype='text/csv', headers={
+            'Content-Disposition': 'attachment; filename=reporte_ventas.csv'
+        })
+    try:
+        archivo = await asyncio.to_thread(_reporte_xlsx, mes, anio, desde, hasta)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    return Response(
+        _leer_archivo(archivo),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers={'Content-Disposition': 'attachment; filename=reporte_ventas.xlsx'}
+    )
+
+# Ruta de prueba para verificar que la API funciona
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """
+    GET /api/health
+    Verificación de estado de la API
+    """
+    return jsonify({
+        'success': True,
+        'message': 'API funcionando correctamente',
+        'timestamp': datetime.now().isoformat(),
+        'pool': estadisticas_pool(engine_api()),
+        'cache_productos': cache_productos.estadisticas()
+    }), 200
+
+@app.route('/api/metrics', methods=['GET'])
+async def metricas():
+    """
+    GET /api/metrics
+    Métricas de la API en el formato de texto de Prometheus
+    """
+    return Response(exponer(engine_api().pool, cache_productos), content_type=CONTENT_TYPE)
+
+# Manejo de errores globales
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify({
+        'success': False,
+        'error': 'Endpoint no encontrado'
+    }), 404
+
+@app.errorhandler(405)
+async def method_not_allowed(error):
+    return jsonify({
+        'success': False,
+        'error': 'Método no permitido'
+    }), 405
+
+@app.errorhandler(500)
+async def internal_error(error):
+    return jsonify({
+        'success': False,
+        'error': 'Error interno del servidor'
+    }), 500
+
+@app.route('/')
+async def index():
+    return await send_from_directory('.', 'frontend.html')
+
+if __name__ == '__main__':
+    # Solo para desarrollo; en producción se sirve con hypercorn (ver arriba)
+    inicializar_esquema()
+    app.run(debug=True, host='0.0.0.0', port=5000)
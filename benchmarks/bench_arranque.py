@@ -0,0 +1,63 @@
+"""
+Tiempo de arranque en frío de apii y sistema.
+
+Cada medición lanza un intérprete nuevo. Se comparan:
+  - import: importar el módulo (el engine y el esquema ya no se tocan al importar).
+  - import + esquema: importar y ejecutar db.inicializar_esquema(), que equivale
+    a lo que antes hacía cualquier import de db (create_all con introspección).
+  - primera consulta: importar y ejecutar un SELECT 1, que crea el engine.
+
+Uso:
+    python benchmarks/bench_arranque.py --repeticiones 10
+    DATABASE_URL=postgresql://... python benchmarks/bench_arranque.py
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ESCENARIOS = {
+    "import": "import {modulo}",
+    "import + esquema": "import {modulo}, db; db.inicializar_esquema()",
+    "primera consulta": "import {modulo}, db; from sqlalchemy import text; "
+                        "db.get_engine().connect().execute(text('SELECT 1'))",
+}
+
+MEDIR = (
+    "import time; _inicio = time.perf_counter(); {codigo}; "
+    "print((time.perf_counter() - _inicio) * 1000)"
+)
+
+
+def medir(codigo, repeticiones, entorno):
+    tiempos = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", MEDIR.format(codigo=codigo)], cwd=RAIZ, env=entorno,
+                                check=True, capture_output=True, text=True).stdout
+        tiempos.append(float(salida.strip().splitlines()[-1]))
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=7)
+    args = parser.parse_args()
+
+    entorno = dict(os.environ)
+    entorno.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_arranque.db"))
+    # La base debe existir para que "import + esquema" mida solo la introspección
+    subprocess.run([sys.executable, "db.py", "bootstrap"], cwd=RAIZ, env=entorno, check=True, capture_output=True)
+
+    print(f"Mediana de {args.repeticiones} arranques ({entorno['DATABASE_URL'].split(':')[0]})")
+    for modulo in ("apii", "sistema"):
+        for nombre, plantilla in ESCENARIOS.items():
+            ms = medir(plantilla.format(modulo=modulo), args.repeticiones, entorno)
+            print(f"  {modulo:<8} {nombre:<18} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
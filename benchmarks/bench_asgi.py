@@ -0,0 +1,230 @@
+"""
+Carga concurrente sobre la API: variante WSGI (apii.py, servidor con un hilo por
+petición) contra la variante ASGI (apii_async.py sobre hypercorn, un proceso y un
+event loop), con el mismo presupuesto de conexiones a la base.
+
+Cada servidor corre en su propio proceso. El generador de carga abre --concurrencia
+conexiones simultáneas contra GET /api/productos?limit=50; cada cliente es "lento":
+envía la línea de la petición, espera --cliente-lento-ms y recién entonces envía las
+cabeceras. Con SQLite se simula la latencia de red de un servidor de base de datos
+con una función dormir(ms) que se ejecuta antes de cada sentencia en el hilo del
+driver (el hilo de la petición en WSGI, el hilo de aiosqlite en ASGI).
+
+Se informan peticiones por segundo, latencias, errores y el máximo de hilos y de
+memoria residente del proceso servidor.
+
+Uso:
+    python benchmarks/bench_asgi.py --concurrencia 200 --peticiones 2000 --latencia-ms 20
+    DATABASE_URL=postgresql://... python benchmarks/bench_asgi.py --latencia-ms 0
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+RUTA = "/api/productos?limit=50"
+
+
+def _instalar_latencia(motor_sync, latencia_ms):
+    # Una sentencia previa "SELECT dormir(ms)" en el mismo cursor y en el hilo del driver
+    from sqlalchemy import event
+    if not latencia_ms or motor_sync.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(motor_sync, "connect")
+    def _registrar(dbapi_connection, connection_record):
+        dbapi_connection.create_function("dormir", 1, lambda ms: time.sleep(ms / 1000) or 0)
+
+    @event.listens_for(motor_sync, "before_cursor_execute")
+    def _esperar(conn, cursor, statement, parameters, context, executemany):
+        cursor.execute(f"SELECT dormir({latencia_ms})")
+
+
+def preparar_base(url, productos):
+    from sqlalchemy import create_engine, insert
+    from db import Base, Producto
+    motor = create_engine(url)
+    Base.metadata.create_all(motor)
+    with motor.begin() as conexion:
+        conexion.execute(insert(Producto.__table__), [
+            {"id_producto": i, "nombre": f"Producto {i}", "costo": Decimal("10.25"), "stock": i % 50,
+             "precio_inicial": Decimal("19.90")} for i in range(1, productos + 1)
+        ])
+    motor.dispose()
+
+
+def servir(variante, puerto, latencia_ms):
+    import db
+    if variante == "wsgi":
+        from werkzeug.serving import make_server
+        import apii
+        _instalar_latencia(db.get_engine(), latencia_ms)
+        make_server("127.0.0.1", puerto, apii.app, threaded=True).serve_forever()
+    else:
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+        import apii_async
+        _instalar_latencia(db.get_engine_async().sync_engine, latencia_ms)
+        config = Config()
+        config.bind = [f"127.0.0.1:{puerto}"]
+        config.backlog = 2048
+        config.accesslog = None
+        asyncio.run(serve(apii_async.app, config))
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _leer_proc(pid):
+    # (hilos, RSS en KiB) del proceso servidor
+    hilos = rss = 0
+    try:
+        with open(f"/proc/{pid}/status") as archivo:
+            for linea in archivo:
+                if linea.startswith("Threads:"):
+                    hilos = int(linea.split()[1])
+                elif linea.startswith("VmRSS:"):
+                    rss = int(linea.split()[1])
+    except OSError:
+        pass
+    return hilos, rss
+
+
+async def _peticion(puerto, espera_s):
+    inicio = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", puerto)
+    try:
+        writer.write(f"GET {RUTA} HTTP/1.1\r\n".encode())
+        await writer.drain()
+        if espera_s:
+            await asyncio.sleep(espera_s)
+        writer.write(b"Host: localhost\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        datos = await reader.read()
+    finally:
+        writer.close()
+    estado = int(datos.split(b" ", 2)[1]) if datos else 0
+    return time.perf_counter() - inicio, estado
+
+
+async def _cargar(puerto, pid, concurrencia, peticiones, espera_s):
+    latencias, errores = [], 0
+    maximos = [0, 0]
+    pendientes = iter(range(peticiones))
+    terminado = asyncio.Event()
+
+    async def cliente():
+        nonlocal errores
+        for _ in pendientes:
+            try:
+                duracion, estado = await _peticion(puerto, espera_s)
+            except OSError:
+                errores += 1
+                continue
+            if estado == 200:
+                latencias.append(duracion)
+            else:
+                errores += 1
+
+    async def muestrear():
+        while not terminado.is_set():
+            hilos, rss = _leer_proc(pid)
+            maximos[0], maximos[1] = max(maximos[0], hilos), max(maximos[1], rss)
+            await asyncio.sleep(0.05)
+
+    muestreo = asyncio.ensure_future(muestrear())
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente() for _ in range(concurrencia)))
+    total = time.perf_counter() - inicio
+    terminado.set()
+    await muestreo
+    return latencias, errores, total, maximos
+
+
+async def _esperar_servidor(puerto, proceso, limite_s=30):
+    fin = time.monotonic() + limite_s
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            raise RuntimeError("El servidor terminó al arrancar")
+        try:
+            _, estado = await _peticion(puerto, 0)
+            if estado == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("El servidor no respondió a tiempo")
+
+
+def medir(variante, args, entorno):
+    puerto = _puerto_libre()
+    proceso = subprocess.Popen(
+        [sys.executable, __file__, "--servir", variante, "--puerto", str(puerto), "--latencia-ms", str(args.latencia_ms)],
+        env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(_esperar_servidor(puerto, proceso))
+        latencias, errores, total, (hilos, rss) = asyncio.run(
+            _cargar(puerto, proceso.pid, args.concurrencia, args.peticiones, args.cliente_lento_ms / 1000)
+        )
+    finally:
+        proceso.terminate()
+        proceso.wait()
+    latencias.sort()
+    percentil = lambda p: latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000 if latencias else 0
+    return {
+        "rps": len(latencias) / total,
+        "p50": statistics.median(latencias) * 1000 if latencias else 0,
+        "p95": percentil(0.95),
+        "p99": percentil(0.99),
+        "errores": errores,
+        "hilos": hilos,
+        "rss_mb": rss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--peticiones", type=int, default=2000)
+    parser.add_argument("--latencia-ms", type=int, default=20, help="Latencia simulada por sentencia (solo SQLite)")
+    parser.add_argument("--cliente-lento-ms", type=int, default=50)
+    parser.add_argument("--pool", type=int, default=20, help="Conexiones a la base en ambas variantes")
+    parser.add_argument("--productos", type=int, default=1000)
+    parser.add_argument("--servir", choices=("wsgi", "asgi"), help=argparse.SUPPRESS)
+    parser.add_argument("--puerto", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir:
+        servir(args.servir, args.puerto, args.latencia_ms)
+        return
+
+    entorno = dict(os.environ, DB_POOL_SIZE=str(args.pool), DB_MAX_OVERFLOW="0", DB_POOL_TIMEOUT="120")
+    if "DATABASE_URL" not in entorno:
+        # Sin DATABASE_URL se usa un SQLite temporal
+        entorno["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_asgi.db")
+        preparar_base(entorno["DATABASE_URL"], args.productos)
+
+    print(f"{args.peticiones} peticiones GET {RUTA}, {args.concurrencia} clientes simultáneos, "
+          f"cliente lento {args.cliente_lento_ms} ms, latencia de base {args.latencia_ms} ms, pool {args.pool}")
+    print(f"  {'variante':<32} {'pet/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errores':>8} "
+          f"{'hilos':>6} {'RSS MiB':>8}")
+    for variante, nombre in (("wsgi", "WSGI (Flask, hilo por petición)"), ("asgi", "ASGI (Quart + hypercorn)")):
+        r = medir(variante, args, entorno)
+        print(f"  {nombre:<32} {r['rps']:8.0f} {r['p50']:8.0f} {r['p95']:8.0f} {r['p99']:8.0f} {r['errores']:8d} "
+              f"{r['hilos']:6d} {r['rss_mb']:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
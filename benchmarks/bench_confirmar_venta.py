@@ -0,0 +1,151 @@
+"""
+Benchmark de concurrencia para la confirmación de ventas.
+
+Compara el flujo anterior (2N+2 consultas por nota, verificación y descuento en
+pasos separados) con el motor de ventas.confirmar_nota (un UPDATE condicionado
+por nota). Varios hilos confirman notas que comparten productos y se reporta
+confirmaciones por segundo y si hubo sobreventa (stock negativo).
+
+Uso:
+    python benchmarks/bench_confirmar_venta.py --notas 400 --lineas 20 --hilos 8
+    DATABASE_URL=postgresql://... python benchmarks/bench_confirmar_venta.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+# Sin DATABASE_URL se usa un SQLite temporal
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_confirmar.db"))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from db import Base, Cliente, Producto, NotaVenta, DetalleNotaVenta
+from ventas import confirmar_nota
+
+
+def confirmar_nota_anterior(session, id_nota):
+    # Réplica del flujo previo: consulta el producto dos veces por línea
+    nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
+    if not nota:
+        raise ValueError("La nota de venta no existe.")
+    detalles = session.query(DetalleNotaVenta).filter_by(id_nota=id_nota).all()
+    for detalle in detalles:
+        producto = session.query(Producto).filter_by(id_producto=detalle.id_producto).first()
+        if not producto:
+            raise ValueError(f"El producto con ID {detalle.id_producto} no existe.")
+        if producto.stock < detalle.cantidad:
+            raise ValueError(f"El producto '{producto.nombre}' no tiene suficiente stock.")
+    for detalle in detalles:
+        producto = session.query(Producto).filter_by(id_producto=detalle.id_producto).first()
+        producto.stock -= detalle.cantidad
+    nota.estado = "Cancelado"
+    nota.fecha_venta = date.today()
+    return nota
+
+
+def preparar_datos(Sesion, notas, lineas, productos):
+    session = Sesion()
+    try:
+        session.query(DetalleNotaVenta).delete()
+        session.query(NotaVenta).delete()
+        session.query(Producto).delete()
+        session.query(Cliente).delete()
+        cliente = Cliente(dni="BENCH", nombre="Cliente Benchmark")
+        session.add(cliente)
+        # Stock justo para la mitad de las notas: la otra mitad debe fallar
+        stock_inicial = notas * lineas // productos // 2
+        session.add_all([
+            Producto(nombre=f"Producto {i}", costo=Decimal("1.00"), stock=stock_inicial)
+            for i in range(productos)
+        ])
+        session.flush()
+        ids_productos = [p.id_producto for p in session.query(Producto.id_producto)]
+        ids_notas = []
+        for n in range(notas):
+            nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(), total=0, estado="Pendiente")
+            session.add(nota)
+            session.flush()
+            session.add_all([
+                DetalleNotaVenta(id_nota=nota.id_nota, id_producto=ids_productos[(n + l) % productos],
+                                 cantidad=1, precio_unitario=Decimal("2.00"), subtotal=Decimal("2.00"))
+                for l in range(lineas)
+            ])
+            ids_notas.append(nota.id_nota)
+        session.commit()
+        return ids_notas
+    finally:
+        session.close()
+
+
+def ejecutar(Sesion, ids_notas, hilos, confirmar):
+    pendientes = list(ids_notas)
+    candado = threading.Lock()
+    resultados = {"confirmadas": 0, "rechazadas": 0, "errores": 0}
+
+    def trabajador():
+        session = Sesion()
+        try:
+            while True:
+                with candado:
+                    if not pendientes:
+                        return
+                    id_nota = pendientes.pop()
+                try:
+                    confirmar(session, id_nota)
+                    session.commit()
+                    clave = "confirmadas"
+                except ValueError:
+                    session.rollback()
+                    clave = "rechazadas"
+                except Exception:
+                    session.rollback()
+                    clave = "errores"
+                with candado:
+                    resultados[clave] += 1
+        finally:
+            session.close()
+
+    inicio = time.perf_counter()
+    workers = [threading.Thread(target=trabajador) for _ in range(hilos)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    resultados["segundos"] = time.perf_counter() - inicio
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notas", type=int, default=300)
+    parser.add_argument("--lineas", type=int, default=20)
+    parser.add_argument("--productos", type=int, default=50)
+    parser.add_argument("--hilos", type=int, default=8)
+    args = parser.parse_args()
+
+    url = os.environ["DATABASE_URL"]
+    connect_args = {"timeout": 30, "check_same_thread": False} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args, pool_size=args.hilos, max_overflow=0)
+    Base.metadata.create_all(engine)
+    Sesion = sessionmaker(bind=engine)
+
+    print(f"{engine.dialect.name}: {args.notas} notas x {args.lineas} líneas, {args.hilos} hilos")
+    for etiqueta, confirmar in (("anterior", confirmar_nota_anterior), ("set-based", confirmar_nota)):
+        ids_notas = preparar_datos(Sesion, args.notas, args.lineas, args.productos)
+        r = ejecutar(Sesion, ids_notas, args.hilos, confirmar)
+        session = Sesion()
+        stock_negativo = session.query(func.count()).filter(Producto.stock < 0).scalar()
+        session.close()
+        print(f"  {etiqueta:<10} {args.notas / r['segundos']:8.1f} notas/s  "
+              f"confirmadas={r['confirmadas']} rechazadas={r['rechazadas']} "
+              f"errores={r['errores']} productos_con_stock_negativo={stock_negativo}")
+
+
+if __name__ == "__main__":
+    main()
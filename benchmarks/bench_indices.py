@@ -0,0 +1,118 @@
+"""
+Planes de ejecución antes y después de los índices declarados en db.py.
+
+Crea (o reutiliza) una base con datos sintéticos, elimina los índices
+secundarios para simular una base anterior, registra el plan y el tiempo de
+las consultas frecuentes, aplica db.crear_indices_faltantes y vuelve a medir.
+
+Uso:
+    python benchmarks/bench_indices.py --notas 50000
+    DATABASE_URL=postgresql://... python benchmarks/bench_indices.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+# Sin DATABASE_URL se usa un SQLite temporal
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_indices.db"))
+
+from sqlalchemy import select, insert, text
+from db import (get_engine, Base, Cliente, Producto, NotaVenta, DetalleNotaVenta, Amortizacion,
+                crear_indices_faltantes, inicializar_esquema)
+
+engine = get_engine()
+
+HOY = date(2024, 12, 31)
+
+
+def poblar(notas):
+    rnd = random.Random(7)
+    with engine.begin() as conn:
+        for tabla in reversed(Base.metadata.sorted_tables):
+            conn.execute(tabla.delete())
+        conn.execute(insert(Cliente.__table__), [
+            {"id_cliente": i, "dni": str(10000000 + i), "nombre": f"Cliente {i}"} for i in range(1, 2001)
+        ])
+        conn.execute(insert(Producto.__table__), [
+            {"id_producto": i, "nombre": f"Producto {i}", "costo": 10, "stock": 1000} for i in range(1, 501)
+        ])
+        filas_notas, filas_detalles, filas_amort = [], [], []
+        for n in range(1, notas + 1):
+            cancelada = rnd.random() < 0.7
+            fecha = HOY - timedelta(days=rnd.randrange(730))
+            filas_notas.append({
+                "id_nota": n, "id_cliente": rnd.randrange(1, 2001), "fecha": fecha, "total": 100,
+                "estado": "Cancelado" if cancelada else "Pendiente",
+                "fecha_venta": fecha if cancelada else None,
+                "estado_pedido": rnd.choice(["ABIERTO", "CERRADO", "ENTREGADO"]),
+            })
+            for l in range(3):
+                filas_detalles.append({"id_nota": n, "id_producto": rnd.randrange(1, 501), "cantidad": 1,
+                                       "precio_unitario": 20, "subtotal": 20})
+            if rnd.random() < 0.3:
+                filas_amort.append({"id_nota": n, "monto": 50, "fecha": fecha})
+        conn.execute(insert(NotaVenta.__table__), filas_notas)
+        conn.execute(insert(DetalleNotaVenta.__table__), filas_detalles)
+        conn.execute(insert(Amortizacion.__table__), filas_amort)
+
+
+def consultas():
+    inicio_mes = date(2024, 6, 1)
+    fin_mes = date(2024, 6, 30)
+    return {
+        "reporte de ganancias (estado, fecha_venta)": select(NotaVenta.id_nota).where(
+            NotaVenta.estado == "Cancelado", NotaVenta.fecha_venta.between(inicio_mes, fin_mes)),
+        "notas por cliente": select(NotaVenta.id_nota).where(NotaVenta.id_cliente == 42),
+        "notas por estado_pedido": select(NotaVenta.id_nota).where(NotaVenta.estado_pedido == "ABIERTO")
+                                                             .order_by(NotaVenta.id_nota.desc()).limit(50),
+        "detalles de una nota": select(DetalleNotaVenta.id_detalle).where(DetalleNotaVenta.id_nota == 1234),
+        "detalle (id_nota, id_producto)": select(DetalleNotaVenta.id_detalle).where(
+            DetalleNotaVenta.id_nota == 1234, DetalleNotaVenta.id_producto == 7),
+        "ventas de un producto": select(DetalleNotaVenta.id_nota).where(DetalleNotaVenta.id_producto == 7),
+        "amortizaciones de una nota": select(Amortizacion.monto).where(Amortizacion.id_nota == 1234),
+    }
+
+
+def plan(conn, sql):
+    if engine.dialect.name == "sqlite":
+        return " | ".join(fila[-1] for fila in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    return " | ".join(fila[0].strip() for fila in conn.execute(text("EXPLAIN " + sql)))
+
+
+def medir(etiqueta, repeticiones=20):
+    print(f"\n== {etiqueta} ==")
+    with engine.connect() as conn:
+        for nombre, consulta in consultas().items():
+            sql = str(consulta.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                conn.execute(text(sql)).fetchall()
+            ms = (time.perf_counter() - inicio) * 1000 / repeticiones
+            print(f"{nombre:<45} {ms:9.3f} ms  {plan(conn, sql)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notas", type=int, default=50000)
+    args = parser.parse_args()
+
+    inicializar_esquema()
+    poblar(args.notas)
+    # Simular una base creada antes de declarar los índices
+    with engine.begin() as conn:
+        for tabla in Base.metadata.sorted_tables:
+            for indice in tabla.indexes:
+                indice.drop(conn, checkfirst=True)
+    medir("sin índices secundarios")
+    creados = crear_indices_faltantes()
+    print(f"\nÍndices creados: {', '.join(creados)}")
+    medir("con índices declarados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Serialización de respuestas de 10k filas en la API.
+
+Compara el to_dict anterior (recorre __table__.columns con isinstance por valor
+y deja los Decimal al proveedor JSON por defecto de Flask) con los serializadores
+precompilados de serializadores.py, con el módulo json estándar y con orjson.
+Mide sobre instancias de Producto y sobre filas de una consulta de columnas,
+igual que /api/productos y /api/notas/filtradas.
+
+Uso:
+    python benchmarks/bench_serializacion.py --filas 10000 --repeticiones 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+# Sin DATABASE_URL se usa un SQLite temporal
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_serializacion.db"))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from db import Base, Cliente, Producto, NotaVenta
+import serializadores
+
+
+def to_dict_anterior(obj):
+    # Réplica del to_dict previo de apii.py
+    result = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.name)
+        if isinstance(value, date):
+            result[column.name] = value.isoformat()
+        else:
+            result[column.name] = value
+    return result
+
+
+def preparar(filas):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Cliente.__table__), [{"id_cliente": i, "dni": str(i), "nombre": f"Cliente {i}"}
+                                                 for i in range(1, 101)])
+        conn.execute(insert(Producto.__table__), [
+            {"id_producto": i, "nombre": f"Producto {i}", "costo": Decimal("10.25"), "stock": i % 50,
+             "precio_inicial": Decimal("19.90")} for i in range(1, filas + 1)
+        ])
+        conn.execute(insert(NotaVenta.__table__), [
+            {"id_nota": i, "id_cliente": i % 100 + 1, "total": Decimal("120.50"), "estado": "Cancelado",
+             "fecha_venta": date(2024, 1, 1) + timedelta(days=i % 365)} for i in range(1, filas + 1)
+        ])
+    session = sessionmaker(bind=engine)()
+    productos = session.query(Producto).all()
+    consulta = session.query(NotaVenta.id_nota, NotaVenta.fecha_venta, NotaVenta.total,
+                             Cliente.nombre.label("nombre_cliente")).join(Cliente)
+    notas = consulta.all()
+    return productos, consulta, notas
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        tamanio = funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return min(tiempos), tamanio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    productos, consulta, notas = preparar(args.filas)
+    app_anterior = Flask("anterior")
+    app_anterior.json = DefaultJSONProvider(app_anterior)
+    app_nueva = Flask("nueva")
+    app_nueva.json = serializadores.ProveedorJSON(app_nueva)
+
+    def anterior_productos():
+        with app_anterior.app_context():
+            return len(app_anterior.json.response({'data': [to_dict_anterior(p) for p in productos]}).data)
+
+    def anterior_notas():
+        # Réplica del armado manual de /api/notas/filtradas
+        with app_anterior.app_context():
+            datos = [{'id_nota': n.id_nota, 'fecha_venta': n.fecha_venta.isoformat(),
+                      'total': float(n.total) if n.total else 0, 'nombre_cliente': n.nombre_cliente} for n in notas]
+            return len(app_anterior.json.response({'data': datos}).data)
+
+    def nueva_productos():
+        with app_nueva.app_context():
+            serializar = serializadores.serializador_modelo(Producto)
+            return len(app_nueva.json.response({'data': [serializar(p) for p in productos]}).data)
+
+    def nueva_notas():
+        with app_nueva.app_context():
+            serializar = serializadores.serializador_filas(consulta)
+            return len(app_nueva.json.response({'data': [serializar(n) for n in notas]}).data)
+
+    print(f"{args.filas} filas, mejor de {args.repeticiones} repeticiones")
+    casos = [
+        ("productos", "to_dict anterior + json de Flask", anterior_productos, serializadores.orjson),
+        ("productos", "serializador + json estándar", nueva_productos, None),
+        ("productos", "serializador + orjson", nueva_productos, serializadores.orjson),
+        ("notas", "dicts a mano + json de Flask", anterior_notas, serializadores.orjson),
+        ("notas", "serializador + json estándar", nueva_notas, None),
+        ("notas", "serializador + orjson", nueva_notas, serializadores.orjson),
+    ]
+    for recurso, nombre, funcion, orjson in casos:
+        if "orjson" in nombre and orjson is None:
+            print(f"  {recurso:<10} {nombre:<36} (orjson no instalado)")
+            continue
+        with patch.object(serializadores, "orjson", orjson):
+            ms, tamanio = medir(funcion, args.repeticiones)
+        print(f"  {recurso:<10} {nombre:<36} {ms:8.1f} ms  {tamanio / 1024:8.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
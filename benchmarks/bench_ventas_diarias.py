@@ -0,0 +1,91 @@
+"""
+Reporte de ganancias: recorrido de notas en Python frente a la agregación en SQL
+y al acumulado diario.
+
+Puebla una base sintética, reconstruye ventas_diarias y mide, para un mes y
+para un año, obtener_ventas_por_fecha + calcular_*, obtener_totales_ventas
+y obtener_resumen_ventas.
+
+Uso:
+    python benchmarks/bench_ventas_diarias.py --notas 50000
+    DATABASE_URL=postgresql://... python benchmarks/bench_ventas_diarias.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+# Sin DATABASE_URL se usa un SQLite temporal
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_ventas_diarias.db"))
+
+from sqlalchemy import insert
+from db import get_engine, Base, Cliente, Producto, NotaVenta, DetalleNotaVenta, Session, inicializar_esquema
+from ventas import reconstruir_ventas_diarias
+
+HOY = date(2024, 12, 31)
+
+
+def poblar(notas):
+    rnd = random.Random(7)
+    with get_engine().begin() as conn:
+        for tabla in reversed(Base.metadata.sorted_tables):
+            conn.execute(tabla.delete())
+        conn.execute(insert(Cliente.__table__), [
+            {"id_cliente": i, "dni": str(10000000 + i), "nombre": f"Cliente {i}"} for i in range(1, 501)
+        ])
+        conn.execute(insert(Producto.__table__), [
+            {"id_producto": i, "nombre": f"Producto {i}", "costo": Decimal("10.25"), "stock": 1000}
+            for i in range(1, 501)
+        ])
+        filas_notas, filas_detalles = [], []
+        for n in range(1, notas + 1):
+            fecha = HOY - timedelta(days=rnd.randrange(730))
+            filas_notas.append({"id_nota": n, "id_cliente": rnd.randrange(1, 501), "fecha": fecha, "total": 0,
+                                "estado": "Cancelado", "fecha_venta": fecha, "estado_pedido": "ENTREGADO"})
+            for _ in range(3):
+                cantidad = rnd.randrange(1, 5)
+                filas_detalles.append({"id_nota": n, "id_producto": rnd.randrange(1, 501), "cantidad": cantidad,
+                                       "precio_unitario": Decimal("19.90"), "subtotal": Decimal("19.90") * cantidad})
+        conn.execute(insert(NotaVenta.__table__), filas_notas)
+        conn.execute(insert(DetalleNotaVenta.__table__), filas_detalles)
+
+
+def cronometrar(funcion):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    return (time.perf_counter() - inicio) * 1000, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notas", type=int, default=20000)
+    args = parser.parse_args()
+
+    inicializar_esquema()
+    poblar(args.notas)
+    session = Session()
+    ms, filas = cronometrar(lambda: reconstruir_ventas_diarias(session))
+    session.commit()
+    print(f"Reconstrucción de ventas_diarias: {filas} filas en {ms:.0f} ms")
+
+    import sistema
+    rangos = {"mes": (date(2024, 6, 1), date(2024, 6, 30)), "año": (date(2024, 1, 1), date(2024, 12, 31))}
+    for nombre, (desde, hasta) in rangos.items():
+        def recorrido():
+            ventas = sistema.obtener_ventas_por_fecha(desde, hasta)
+            return sistema.calcular_ganancia(ventas)
+        ms_python, ganancia_python = cronometrar(recorrido)
+        ms_sql, totales = cronometrar(lambda: sistema.obtener_totales_ventas(desde, hasta))
+        ms_acumulado, resumen = cronometrar(lambda: sistema.obtener_resumen_ventas(desde, hasta))
+        print(f"{nombre:<4} recorrido en Python {ms_python:9.1f} ms | SQL {ms_sql:7.1f} ms | "
+              f"acumulado diario {ms_acumulado:7.2f} ms | "
+              f"ganancia {ganancia_python} / {totales['ganancia']} / {resumen['ganancia']}")
+
+
+if __name__ == "__main__":
+    main()
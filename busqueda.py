@@ -0,0 +1,150 @@
+import weakref
+from sqlalchemy import text, table, select, literal_column, func, or_, false, inspect
+from db import Cliente, Producto, NotaVenta
+
+# Búsqueda por texto indexada:
+#  - PostgreSQL: índices GIN de trigramas (pg_trgm) sobre lower(nombre), que
+#    sirven directamente a los LIKE '%texto%'.
+#  - SQLite: tablas FTS5 con tokenizer trigram, sincronizadas por triggers.
+#  - Cualquier otro caso: LIKE sin índice (comportamiento anterior).
+# Una entrada numérica busca por prefijo de la clave primaria en lugar de
+# convertir los ids a texto.
+
+MAX_DIGITOS_ID = 10
+# Estados que la aplicación asigna a NotaVenta.estado
+ESTADOS_NOTA = ("Pendiente", "Cancelado")
+# Las frases FTS5 con trigramas necesitan al menos 3 caracteres
+MIN_CARACTERES_FTS = 3
+
+# tabla -> (tabla FTS, columna id)
+_TABLAS_FTS = {
+    'clientes': ('clientes_fts', 'id_cliente'),
+    'productos': ('productos_fts', 'id_producto'),
+}
+
+_modos = weakref.WeakKeyDictionary()
+
+
+def _engine_de(session_o_bind):
+    bind = session_o_bind.get_bind() if hasattr(session_o_bind, 'get_bind') else session_o_bind
+    return getattr(bind, 'engine', bind)
+
+
+def modo_busqueda(session):
+    """
+    Devuelve 'trigram', 'fts5' o 'like' según el motor y los objetos creados
+    por preparar_busqueda. El resultado se guarda por engine.
+    """
+    engine = _engine_de(session)
+    modo = _modos.get(engine)
+    if modo is None:
+        if engine.dialect.name == 'postgresql':
+            modo = 'trigram'
+        elif engine.dialect.name == 'sqlite' and inspect(engine).has_table('clientes_fts'):
+            modo = 'fts5'
+        else:
+            modo = 'like'
+        _modos[engine] = modo
+    return modo
+
+
+def preparar_busqueda(bind):
+    """
+    Crea los índices de búsqueda en una base existente (idempotente).
+    En SQLite además reconstruye las tablas FTS5 a partir de los datos actuales.
+    """
+    engine = _engine_de(bind)
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for tabla in _TABLAS_FTS:
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{tabla}_nombre_trgm "
+                    f"ON {tabla} USING gin (lower(nombre) gin_trgm_ops)"
+                ))
+        elif engine.dialect.name == 'sqlite':
+            for tabla, (fts, id_col) in _TABLAS_FTS.items():
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"nombre, content='{tabla}', content_rowid='{id_col}', tokenize='trigram')"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabla} BEGIN "
+                    f"INSERT INTO {fts}(rowid, nombre) VALUES (new.{id_col}, new.nombre); END"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabla} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, nombre) VALUES ('delete', old.{id_col}, old.nombre); END"
+                ))
+                # Solo al cambiar el nombre (no en cada UPDATE de stock o estado); se recrea
+                # para reemplazar el trigger de bases preparadas con versiones anteriores
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {fts}_au"))
+                conn.execute(text(
+                    f"CREATE TRIGGER {fts}_au AFTER UPDATE OF nombre ON {tabla} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, nombre) VALUES ('delete', old.{id_col}, old.nombre); "
+                    f"INSERT INTO {fts}(rowid, nombre) VALUES (new.{id_col}, new.nombre); END"
+                ))
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    _modos.pop(engine, None)
+
+
+def es_numerico(texto):
+    return bool(texto) and texto.strip().isdigit()
+
+
+def filtro_id_prefijo(columna_id, digitos, max_digitos=MAX_DIGITOS_ID):
+    """
+    Ids cuya representación decimal empieza con `digitos`, expresados como
+    rangos sobre la clave primaria (12 -> 12, 120..129, 1200..1299, ...).
+    """
+    digitos = digitos.strip()
+    if digitos.startswith('0'):
+        return false()
+    base = int(digitos)
+    condiciones = [columna_id == base]
+    for extra in range(1, max_digitos - len(digitos) + 1):
+        factor = 10 ** extra
+        condiciones.append(columna_id.between(base * factor, base * factor + factor - 1))
+    return or_(*condiciones)
+
+
+def filtro_nombre(session, columna_id, columna_nombre, texto):
+    """
+    Condición de "nombre contiene texto" que usa el índice disponible.
+
+    :param columna_id: Columna que se compara con los ids encontrados en FTS5; puede ser
+                       la clave foránea (p. ej. NotaVenta.id_cliente) para no depender del JOIN.
+    :param columna_nombre: Columna de texto en la que se busca.
+    """
+    tabla = columna_nombre.table.name
+    if modo_busqueda(session) == 'fts5' and len(texto) >= MIN_CARACTERES_FTS and tabla in _TABLAS_FTS:
+        fts = _TABLAS_FTS[tabla][0]
+        frase = '"' + texto.replace('"', '""') + '"'
+        ids = select(literal_column('rowid')).select_from(table(fts)) \
+                                             .where(literal_column(fts).op('MATCH')(frase))
+        return columna_id.in_(ids)
+    return func.lower(columna_nombre).like(f"%{texto.lower()}%")
+
+
+def filtro_notas(session, texto):
+    """
+    Filtro del buscador de notas: id de nota (por prefijo) si el texto es
+    numérico; si no, nombre del cliente o estado de la nota.
+    """
+    if es_numerico(texto):
+        return filtro_id_prefijo(NotaVenta.id_nota, texto)
+    condiciones = [filtro_nombre(session, NotaVenta.id_cliente, Cliente.nombre, texto)]
+    # El estado tiene pocos valores: se resuelven en memoria y se filtra por igualdad (índice)
+    estados = [estado for estado in ESTADOS_NOTA if texto.lower() in estado.lower()]
+    if estados:
+        condiciones.append(NotaVenta.estado.in_(estados))
+    return or_(*condiciones)
+
+
+def filtro_productos(session, texto):
+    """
+    Filtro del buscador de productos: id por prefijo o nombre.
+    """
+    if es_numerico(texto):
+        return filtro_id_prefijo(Producto.id_producto, texto)
+    return filtro_nombre(session, Producto.id_producto, Producto.nombre, texto)
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from db import Producto, escuchar_cambios_catalogo, version_catalogo
+from serializadores import serializador_modelo
+
+# Cache en memoria del proceso para las filas de productos que lee la API
+# (GET /api/productos/{id} y la verificación de productos al crear notas).
+# Cada commit que escribe productos en este proceso invalida las entradas afectadas
+# (db.escuchar_cambios_catalogo). Cada entrada guarda además la versión del catálogo
+# (db.version_catalogo) con la que se leyó: cuando una petición lee una versión más
+# nueva, escrita por otro proceso (otro worker, el sistema de escritorio), las
+# entradas anteriores dejan de servirse. Así GET /api/productos/{id} nunca responde
+# una fila vieja con el ETag de la versión nueva.
+# El stock de una entrada es orientativo: confirmar una venta siempre lo vuelve a
+# verificar en la base con un UPDATE condicionado.
+
+
+class CacheLRU:
+    """
+    Cache acotado: descarta la entrada usada hace más tiempo al llenarse y las
+    entradas con más de ttl_segundos. Seguro entre hilos.
+
+    Para no guardar un valor leído antes de una invalidación concurrente, se toma
+    la generación antes de leer de la base y se la pasa a guardar.
+
+    Cada entrada lleva la versión de los datos con la que se leyó; self.version es la
+    más nueva que informaron las lecturas, y las entradas anteriores se consideran vencidas.
+    """
+
+    def __init__(self, tamanio_maximo, ttl_segundos, reloj=time.monotonic):
+        self.tamanio_maximo = tamanio_maximo
+        self.ttl_segundos = ttl_segundos
+        self._reloj = reloj
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.generacion = 0
+        self.version = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+        self.invalidaciones = 0
+
+    def obtener_muchos(self, claves, version=None):
+        """
+        :param claves: Iterable de claves.
+        :param version: Versión actual de los datos, si se conoce; las entradas leídas
+                        con una versión anterior se descartan.
+        :return: ({clave: valor} de las encontradas vigentes, lista de claves faltantes).
+        """
+        encontrados, faltantes = {}, []
+        ahora = self._reloj()
+        with self._lock:
+            if version is not None and version > self.version:
+                self.version = version
+            for clave in claves:
+                entrada = self._datos.get(clave)
+                if entrada is not None and entrada[0] > ahora and entrada[1] >= self.version:
+                    self._datos.move_to_end(clave)
+                    encontrados[clave] = entrada[2]
+                    self.aciertos += 1
+                else:
+                    if entrada is not None:
+                        del self._datos[clave]
+                    faltantes.append(clave)
+                    self.fallos += 1
+        return encontrados, faltantes
+
+    def guardar(self, clave, valor, generacion, version):
+        """
+        Guarda el valor salvo que haya habido una invalidación desde que se tomó la
+        generación o que ya se conozca una versión más nueva de los datos.
+
+        :param generacion: Valor de self.generacion antes de leer el valor de la base.
+        :param version: Versión de los datos leída antes que el valor, en la misma transacción.
+        """
+        if self.tamanio_maximo <= 0:
+            return
+        with self._lock:
+            if generacion != self.generacion or version < self.version:
+                return
+            self._datos[clave] = (self._reloj() + self.ttl_segundos, version, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.tamanio_maximo:
+                self._datos.popitem(last=False)
+                self.descartes += 1
+
+    def invalidar(self, claves=None):
+        """
+        :param claves: Claves a descartar, o None para vaciar el cache (y olvidar la
+                       versión conocida, p. ej. al cambiar de base).
+        """
+        with self._lock:
+            self.generacion += 1
+            self.invalidaciones += 1
+            if claves is None:
+                self._datos.clear()
+                self.version = 0
+            else:
+                for clave in claves:
+                    self._datos.pop(clave, None)
+
+    def estadisticas(self):
+        """Contadores del cache, para /api/health."""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._datos),
+                'tamanio_maximo': self.tamanio_maximo,
+                'version': self.version,
+                'ttl_segundos': self.ttl_segundos,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else None,
+                'descartes': self.descartes,
+                'invalidaciones': self.invalidaciones,
+            }
+
+
+cache_productos = CacheLRU(
+    tamanio_maximo=int(os.getenv('API_CACHE_PRODUCTOS_TAMANIO', 10000)),
+    ttl_segundos=float(os.getenv('API_CACHE_PRODUCTOS_TTL_SEGUNDOS', 30)),
+)
+escuchar_cambios_catalogo(cache_productos.invalidar)
+
+
+def productos_cacheados(session, ids_productos, version=None):
+    """
+    Productos por ID como diccionarios serializados (los de GET /api/productos/{id}),
+    leyendo de la base en una sola consulta IN solo los que no están en el cache.
+    Los diccionarios se comparten entre peticiones: no deben modificarse.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param ids_productos: Iterable de IDs (se ignoran los repetidos).
+    :param version: Versión del catálogo ya leída en esta transacción (p. ej. la del
+                    ETag); si falta y hay que ir a la base, se lee antes que los productos.
+    :return: Diccionario {id_producto: dict}; los IDs inexistentes no figuran.
+    """
+    encontrados, faltantes = cache_productos.obtener_muchos(set(ids_productos), version)
+    if not faltantes:
+        return encontrados
+    generacion = cache_productos.generacion
+    if version is None:
+        version = version_catalogo(session)[0]
+    productos = session.query(Producto).filter(Producto.id_producto.in_(faltantes)).all()
+    # Con productos escritos y sin commit en esta sesión (ya volcados por el autoflush)
+    # se devuelven sin guardarlos en el cache
+    guardar = not session.info.get('catalogo_modificado')
+    serializar = serializador_modelo(Producto)
+    for producto in productos:
+        fila = serializar(producto)
+        if guardar:
+            cache_productos.guardar(producto.id_producto, fila, generacion, version)
+        encontrados[producto.id_producto] = fila
+    return encontrados
+
+
+def precargar_productos(session, limite):
+    """
+    Carga en el cache hasta `limite` productos (los de menor ID), por ejemplo al
+    arrancar un worker antes de recibir tráfico.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param limite: Máximo de productos a cargar (se acota al tamaño del cache).
+    :return: Cantidad de productos cargados.
+    """
+    limite = min(limite, cache_productos.tamanio_maximo)
+    if limite <= 0:
+        return 0
+    generacion = cache_productos.generacion
+    version = version_catalogo(session)[0]
+    serializar = serializador_modelo(Producto)
+    productos = session.query(Producto).order_by(Producto.id_producto).limit(limite).all()
+    for producto in productos:
+        cache_productos.guardar(producto.id_producto, serializar(producto), generacion, version)
+    return len(productos)
@@ -0,0 +1,104 @@
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se ofrece gzip
+    brotli = None
+
+# Compresión negociada (Accept-Encoding) de las respuestas de la API. Las respuestas
+# completas se comprimen si superan el umbral; las transmitidas por partes (CSV del
+# reporte, NDJSON) se comprimen fragmento a fragmento sin acumularlas.
+
+TIPOS_COMPRIMIBLES = ("application/json", "application/x-ndjson", "text/")
+
+
+def configuracion_compresion():
+    """
+    Parámetros leídos del entorno:
+    API_COMPRESION_MIN_BYTES (umbral, por defecto 1024), API_COMPRESION_NIVEL_GZIP (1-9, por defecto 6)
+    y API_COMPRESION_NIVEL_BROTLI (0-11, por defecto 5).
+    """
+    return {
+        'min_bytes': int(os.getenv('API_COMPRESION_MIN_BYTES', 1024)),
+        'nivel_gzip': int(os.getenv('API_COMPRESION_NIVEL_GZIP', 6)),
+        'nivel_brotli': int(os.getenv('API_COMPRESION_NIVEL_BROTLI', 5)),
+    }
+
+
+def _codificacion_aceptada():
+    codificaciones = ["br", "gzip"] if brotli is not None else ["gzip"]
+    # best_match respeta los q=0 y, a igual calidad, el orden de preferencia del servidor
+    return request.accept_encodings.best_match(codificaciones)
+
+
+class _Compresor:
+    """Compresor incremental con la misma interfaz para gzip y brotli."""
+    def __init__(self, codificacion, config):
+        if codificacion == "br":
+            self._compresor = brotli.Compressor(quality=config['nivel_brotli'])
+            self._comprimir, self._vaciar, self._terminar = (
+                self._compresor.process, self._compresor.flush, self._compresor.finish)
+        else:
+            # wbits=31: formato gzip (cabecera y CRC) en lugar de zlib
+            self._compresor = zlib.compressobj(config['nivel_gzip'], zlib.DEFLATED, 31)
+            self._comprimir = self._compresor.compress
+            self._vaciar = lambda: self._compresor.flush(zlib.Z_SYNC_FLUSH)
+            self._terminar = self._compresor.flush
+
+    def comprimir(self, datos):
+        return self._comprimir(datos) + self._terminar()
+
+    def fragmentos(self, iterable):
+        # Cada fragmento se vacía para que el cliente lo reciba sin esperar al final
+        for fragmento in iterable:
+            if isinstance(fragmento, str):
+                fragmento = fragmento.encode("utf-8")
+            if fragmento:
+                yield self._comprimir(fragmento) + self._vaciar()
+        yield self._terminar()
+
+
+def _es_comprimible(respuesta):
+    return (
+        200 <= respuesta.status_code < 300 and respuesta.status_code != 204
+        and not respuesta.direct_passthrough  # send_file: archivos (XLSX ya es un zip)
+        and 'Content-Encoding' not in respuesta.headers
+        and (respuesta.mimetype or '').startswith(TIPOS_COMPRIMIBLES)
+    )
+
+
+def instalar_compresion(app):
+    """
+    Registra en la app Flask la compresión gzip / brotli de las respuestas.
+
+    :param app: Aplicación Flask.
+    """
+    config = configuracion_compresion()
+
+    @app.after_request
+    def comprimir_respuesta(respuesta):
+        if not _es_comprimible(respuesta):
+            return respuesta
+        respuesta.vary.add('Accept-Encoding')
+        codificacion = _codificacion_aceptada()
+        if codificacion is None:
+            return respuesta
+        compresor = _Compresor(codificacion, config)
+        if respuesta.is_streamed:
+            respuesta.response = compresor.fragmentos(respuesta.response)
+            respuesta.headers.pop('Content-Length', None)
+        else:
+            datos = respuesta.get_data()
+            if len(datos) < config['min_bytes']:
+                return respuesta
+            respuesta.set_data(compresor.comprimir(datos))
+        respuesta.headers['Content-Encoding'] = codificacion
+        # La representación comprimida no es idéntica byte a byte: el ETag pasa a ser débil
+        etag, debil = respuesta.get_etag()
+        if etag and not debil:
+            respuesta.set_etag(etag, weak=True)
+        return respuesta
+
+    return comprimir_respuesta
@@ -1,16 +1,277 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, DECIMAL, Text, TIMESTAMP
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy import create_engine, event, inspect, select, insert, update, delete, func, Column, Integer, String, Date, ForeignKey, DECIMAL, Text, TIMESTAMP, Index
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import relationship, sessionmaker, attributes, Session as SesionSQLAlchemy
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from datetime import date
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from bisect import bisect_left
+from datetime import date, datetime, timezone
 from dotenv import load_dotenv
 import os
+import threading
+import time
 load_dotenv()
 
 
 Base = declarative_base()
 
-engine = create_engine(os.getenv("DATABASE_URL"))
-Session = sessionmaker(bind=engine)
+# Límites (en ms) de los buckets del histograma de espera al pedir una conexión
+BUCKETS_ESPERA_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Histograma:
+    """Histograma acumulativo thread-safe (buckets fijos + suma, cantidad y máximo)."""
+    def __init__(self, limites):
+        self.limites = tuple(limites)
+        self._lock = threading.Lock()
+        self._cuentas = [0] * (len(self.limites) + 1)
+        self.suma = 0.0
+        self.cantidad = 0
+        self.maximo = 0.0
+
+    def registrar(self, valor):
+        indice = bisect_left(self.limites, valor)
+        with self._lock:
+            self._cuentas[indice] += 1
+            self.suma += valor
+            self.cantidad += 1
+            if valor > self.maximo:
+                self.maximo = valor
+
+    def resumen(self):
+        with self._lock:
+            cuentas = list(self._cuentas)
+            suma, cantidad, maximo = self.suma, self.cantidad, self.maximo
+        etiquetas = [str(limite) for limite in self.limites] + ['+Inf']
+        return {
+            'buckets': dict(zip(etiquetas, cuentas)),
+            'suma': suma,
+            'cantidad': cantidad,
+            'maximo': maximo,
+        }
+
+class PoolMedido(QueuePool):
+    """
+    QueuePool que mide cuánto espera cada checkout por un lugar libre en el pool
+    (sin contar el tiempo de abrir una conexión nueva) y cuántos agotan el timeout.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.esperas_ms = Histograma(BUCKETS_ESPERA_MS)
+        self.timeouts = 0
+        # Segundos que el checkout en curso de cada hilo pasó abriendo conexiones
+        self._conectando = threading.local()
+
+    def _create_connection(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            self._conectando.segundos = getattr(self._conectando, 'segundos', 0.0) + time.perf_counter() - inicio
+
+    def _do_get(self):
+        self._conectando.segundos = 0.0
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            espera = time.perf_counter() - inicio - self._conectando.segundos
+            self.esperas_ms.registrar(max(espera, 0.0) * 1000)
+
+class PoolMedidoAsync(PoolMedido, AsyncAdaptedQueuePool):
+    """PoolMedido para el engine asíncrono de la API ASGI."""
+
+def _env_bool(nombre, defecto):
+    valor = os.getenv(nombre)
+    if valor is None:
+        return defecto
+    return valor.strip().lower() in ('1', 'true', 'si', 'sí', 'yes', 'on')
+
+def configuracion_pool():
+    """
+    Parámetros del pool leídos del entorno (los valores por defecto son los de SQLAlchemy):
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (s), DB_POOL_RECYCLE (s),
+    DB_POOL_PRE_PING y DB_STATEMENT_TIMEOUT_MS (0 = sin límite).
+    """
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', -1)),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', False),
+        'statement_timeout_ms': int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0)),
+    }
+
+def _sqlite_en_memoria(url):
+    # sqlite:// y sqlite:///:memory: no tienen archivo: cada conexión nueva sería otra base vacía
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def crear_engine(url=None):
+    """Crea el engine con el pool configurado desde el entorno."""
+    url = url or os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("La variable de entorno DATABASE_URL no está definida")
+    config = configuracion_pool()
+    statement_timeout_ms = config.pop('statement_timeout_ms')
+    kwargs = {'pool_pre_ping': config['pool_pre_ping'], 'pool_recycle': config['pool_recycle']}
+    if not _sqlite_en_memoria(url):
+        # SQLite en memoria vive en una sola conexión; el resto usa el pool medido
+        kwargs.update(poolclass=PoolMedido, pool_size=config['pool_size'],
+                      max_overflow=config['max_overflow'], pool_timeout=config['pool_timeout'])
+        if url.startswith('sqlite'):
+            kwargs['connect_args'] = {'check_same_thread': False}
+    nuevo_engine = create_engine(url, **kwargs)
+    _limitar_sentencias(nuevo_engine, statement_timeout_ms)
+    return nuevo_engine
+
+def _limitar_sentencias(nuevo_engine, statement_timeout_ms):
+    # Límite de duración de cada sentencia, fijado al abrir cada conexión
+    if not statement_timeout_ms:
+        return
+
+    @event.listens_for(nuevo_engine, 'connect')
+    def _fijar_statement_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if nuevo_engine.dialect.name == 'postgresql':
+            cursor.execute(f"SET statement_timeout = {statement_timeout_ms}")
+        elif nuevo_engine.dialect.name == 'mysql':
+            cursor.execute(f"SET SESSION max_execution_time = {statement_timeout_ms}")
+        cursor.close()
+
+# Driver asíncrono que usa la API ASGI (apii_async.py) para cada motor de DATABASE_URL
+DRIVERS_ASYNC = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg', 'mysql': 'aiomysql'}
+
+def url_async(url):
+    """
+    URL equivalente con driver asíncrono (postgresql://... -> postgresql+asyncpg://...).
+    Si la URL ya indica un driver asíncrono se respeta.
+    """
+    url = make_url(url)
+    if url.get_dialect().is_async:
+        return url
+    backend = url.get_backend_name()
+    if backend not in DRIVERS_ASYNC:
+        raise RuntimeError(f"No hay un driver asíncrono configurado para {backend}")
+    return url.set(drivername=f"{backend}+{DRIVERS_ASYNC[backend]}")
+
+def crear_engine_async(url=None):
+    """
+    Crea el AsyncEngine de la API ASGI con la misma configuración de pool que crear_engine.
+    Requiere sqlalchemy[asyncio] (greenlet) y el driver asíncrono del motor.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = url or os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("La variable de entorno DATABASE_URL no está definida")
+    config = configuracion_pool()
+    kwargs = {'pool_pre_ping': config['pool_pre_ping'], 'pool_recycle': config['pool_recycle']}
+    if not _sqlite_en_memoria(url):
+        kwargs.update(poolclass=PoolMedidoAsync, pool_size=config['pool_size'],
+                      max_overflow=config['max_overflow'], pool_timeout=config['pool_timeout'])
+    nuevo_engine = create_async_engine(url_async(url), **kwargs)
+    _limitar_sentencias(nuevo_engine.sync_engine, config['statement_timeout_ms'])
+    return nuevo_engine
+
+def estadisticas_pool(bind=None):
+    """
+    Estado del pool de conexiones para la API Flask y la GUI:
+    conexiones prestadas, overflow, checkouts, timeouts e histograma de espera (ms).
+    """
+    pool = (bind or get_engine()).pool
+    estadisticas = {'clase': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        estadisticas.update(
+            tamanio=pool.size(),
+            en_uso=pool.checkedout(),
+            disponibles=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    if isinstance(pool, PoolMedido):
+        estadisticas.update(
+            checkouts=pool.esperas_ms.cantidad,
+            timeouts=pool.timeouts,
+            espera_ms=pool.esperas_ms.resumen(),
+        )
+    return estadisticas
+
+# El engine se crea en el primer uso y no al importar el módulo: importar db
+# (API, GUI, tests) no abre conexiones ni falla si la base aún no está disponible.
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Devuelve el engine de la aplicación, creándolo en la primera llamada."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = crear_engine()
+    return _engine
+
+_engine_async = None
+
+def get_engine_async():
+    """Devuelve el AsyncEngine de la API ASGI, creándolo en la primera llamada."""
+    global _engine_async
+    if _engine_async is None:
+        with _engine_lock:
+            if _engine_async is None:
+                _engine_async = crear_engine_async()
+    return _engine_async
+
+def descartar_engines(cerrar=True):
+    """
+    Descarta los engines creados; el próximo uso crea engines nuevos.
+
+    :param cerrar: Cerrar las conexiones del pool. Después de un fork debe ser False:
+                   las conexiones heredadas son del proceso padre, que las sigue usando.
+    """
+    global _engine, _engine_async
+    engines = [motor for motor in (_engine, _engine_async and _engine_async.sync_engine) if motor is not None]
+    _engine = _engine_async = None
+    for motor in engines:
+        motor.dispose(close=cerrar)
+
+def _reiniciar_tras_fork():
+    # En el hijo el lock puede haber quedado tomado por otro hilo del padre
+    global _engine_lock
+    _engine_lock = threading.Lock()
+    descartar_engines(cerrar=False)
+
+# Cada proceso creado con fork (workers de servidor.py, multiprocessing) arma su propio
+# pool: una conexión compartida entre procesos mezcla los mensajes de ambos en el socket.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+def __getattr__(nombre):
+    # Compatibilidad: db.engine sigue disponible y se resuelve en el primer acceso
+    if nombre == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
+class SesionPerezosa(SesionSQLAlchemy):
+    """Sesión sin bind explícito que toma el engine recién al ejecutar la primera consulta."""
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
+
+Session = sessionmaker(class_=SesionPerezosa)
+
+class SesionPerezosaAsync(SesionSQLAlchemy):
+    """
+    Sesión interna de las AsyncSession de la API ASGI (sync_session_class): toma el
+    engine asíncrono recién al ejecutar la primera consulta.
+    """
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine_async().sync_engine
+        return super().get_bind(*args, **kwargs)
+
 class Cliente(Base):
     __tablename__ = 'clientes'
     id_cliente = Column(Integer, primary_key=True)
@@ -39,6 +300,9 @@ class Amortizacion(Base):
     fecha = Column(Date, default=date.today)
     # Relación con la nota de venta
     nota = relationship("NotaVenta", back_populates="amortizaciones")
+    __table_args__ = (
+        Index('ix_amortizaciones_id_nota', 'id_nota'),
+    )
 class NotaVenta(Base):
     __tablename__ = 'notas_venta'
     id_nota = Column(Integer, primary_key=True)
@@ -49,10 +313,19 @@ class NotaVenta(Base):
     fecha_venta = Column(Date)
     observaciones = Column(Text, nullable=True) #agregado
     estado_pedido = Column(String, nullable=True) #agregado
+    # total menos amortizaciones; lo mantienen los eventos de sesión de más abajo
+    saldo = Column(DECIMAL, nullable=True)
     # Relaciones
     cliente = relationship("Cliente", back_populates="notas")
     amortizaciones = relationship("Amortizacion", back_populates="nota", cascade="all, delete")  # Eliminación en cascada
     detalles = relationship("DetalleNotaVenta", back_populates="nota", cascade="all, delete")    # Eliminación en cascada
+    # Índices para los filtros frecuentes (reporte de ganancias, listados y búsquedas por cliente)
+    __table_args__ = (
+        Index('ix_notas_venta_estado_fecha_venta', 'estado', 'fecha_venta'),
+        Index('ix_notas_venta_fecha_venta', 'fecha_venta'),
+        Index('ix_notas_venta_estado_pedido', 'estado_pedido'),
+        Index('ix_notas_venta_id_cliente', 'id_cliente'),
+    )
 class DetalleNotaVenta(Base):
     __tablename__ = 'detalle_nota_venta'
     id_detalle = Column(Integer, primary_key=True)
@@ -63,9 +336,331 @@ class DetalleNotaVenta(Base):
     color = Column(String)
     talla = Column(String)
     subtotal = Column(DECIMAL)
+    costo_unitario = Column(DECIMAL, nullable=True)  # Costo del producto al confirmar la venta (None si no está vendida)
     # Relaciones
     nota = relationship("NotaVenta", back_populates="detalles")
     producto = relationship("Producto")
+    # (id_nota, id_producto) cubre también las búsquedas solo por id_nota
+    __table_args__ = (
+        Index('ix_detalle_nota_venta_id_nota_id_producto', 'id_nota', 'id_producto'),
+        Index('ix_detalle_nota_venta_id_producto', 'id_producto'),
+    )
+class VentaDiaria(Base):
+    # Acumulado de ventas confirmadas por día y producto; lo mantienen ventas.confirmar_nota y
+    # las ediciones de notas vendidas de sistema.py en la misma transacción, y se reconstruye
+    # con "python db.py ventas_diarias"
+    __tablename__ = 'ventas_diarias'
+    fecha_venta = Column(Date, primary_key=True)
+    id_producto = Column(Integer, ForeignKey('productos.id_producto'), primary_key=True)
+    unidades = Column(Integer, nullable=False, default=0)
+    ingresos = Column(DECIMAL, nullable=False, default=0)  # precio_unitario * cantidad
+    costo = Column(DECIMAL, nullable=False, default=0)     # DetalleNotaVenta.costo_unitario * cantidad
+    producto = relationship("Producto")
+class VersionCatalogo(Base):
+    # Contador que se incrementa con cada escritura de productos (altas, cambios, bajas y
+    # descuentos de stock); la API lo usa como ETag sin consultar la tabla de productos
+    __tablename__ = 'versiones_catalogo'
+    nombre = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    actualizado = Column(TIMESTAMP, nullable=True)  # UTC
+class ClaveIdempotencia(Base):
+    # Respuesta de una petición POST enviada con cabecera Idempotency-Key: los reintentos con
+    # la misma clave la reciben sin repetir la transacción (ver idempotencia.py)
+    __tablename__ = 'claves_idempotencia'
+    clave = Column(String(255), primary_key=True)
+    huella = Column(String(64), nullable=False)      # sha256 de método, ruta y cuerpo
+    estado_http = Column(Integer, nullable=True)     # None mientras la petición original está en curso
+    respuesta = Column(Text, nullable=True)
+    expira = Column(TIMESTAMP, nullable=False)       # UTC
+    # La purga borra por rango de expiración
+    __table_args__ = (
+        Index('ix_claves_idempotencia_expira', 'expira'),
+    )
+
+def _saldo_calculado():
+    # total - suma de amortizaciones de la nota, como subconsulta correlacionada
+    amortizado = (
+        select(func.coalesce(func.sum(Amortizacion.monto), 0))
+        .where(Amortizacion.id_nota == NotaVenta.id_nota)
+        .scalar_subquery()
+    )
+    return func.coalesce(NotaVenta.total, 0) - amortizado
+
+def recalcular_saldos(conexion, ids_notas=None):
+    """
+    Recalcula NotaVenta.saldo desde total y amortizaciones en un solo UPDATE.
+
+    :param conexion: Connection o Session donde ejecutar el UPDATE.
+    :param ids_notas: IDs de las notas a recalcular (None = todas).
+    """
+    sentencia = update(NotaVenta.__table__).values(saldo=_saldo_calculado())
+    if ids_notas is not None:
+        sentencia = sentencia.where(NotaVenta.id_nota.in_(ids_notas))
+    conexion.execute(sentencia)
+
+def fijar_costos_unitarios(conexion, ids_notas=None):
+    """
+    Guarda en DetalleNotaVenta.costo_unitario el costo actual del producto de las
+    líneas que todavía no lo tienen, en un solo UPDATE. Se ejecuta al confirmar la
+    venta: desde entonces el costo de la línea no cambia aunque cambie el del producto.
+
+    :param conexion: Connection o Session donde ejecutar el UPDATE.
+    :param ids_notas: IDs de las notas (None = todas las notas vendidas).
+    """
+    if ids_notas is None:
+        ids_notas = select(NotaVenta.id_nota).where(NotaVenta.estado == "Cancelado")
+    detalles = DetalleNotaVenta.__table__
+    conexion.execute(
+        update(detalles)
+        .where(detalles.c.id_nota.in_(ids_notas), detalles.c.costo_unitario.is_(None))
+        .values(costo_unitario=select(Producto.costo)
+                .where(Producto.id_producto == detalles.c.id_producto)
+                .scalar_subquery())
+    )
+
+def saldos_por_nota(session, ids_notas):
+    """
+    Saldo pendiente de varias notas en una sola consulta.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param ids_notas: Iterable de IDs de nota.
+    :return: Diccionario {id_nota: saldo}; las notas inexistentes no aparecen.
+    """
+    ids = set(ids_notas)
+    if not ids:
+        return {}
+    filas = session.execute(select(NotaVenta.id_nota, NotaVenta.saldo).where(NotaVenta.id_nota.in_(ids)))
+    return dict(filas.all())
+
+def _notas_con_saldo_afectado(session):
+    # Notas cuyo total cambió o que ganaron, perdieron o modificaron amortizaciones en este flush
+    ids = set()
+    for obj in session.new:
+        if isinstance(obj, NotaVenta):
+            ids.add(obj.id_nota)
+    for obj in session.dirty:
+        if isinstance(obj, NotaVenta) and attributes.get_history(obj, 'total').has_changes():
+            ids.add(obj.id_nota)
+        elif isinstance(obj, Amortizacion):
+            historial_nota = attributes.get_history(obj, 'id_nota')
+            if historial_nota.has_changes() or attributes.get_history(obj, 'monto').has_changes():
+                ids.update(historial_nota.sum())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Amortizacion):
+            ids.add(obj.id_nota)
+    ids.discard(None)
+    return ids
+
+@event.listens_for(SesionSQLAlchemy, 'after_flush')
+def _registrar_saldos_pendientes(session, flush_context):
+    ids = _notas_con_saldo_afectado(session)
+    if ids:
+        session.info.setdefault('saldos_pendientes', set()).update(ids)
+
+@event.listens_for(SesionSQLAlchemy, 'after_flush_postexec')
+def _actualizar_saldos(session, flush_context):
+    ids = session.info.pop('saldos_pendientes', None)
+    if not ids:
+        return
+    recalcular_saldos(session.connection(), ids)
+    # Las instancias ya cargadas vuelven a leer el saldo en el próximo acceso
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, NotaVenta) and obj.id_nota in ids:
+            session.expire(obj, ['saldo'])
+
+CATALOGO_PRODUCTOS = 'productos'
+
+def version_catalogo(conexion, nombre=CATALOGO_PRODUCTOS):
+    """
+    Versión actual de un catálogo y el momento (UTC) de su último cambio.
+
+    :param conexion: Connection o Session donde leer.
+    :return: Tupla (version, actualizado); (0, None) si el catálogo nunca cambió.
+    """
+    fila = conexion.execute(
+        select(VersionCatalogo.version, VersionCatalogo.actualizado).where(VersionCatalogo.nombre == nombre)
+    ).first()
+    return tuple(fila) if fila else (0, None)
+
+def incrementar_version_catalogo(conexion, nombre=CATALOGO_PRODUCTOS):
+    """
+    Incrementa la versión del catálogo dentro de la transacción en curso.
+
+    :param conexion: Connection o Session donde ejecutar.
+    """
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    resultado = conexion.execute(
+        update(VersionCatalogo.__table__)
+        .where(VersionCatalogo.nombre == nombre)
+        .values(version=VersionCatalogo.version + 1, actualizado=ahora)
+    )
+    if resultado.rowcount == 0:
+        conexion.execute(insert(VersionCatalogo.__table__).values(nombre=nombre, version=1, actualizado=ahora))
+
+# Funciones a llamar después de cada commit que modificó productos (ver escuchar_cambios_catalogo)
+_oyentes_catalogo = []
+
+def marcar_catalogo_modificado(session, ids_productos=None):
+    """
+    Marca que la transacción de la sesión escribió productos: la versión del
+    catálogo se incrementa al hacer commit. Los flush que escriben productos lo
+    marcan solos; las escrituras masivas (UPDATE sobre productos) deben llamarlo.
+
+    :param session: Sesión SQLAlchemy de la transacción.
+    :param ids_productos: IDs de los productos escritos, o None si no se conocen
+                          (los oyentes invalidan entonces todo el catálogo).
+    """
+    session.info['catalogo_modificado'] = True
+    modificados = session.info.get('productos_modificados', set())
+    if ids_productos is None or modificados is None:
+        session.info['productos_modificados'] = None
+    else:
+        modificados.update(ids_productos)
+        session.info['productos_modificados'] = modificados
+
+def escuchar_cambios_catalogo(funcion):
+    """
+    Registra una función que se llama después de cada commit que escribió productos,
+    en el proceso que hizo el commit (p. ej. para invalidar un cache en memoria).
+
+    :param funcion: Recibe el conjunto de IDs de productos escritos, o None si no se conocen.
+    :return: La misma función, para usarla como decorador.
+    """
+    _oyentes_catalogo.append(funcion)
+    return funcion
+
+@event.listens_for(SesionSQLAlchemy, 'after_flush')
+def _registrar_cambios_catalogo(session, flush_context):
+    escritos = [obj.id_producto for obj in session.new if isinstance(obj, Producto)]
+    escritos += [obj.id_producto for obj in session.deleted if isinstance(obj, Producto)]
+    escritos += [obj.id_producto for obj in session.dirty
+                 if isinstance(obj, Producto) and session.is_modified(obj)]
+    if escritos:
+        marcar_catalogo_modificado(session, escritos)
+
+@event.listens_for(SesionSQLAlchemy, 'before_commit')
+def _incrementar_version_catalogo(session):
+    # Se incrementa al final de la transacción para bloquear la fila del contador lo menos posible
+    session.flush()
+    if session.info.pop('catalogo_modificado', False):
+        incrementar_version_catalogo(session.connection())
+        session.info['productos_por_notificar'] = session.info.pop('productos_modificados', None)
+
+@event.listens_for(SesionSQLAlchemy, 'after_commit')
+def _notificar_cambios_catalogo(session):
+    # Después del commit: quien vuelva a leer ya ve los datos nuevos
+    if 'productos_por_notificar' not in session.info:
+        return
+    ids_productos = session.info.pop('productos_por_notificar')
+    for funcion in _oyentes_catalogo:
+        funcion(ids_productos)
+
+@event.listens_for(SesionSQLAlchemy, 'after_rollback')
+def _descartar_cambios_catalogo(session):
+    session.info.pop('catalogo_modificado', None)
+    session.info.pop('productos_modificados', None)
+    session.info.pop('productos_por_notificar', None)
+
+def purgar_claves_idempotencia(conexion, ahora=None):
+    """
+    Borra las claves de idempotencia vencidas (un DELETE por rango sobre el índice de expiración).
+
+    :param conexion: Connection o Session donde ejecutar.
+    :param ahora: Momento de referencia en UTC (por defecto, el actual).
+    :return: Cantidad de claves borradas.
+    """
+    ahora = ahora or datetime.now(timezone.utc).replace(tzinfo=None)
+    resultado = conexion.execute(
+        delete(ClaveIdempotencia.__table__).where(ClaveIdempotencia.expira <= ahora)
+    )
+    return resultado.rowcount
+
+def crear_columnas_faltantes(bind=None):
+    """
+    Agrega a las tablas existentes las columnas declaradas en los modelos que
+    todavía no existan (ALTER TABLE ... ADD COLUMN). Devuelve "tabla.columna" de las creadas.
+    """
+    bind = bind or get_engine()
+    inspector = inspect(bind)
+    creadas = []
+    with bind.begin() as conexion:
+        for tabla in Base.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {columna['name'] for columna in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    definicion = CreateColumn(columna).compile(dialect=bind.dialect)
+                    conexion.exec_driver_sql(f"ALTER TABLE {tabla.name} ADD COLUMN {definicion}")
+                    creadas.append(f"{tabla.name}.{columna.name}")
+        if 'notas_venta.saldo' in creadas:
+            recalcular_saldos(conexion)
+        if 'detalle_nota_venta.costo_unitario' in creadas:
+            # Las ventas anteriores quedan con el costo de hoy, y desde aquí ya no cambia
+            fijar_costos_unitarios(conexion)
+    return creadas
+
+def crear_indices_faltantes(bind=None):
+    """
+    Crea sobre una base de datos existente los índices declarados en los modelos
+    que todavía no existan, sin reconstruir las tablas.
+    Devuelve la lista de nombres de índices creados.
+    """
+    bind = bind or get_engine()
+    inspector = inspect(bind)
+    creados = []
+    for tabla in Base.metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+        existentes = {indice['name'] for indice in inspector.get_indexes(tabla.name)}
+        for indice in sorted(tabla.indexes, key=lambda i: i.name):
+            if indice.name not in existentes:
+                indice.create(bind)
+                creados.append(indice.name)
+    return creados
+
+def inicializar_esquema(bind=None):
+    """
+    Crea las tablas que falten, agrega las columnas e índices declarados.
+    Reemplaza al create_all que antes se ejecutaba al importar el módulo.
+    """
+    bind = bind or get_engine()
+    Base.metadata.create_all(bind)
+    crear_columnas_faltantes(bind)
+    return crear_indices_faltantes(bind)
 
 #reiniciar_db()
-Base.metadata.create_all(engine)
\ No newline at end of file
+
+if __name__ == '__main__':
+    # python db.py bootstrap -> crea el esquema, columnas nuevas e índices (antes ocurría al importar)
+    # python db.py indices   -> agrega los índices faltantes a una base existente
+    # python db.py busqueda  -> crea los índices de búsqueda por texto (trigramas / FTS5)
+    # python db.py ventas_diarias [desde hasta] -> reconstruye el acumulado diario de ventas
+    # python db.py idempotencia -> borra las claves de idempotencia vencidas
+    import sys
+    if sys.argv[1:] == ['bootstrap']:
+        inicializar_esquema()
+        print("Esquema inicializado")
+    elif sys.argv[1:] == ['indices']:
+        for nombre in crear_indices_faltantes():
+            print(f"Índice creado: {nombre}")
+    elif sys.argv[1:] == ['busqueda']:
+        from busqueda import preparar_busqueda
+        preparar_busqueda(get_engine())
+        print("Índices de búsqueda preparados")
+    elif sys.argv[1:2] == ['ventas_diarias'] and len(sys.argv) in (2, 4):
+        from ventas import reconstruir_ventas_diarias
+        rango = [date.fromisoformat(valor) for valor in sys.argv[2:]]
+        session = Session()
+        try:
+            filas = reconstruir_ventas_diarias(session, *rango)
+            session.commit()
+        finally:
+            session.close()
+        print(f"Ventas diarias reconstruidas: {filas} filas")
+    elif sys.argv[1:] == ['idempotencia']:
+        with get_engine().begin() as conexion:
+            borradas = purgar_claves_idempotencia(conexion)
+        print(f"Claves de idempotencia vencidas borradas: {borradas}")
+    else:
+        print("Uso: python db.py [bootstrap|indices|busqueda|ventas_diarias [desde hasta]|idempotencia]")
\ No newline at end of file
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import Response, jsonify, make_response, request
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from db import ClaveIdempotencia, purgar_claves_idempotencia
+
+# Cabecera Idempotency-Key para los POST que escriben (crear nota, confirmar venta).
+# La clave se inserta en la misma transacción que la escritura: si la vista hace commit
+# queda reservada junto con la nota, y si hace rollback desaparece y el reintento se
+# ejecuta de nuevo. Las respuestas 2xx se guardan y se devuelven a los reintentos.
+# reservar_clave / completar_clave no dependen de Flask: apii_async.py las usa con run_sync.
+
+CABECERA_IDEMPOTENCIA = 'Idempotency-Key'
+LARGO_MAXIMO_CLAVE = 255
+# Cada cuánto (como mínimo) un proceso purga las claves vencidas al atender una petición
+INTERVALO_PURGA_SEGUNDOS = 300
+
+_ultima_purga = 0.0
+
+
+def ttl_idempotencia():
+    """
+    Tiempo de vida de las claves, leído de API_IDEMPOTENCIA_TTL_HORAS (por defecto 24).
+    """
+    return timedelta(hours=float(os.getenv('API_IDEMPOTENCIA_TTL_HORAS', 24)))
+
+
+def _ahora():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def huella_peticion(metodo, ruta, cuerpo):
+    """Identifica la petición: la misma clave con otro cuerpo o ruta es un error del cliente."""
+    contenido = hashlib.sha256()
+    contenido.update(f"{metodo} {ruta}\n".encode("utf-8"))
+    contenido.update(cuerpo)
+    return contenido.hexdigest()
+
+
+def clave_invalida(clave):
+    """Mensaje de error si la clave no es aceptable, o None."""
+    if len(clave) > LARGO_MAXIMO_CLAVE:
+        return f'{CABECERA_IDEMPOTENCIA} admite hasta {LARGO_MAXIMO_CLAVE} caracteres'
+    return None
+
+
+def _respuesta_registrada(registro, huella):
+    if registro.huella != huella:
+        return {'success': False, 'error': f'La clave {CABECERA_IDEMPOTENCIA} ya se usó con otra petición'}, 422, False
+    if registro.estado_http is None:
+        return {'success': False,
+                'error': 'Hay una petición con la misma clave en curso; reintente más tarde'}, 409, False
+    return registro.respuesta, registro.estado_http, True
+
+
+def reservar_clave(session, clave, huella):
+    """
+    Reserva la clave en la transacción de la sesión, antes de ejecutar la operación.
+
+    :param session: Sesión de la petición (la misma que usará la operación).
+    :param clave: Valor de la cabecera Idempotency-Key.
+    :param huella: huella_peticion de la petición.
+    :return: None si la clave quedó reservada (hay que ejecutar la operación); si no,
+             (cuerpo, estado, reproducida): la respuesta guardada (cuerpo JSON como texto,
+             reproducida=True) o un error (cuerpo dict) de clave reutilizada o en curso.
+    """
+    ahora = _ahora()
+    registro = session.get(ClaveIdempotencia, clave)
+    if registro is not None and registro.expira <= ahora:
+        session.delete(registro)
+        registro = None
+    if registro is not None:
+        return _respuesta_registrada(registro, huella)
+
+    # Con dos peticiones simultáneas la segunda falla aquí
+    session.add(ClaveIdempotencia(clave=clave, huella=huella, expira=ahora + ttl_idempotencia()))
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        registro = session.get(ClaveIdempotencia, clave)
+        if registro is None:
+            return {'success': False, 'error': 'Conflicto al registrar la clave; reintente'}, 409, False
+        return _respuesta_registrada(registro, huella)
+    return None
+
+
+def completar_clave(session, clave, estado, cuerpo):
+    """
+    Tras ejecutar la operación: guarda la respuesta 2xx (la operación ya hizo commit
+    junto con la reserva) o, ante un error, descarta la reserva para que el reintento
+    vuelva a ejecutarse.
+
+    :param estado: Código HTTP de la respuesta.
+    :param cuerpo: Cuerpo de la respuesta (texto JSON).
+    """
+    global _ultima_purga
+    if not 200 <= estado < 300:
+        session.rollback()
+        return
+    session.execute(
+        update(ClaveIdempotencia.__table__)
+        .where(ClaveIdempotencia.clave == clave)
+        .values(estado_http=estado, respuesta=cuerpo)
+    )
+    session.commit()
+    if time.monotonic() - _ultima_purga >= INTERVALO_PURGA_SEGUNDOS:
+        _ultima_purga = time.monotonic()
+        purgar_claves_idempotencia(session)
+        session.commit()
+
+
+def idempotente(obtener_sesion):
+    """
+    Decorador para vistas POST de Flask que respeta la cabecera Idempotency-Key.
+    Sin cabecera la vista se ejecuta normalmente.
+
+    :param obtener_sesion: Función que devuelve la sesión de la petición (la que usa la vista).
+    :return: Decorador.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            clave = request.headers.get(CABECERA_IDEMPOTENCIA)
+            if not clave:
+                return vista(*args, **kwargs)
+            error = clave_invalida(clave)
+            if error:
+                return jsonify({'success': False, 'error': error}), 400
+
+            session = obtener_sesion()
+            previa = reservar_clave(session, clave, huella_peticion(request.method, request.path, request.get_data()))
+            if previa is not None:
+                cuerpo, estado, reproducida = previa
+                if not reproducida:
+                    return jsonify(cuerpo), estado
+                respuesta = Response(cuerpo, status=estado, mimetype='application/json')
+                respuesta.headers['Idempotent-Replayed'] = 'true'
+                return respuesta
+
+            respuesta = make_response(vista(*args, **kwargs))
+            completar_clave(session, clave, respuesta.status_code, respuesta.get_data(as_text=True))
+            return respuesta
+        return envoltura
+    return decorador
@@ -0,0 +1,201 @@
+import os
+import re
+import time
+import warnings
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Medición de las sentencias SQL de cada unidad de trabajo: una petición de la API
+# (metricas.py) o una llamada a una función de sistema.py (decorador medido).
+# Por unidad se cuentan sentencias, tiempo y forma de cada sentencia (el texto con los
+# valores reemplazados por ?), sin depender de Flask.
+#
+# Depuración de consultas N+1: con DB_MAX_REPETICIONES_SENTENCIA=N, una unidad que
+# ejecuta la misma forma más de N veces emite un SentenciaRepetidaAviso, o lanza
+# SentenciaRepetida si además DB_REPETICIONES_FALLAR=1 (pensado para tests y desarrollo).
+
+# Unidades terminadas que se conservan para inspección (ultimas_mediciones)
+MEDICIONES_GUARDADAS = 200
+
+
+class SentenciaRepetida(RuntimeError):
+    """Una unidad de trabajo repitió la misma forma de sentencia más veces que el máximo."""
+
+
+class SentenciaRepetidaAviso(RuntimeWarning):
+    """Aviso equivalente a SentenciaRepetida cuando no está configurado fallar."""
+
+
+def configuracion_medicion():
+    """
+    Parámetros leídos del entorno: DB_MAX_REPETICIONES_SENTENCIA (0 = sin control,
+    por defecto) y DB_REPETICIONES_FALLAR (por defecto avisa en lugar de fallar).
+    """
+    return {
+        'maximo_repeticiones': int(os.getenv('DB_MAX_REPETICIONES_SENTENCIA', 0)),
+        'fallar': os.getenv('DB_REPETICIONES_FALLAR', '').strip().lower() in ('1', 'true', 'si', 'sí', 'yes', 'on'),
+    }
+
+
+_config = configuracion_medicion()
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETROS = re.compile(r"%\(\w+\)s|%s|(?<![:\w]):\w+|\$\d+|\?")
+_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_FILAS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+_ESPACIOS = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalizar_sentencia(sentencia):
+    """
+    Forma de una sentencia: literales y parámetros como ?, listas IN y filas de
+    VALUES de cualquier largo como una sola, y espacios simples.
+
+    :param sentencia: Texto SQL tal como llega al cursor.
+    :return: Texto normalizado.
+    """
+    forma = _PARAMETROS.sub('?', _LITERALES.sub('?', sentencia))
+    forma = _FILAS.sub('(?)', _LISTAS.sub('(?)', forma))
+    return _ESPACIOS.sub(' ', forma).strip()
+
+
+class MedicionSQL:
+    """Sentencias de una unidad de trabajo: cantidad, tiempo y {forma: [veces, segundos]}."""
+    __slots__ = ('nombre', 'inicio', 'duracion', 'sentencias', 'segundos', 'formas',
+                 'maximo_repeticiones', 'fallar')
+
+    def __init__(self, nombre, maximo_repeticiones=None, fallar=None):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.duracion = None
+        self.sentencias = 0
+        self.segundos = 0.0
+        self.formas = {}
+        self.maximo_repeticiones = _config['maximo_repeticiones'] if maximo_repeticiones is None \
+            else maximo_repeticiones
+        self.fallar = _config['fallar'] if fallar is None else fallar
+
+    def registrar(self, sentencia, segundos):
+        self.sentencias += 1
+        self.segundos += segundos
+        forma = normalizar_sentencia(sentencia)
+        datos = self.formas.get(forma)
+        if datos is None:
+            self.formas[forma] = [1, segundos]
+            return
+        datos[0] += 1
+        datos[1] += segundos
+        # Se informa una sola vez por forma, al superar el máximo
+        if self.maximo_repeticiones and datos[0] == self.maximo_repeticiones + 1:
+            mensaje = (f"{self.nombre}: la misma sentencia se ejecutó más de {self.maximo_repeticiones} "
+                       f"veces (posible N+1): {forma}")
+            if self.fallar:
+                raise SentenciaRepetida(mensaje)
+            warnings.warn(mensaje, SentenciaRepetidaAviso, stacklevel=2)
+
+    def repetidas(self, minimo=2):
+        """
+        :param minimo: Veces a partir de las que una forma se considera repetida.
+        :return: Lista de (forma, veces, segundos), de la más repetida a la menos.
+        """
+        return sorted(((forma, veces, segundos) for forma, (veces, segundos) in self.formas.items()
+                       if veces >= minimo), key=lambda fila: -fila[1])
+
+
+_medicion_actual = ContextVar('medicion_sql_actual', default=None)
+_ultimas = deque(maxlen=MEDICIONES_GUARDADAS)
+
+
+def medicion_actual():
+    """MedicionSQL de la unidad de trabajo en curso en este contexto, o None."""
+    return _medicion_actual.get()
+
+
+def iniciar_medicion(nombre, maximo_repeticiones=None, fallar=None):
+    """
+    Comienza a medir una unidad de trabajo en el contexto actual (hilo o tarea).
+
+    :param nombre: Nombre de la unidad (ruta o función) para los mensajes.
+    :return: (medicion, token) para pasar a terminar_medicion.
+    """
+    medicion = MedicionSQL(nombre, maximo_repeticiones, fallar)
+    return medicion, _medicion_actual.set(medicion)
+
+
+def terminar_medicion(medicion, token):
+    """Cierra la unidad: fija su duración y la guarda entre las últimas mediciones."""
+    medicion.duracion = time.perf_counter() - medicion.inicio
+    try:
+        _medicion_actual.reset(token)
+    except ValueError:
+        # Terminada desde otro contexto (otra tarea u otro hilo): allí no es la actual
+        pass
+    _ultimas.append(medicion)
+    return medicion
+
+
+@contextmanager
+def medir_sql(nombre, maximo_repeticiones=None, fallar=None):
+    """
+    Mide las sentencias del bloque como una unidad de trabajo. Dentro de otra unidad
+    no abre una nueva: las sentencias se suman a la de afuera.
+
+    Uso:
+        with medir_sql("importar_catalogo") as medicion:
+            ...
+        print(medicion.sentencias, medicion.repetidas())
+    """
+    actual = _medicion_actual.get()
+    if actual is not None:
+        yield actual
+        return
+    medicion, token = iniciar_medicion(nombre, maximo_repeticiones, fallar)
+    try:
+        yield medicion
+    finally:
+        terminar_medicion(medicion, token)
+
+
+def medido(funcion):
+    """Decorador: cada llamada a la función es una unidad de trabajo medida (ver medir_sql)."""
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        with medir_sql(funcion.__name__):
+            return funcion(*args, **kwargs)
+    return envoltura
+
+
+def permitir_repeticiones(cantidad):
+    """
+    Declara que la unidad en curso repite a propósito cada sentencia hasta `cantidad`
+    veces más (p. ej. un savepoint por elemento de un lote): sube su máximo de repeticiones.
+
+    :param cantidad: Repeticiones esperadas adicionales.
+    """
+    medicion = _medicion_actual.get()
+    if medicion is not None and medicion.maximo_repeticiones:
+        medicion.maximo_repeticiones += cantidad
+
+
+def ultimas_mediciones():
+    """Unidades de trabajo terminadas más recientes, de la más vieja a la más nueva."""
+    return list(_ultimas)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _inicio_sentencia(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _medicion_actual.get() is not None:
+        context._inicio_medicion = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _fin_sentencia(conn, cursor, statement, parameters, context, executemany):
+    medicion = _medicion_actual.get()
+    inicio = getattr(context, '_inicio_medicion', None)
+    if medicion is not None and inicio is not None:
+        medicion.registrar(statement, time.perf_counter() - inicio)
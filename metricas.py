@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from flask import Response, g, request
+from sqlalchemy.pool import QueuePool
+from db import Histograma, PoolMedido
+from medicion_sql import iniciar_medicion, terminar_medicion
+
+# Métricas de la API en el formato de texto de Prometheus (GET /api/metrics):
+# latencia por ruta, peticiones en curso, sentencias SQL y tiempo de base por petición,
+# espera al pedir una conexión al pool y aciertos del cache de productos.
+#
+# En el camino de cada petición solo se toman tiempos y se suman contadores; el texto
+# se arma al consultar /api/metrics. Cada proceso tiene sus propias métricas: con
+# varios workers, Prometheus consulta cada uno por separado (etiqueta de instancia).
+#
+# Cada petición es una unidad de trabajo de medicion_sql.py; sus sentencias y su
+# tiempo de base también se envían en la cabecera Server-Timing.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Límites de los buckets (segundos) de la latencia por ruta y del tiempo SQL por petición
+BUCKETS_LATENCIA_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Límites de los buckets de sentencias SQL por petición
+BUCKETS_SENTENCIAS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# Etiqueta de ruta de las peticiones que no coinciden con ninguna (evita una serie por URL)
+RUTA_DESCONOCIDA = '<sin ruta>'
+
+
+def server_timing_activo():
+    """Cabecera Server-Timing en las respuestas, salvo API_SERVER_TIMING=0."""
+    return os.getenv('API_SERVER_TIMING', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+class RegistroMetricas:
+    """Series de la API, una por combinación de etiquetas. Seguro entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.en_curso = 0
+        self.peticiones = {}    # (metodo, ruta, estado) -> cantidad
+        self.latencias = {}     # (metodo, ruta) -> Histograma (s)
+        self.sentencias = {}    # (metodo, ruta) -> Histograma (sentencias por petición)
+        self.segundos_sql = {}  # (metodo, ruta) -> Histograma (s de SQL por petición)
+
+    def iniciar(self, nombre):
+        """
+        Comienza la medición de una petición en el contexto actual.
+
+        :param nombre: Nombre de la unidad de trabajo (método y ruta).
+        :return: (medicion, token) para pasar a terminar.
+        """
+        with self._lock:
+            self.en_curso += 1
+        # En ASGI la medición la comparten las consultas hechas con run_sync
+        return iniciar_medicion(nombre)
+
+    def terminar(self, medicion, token, metodo, ruta, estado):
+        """
+        Registra la petición medida.
+
+        :param ruta: Regla de la ruta (p. ej. /api/productos/<int:id_producto>), no la URL.
+        :param estado: Código HTTP de la respuesta.
+        """
+        terminar_medicion(medicion, token)
+        clave = (metodo, ruta)
+        with self._lock:
+            self.en_curso -= 1
+            self.peticiones[clave + (estado,)] = self.peticiones.get(clave + (estado,), 0) + 1
+            if clave not in self.latencias:
+                self.latencias[clave] = Histograma(BUCKETS_LATENCIA_S)
+                self.sentencias[clave] = Histograma(BUCKETS_SENTENCIAS)
+                self.segundos_sql[clave] = Histograma(BUCKETS_LATENCIA_S)
+        # Cada histograma tiene su propio lock
+        self.latencias[clave].registrar(medicion.duracion)
+        self.sentencias[clave].registrar(medicion.sentencias)
+        self.segundos_sql[clave].registrar(medicion.segundos)
+
+
+registro = RegistroMetricas()
+
+
+def server_timing(medicion):
+    """
+    Valor de la cabecera Server-Timing de una petición en curso: sentencias y tiempo
+    de base (db) y tiempo total hasta armar la respuesta (app), en ms.
+    """
+    total_ms = (time.perf_counter() - medicion.inicio) * 1000
+    return (f'db;dur={medicion.segundos * 1000:.1f};desc="{medicion.sentencias} sentencias", '
+            f'app;dur={total_ms:.1f}')
+
+
+def _numero(valor):
+    if valor is None:
+        return 'NaN'
+    if isinstance(valor, float) and valor.is_integer() and abs(valor) < 1e15:
+        return str(int(valor))
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+def _etiquetas(pares):
+    if not pares:
+        return ''
+    texto = ','.join('{}="{}"'.format(nombre, str(valor).replace('\\', '\\\\').replace('"', '\\"')
+                                      .replace('\n', '\\n')) for nombre, valor in pares)
+    return '{' + texto + '}'
+
+
+def _encabezado(lineas, nombre, tipo, ayuda):
+    lineas.append(f'# HELP {nombre} {ayuda}')
+    lineas.append(f'# TYPE {nombre} {tipo}')
+
+
+def _histograma(lineas, nombre, pares, histograma, escala=1):
+    # Histograma guarda la cuenta de cada bucket; Prometheus espera cuentas acumuladas
+    resumen = histograma.resumen()
+    acumulado = 0
+    for limite, cuenta in zip(histograma.limites + (None,), resumen['buckets'].values()):
+        acumulado += cuenta
+        le = '+Inf' if limite is None else _numero(limite * escala)
+        lineas.append(f'{nombre}_bucket{_etiquetas(pares + (("le", le),))} {acumulado}')
+    lineas.append(f'{nombre}_sum{_etiquetas(pares)} {_numero(resumen["suma"] * escala)}')
+    lineas.append(f'{nombre}_count{_etiquetas(pares)} {resumen["cantidad"]}')
+
+
+def exponer(pool=None, cache=None):
+    """
+    Texto de /api/metrics.
+
+    :param pool: Pool del engine de la API (sus esperas se publican si es un PoolMedido).
+    :param cache: CacheLRU cuyos contadores se publican (opcional).
+    :return: Métricas en el formato de texto de Prometheus.
+    """
+    lineas = []
+    with registro._lock:
+        en_curso = registro.en_curso
+        peticiones = sorted(registro.peticiones.items())
+        claves = sorted(registro.latencias)
+
+    _encabezado(lineas, 'api_peticiones_en_curso', 'gauge', 'Peticiones que se están atendiendo.')
+    lineas.append(f'api_peticiones_en_curso {en_curso}')
+    _encabezado(lineas, 'api_peticiones_total', 'counter', 'Peticiones atendidas por ruta y código HTTP.')
+    for (metodo, ruta, estado), cantidad in peticiones:
+        lineas.append(f'api_peticiones_total{_etiquetas((("metodo", metodo), ("ruta", ruta), ("estado", estado)))} '
+                      f'{cantidad}')
+    for nombre, series, ayuda in (
+        ('api_peticion_duracion_segundos', registro.latencias, 'Latencia de las peticiones por ruta.'),
+        ('api_sql_sentencias_por_peticion', registro.sentencias, 'Sentencias SQL ejecutadas por petición.'),
+        ('api_sql_segundos_por_peticion', registro.segundos_sql, 'Tiempo en la base de datos por petición.'),
+    ):
+        _encabezado(lineas, nombre, 'histogram', ayuda)
+        for metodo, ruta in claves:
+            _histograma(lineas, nombre, (("metodo", metodo), ("ruta", ruta)), series[(metodo, ruta)])
+
+    if isinstance(pool, QueuePool):
+        _encabezado(lineas, 'db_pool_conexiones_en_uso', 'gauge', 'Conexiones prestadas por el pool.')
+        lineas.append(f'db_pool_conexiones_en_uso {pool.checkedout()}')
+        _encabezado(lineas, 'db_pool_tamanio', 'gauge', 'Tamaño configurado del pool.')
+        lineas.append(f'db_pool_tamanio {pool.size()}')
+    if isinstance(pool, PoolMedido):
+        _encabezado(lineas, 'db_pool_espera_checkout_segundos', 'histogram',
+                    'Espera por un lugar libre en el pool (sin el tiempo de abrir conexiones).')
+        _histograma(lineas, 'db_pool_espera_checkout_segundos', (), pool.esperas_ms, escala=0.001)
+        _encabezado(lineas, 'db_pool_timeouts_total', 'counter', 'Pedidos de conexión que agotaron el timeout.')
+        lineas.append(f'db_pool_timeouts_total {pool.timeouts}')
+
+    if cache is not None:
+        estadisticas = cache.estadisticas()
+        for nombre, tipo, clave, ayuda in (
+            ('cache_productos_aciertos_total', 'counter', 'aciertos', 'Lecturas de productos resueltas por el cache.'),
+            ('cache_productos_fallos_total', 'counter', 'fallos', 'Lecturas de productos que fueron a la base.'),
+            ('cache_productos_tasa_aciertos', 'gauge', 'tasa_aciertos', 'Aciertos sobre lecturas desde el arranque.'),
+            ('cache_productos_entradas', 'gauge', 'entradas', 'Productos guardados en el cache.'),
+            ('cache_productos_descartes_total', 'counter', 'descartes', 'Entradas descartadas por tamaño.'),
+            ('cache_productos_invalidaciones_total', 'counter', 'invalidaciones', 'Invalidaciones por escrituras.'),
+        ):
+            _encabezado(lineas, nombre, tipo, ayuda)
+            lineas.append(f'{nombre} {_numero(estadisticas[clave])}')
+    return '\n'.join(lineas) + '\n'
+
+
+def ruta_peticion(regla):
+    """Etiqueta de ruta: la regla que atendió la petición, o RUTA_DESCONOCIDA."""
+    return regla.rule if regla is not None else RUTA_DESCONOCIDA
+
+
+def instalar_metricas(app, obtener_pool, cache=None):
+    """
+    Registra en la app Flask la medición de cada petición y la ruta GET /api/metrics.
+
+    La latencia va desde que llega la petición hasta que la respuesta está armada
+    (en las transmitidas, hasta que empieza a enviarse).
+
+    :param app: Aplicación Flask.
+    :param obtener_pool: Función que devuelve el pool del engine de la API.
+    :param cache: CacheLRU a publicar (opcional).
+    """
+    enviar_server_timing = server_timing_activo()
+
+    @app.before_request
+    def _iniciar_medicion():
+        g._medicion = registro.iniciar(f'{request.method} {ruta_peticion(request.url_rule)}')
+
+    @app.after_request
+    def _registrar_estado(respuesta):
+        g._estado_medicion = respuesta.status_code
+        if enviar_server_timing and '_medicion' in g:
+            respuesta.headers['Server-Timing'] = server_timing(g._medicion[0])
+        return respuesta
+
+    @app.teardown_request
+    def _terminar_medicion(exception=None):
+        medicion = g.pop('_medicion', None)
+        if medicion is not None:
+            registro.terminar(*medicion, request.method, ruta_peticion(request.url_rule),
+                              g.pop('_estado_medicion', 500))
+
+    @app.route('/api/metrics', methods=['GET'])
+    def metricas():
+        """
+        GET /api/metrics
+        Métricas de la API en el formato de texto de Prometheus
+        """
+        return Response(exponer(obtener_pool(), cache), content_type=CONTENT_TYPE)
@@ -0,0 +1,543 @@
+import hashlib
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from sqlalchemy import false, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from db import Cliente, Producto, NotaVenta
+from ventas import confirmar_nota, confirmar_notas, StockInsuficiente, Text_Nota_Inexistente, insertar_detalles
+from busqueda import filtro_nombre, filtro_id_prefijo, es_numerico
+from paginacion import paginar_por_cursor
+from serializadores import serializador_filas
+from reportes import FORMATOS_EXPORTACION
+from cache import productos_cacheados
+from medicion_sql import permitir_repeticiones
+
+# Operaciones de la API compartidas por apii.py (Flask, WSGI) y apii_async.py (Quart, ASGI).
+# Reciben la sesión y los datos ya leídos de la petición y devuelven (cuerpo, estado):
+# cada aplicación solo lee la petición y arma la respuesta, con el mismo contrato JSON.
+# En la variante asíncrona se ejecutan con AsyncSession.run_sync.
+
+PRODUCTOS_POR_PAGINA = 50
+MAX_PRODUCTOS_POR_PAGINA = 500
+# Filas pedidas al cursor en cada viaje y agrupadas en cada fragmento NDJSON
+FILAS_POR_FRAGMENTO_NDJSON = 500
+# Notas admitidas por petición en POST /api/notas/batch y /api/notas/confirmar-venta
+MAX_NOTAS_POR_LOTE = 500
+
+
+def _error(mensaje, estado):
+    return {
+        'success': False,
+        'error': mensaje
+    }, estado
+
+
+# Columnas de Producto que se pueden pedir con ?fields= (id_producto va siempre: es la clave del cursor)
+def columnas_producto(fields):
+    columnas = Producto.__table__.columns
+    if not fields:
+        return [getattr(Producto, columna.key) for columna in columnas]
+    pedidas = [campo.strip() for campo in fields.split(',') if campo.strip()]
+    desconocidas = [campo for campo in pedidas if campo not in columnas]
+    if desconocidas:
+        raise ValueError(f"Campos desconocidos: {', '.join(desconocidas)}. "
+                         f"Opciones: {', '.join(columnas.keys())}")
+    nombres = ['id_producto'] + [campo for campo in pedidas if campo != 'id_producto']
+    return [getattr(Producto, nombre) for nombre in dict.fromkeys(nombres)]
+
+# Función auxiliar para serializar fechas
+def serialize_date(obj):
+    if isinstance(obj, date):
+        return obj.isoformat()
+    return obj
+
+
+def validadores_catalogo(version, actualizado, ruta_completa):
+    """
+    ETag y Last-Modified de una respuesta del catálogo a partir de su versión.
+
+    :param version: Versión del catálogo (db.version_catalogo).
+    :param actualizado: Momento (UTC, sin zona) del último cambio, o None.
+    :param ruta_completa: Ruta con query string: la representación depende de filtros, cursor y fields.
+    :return: Tupla (etag, ultimo_cambio).
+    """
+    etag = f"{version}-{hashlib.sha1(ruta_completa.encode('utf-8')).hexdigest()[:10]}"
+    ultimo_cambio = actualizado.replace(tzinfo=timezone.utc, microsecond=0) if actualizado else None
+    return etag, ultimo_cambio
+
+
+def no_modificado(request, etag, ultimo_cambio):
+    """True si el cliente ya tiene la representación (If-None-Match / If-Modified-Since)."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return bool(ultimo_cambio and request.if_modified_since and ultimo_cambio <= request.if_modified_since)
+
+
+def marcar_validadores(respuesta, etag, ultimo_cambio):
+    """Agrega ETag, Last-Modified y Cache-Control a las respuestas 200 y 304 del catálogo."""
+    if respuesta.status_code in (200, 304):
+        respuesta.set_etag(etag)
+        if ultimo_cambio:
+            respuesta.last_modified = ultimo_cambio
+        # El cliente puede guardar la respuesta pero debe revalidarla en cada uso
+        respuesta.cache_control.no_cache = True
+    return respuesta
+
+
+def listar_productos(session, args):
+    """
+    Página de productos de GET /api/productos.
+
+    :param args: Parámetros de la query string (MultiDict): limit, cursor, nombre, stock_min, fields.
+    """
+    try:
+        limite = args.get('limit', PRODUCTOS_POR_PAGINA, type=int)
+        if not 1 <= limite <= MAX_PRODUCTOS_POR_PAGINA:
+            raise ValueError(f"limit debe estar entre 1 y {MAX_PRODUCTOS_POR_PAGINA}")
+        columnas = columnas_producto(args.get('fields'))
+        nombre = args.get('nombre', '').strip()
+        stock_min = args.get('stock_min', type=int)
+
+        query = session.query(*columnas)
+        if nombre:
+            query = query.filter(filtro_nombre(session, Producto.id_producto, Producto.nombre, nombre))
+        if stock_min is not None:
+            query = query.filter(Producto.stock >= stock_min)
+        filtros = {'nombre': nombre, 'stock_min': stock_min}
+        productos, siguiente_cursor = paginar_por_cursor(
+            query, Producto.id_producto, args.get('cursor'), limite, filtros, ascendente=True
+        )
+        serializar = serializador_filas(query)
+        productos_dict = [serializar(producto) for producto in productos]
+
+        return {
+            'success': True,
+            'data': productos_dict,
+            'count': len(productos_dict),
+            'next_cursor': siguiente_cursor
+        }, 200
+
+    except ValueError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+def producto_por_id(session, id_producto, version=None):
+    """
+    Producto de GET /api/productos/{id} (desde el cache de productos si está).
+    version es la del catálogo con la que se arma el ETag: el cache no sirve filas anteriores.
+    """
+    try:
+        producto = productos_cacheados(session, [id_producto], version).get(id_producto)
+
+        if not producto:
+            return _error('Producto no encontrado', 404)
+
+        return {
+            'success': True,
+            'data': producto
+        }, 200
+
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+def filtros_notas(filtros_activos):
+    """
+    Valida y convierte los filtros de /api/notas/filtradas antes de consultar
+    (en modo NDJSON, antes de enviar las cabeceras).
+    """
+    filtros = {'id_venta': None, 'cliente': None, 'fecha_inicio': None, 'fecha_fin': None}
+    if filtros_activos.get("ID Venta"):
+        filtros['id_venta'] = str(filtros_activos["ID Venta"])
+    if filtros_activos.get("Cliente"):
+        filtros['cliente'] = filtros_activos["Cliente"]
+    if filtros_activos.get("Fecha Inicio"):
+        filtros['fecha_inicio'] = datetime.strptime(filtros_activos["Fecha Inicio"], "%Y-%m-%d").date()
+    if filtros_activos.get("Fecha Fin"):
+        filtros['fecha_fin'] = datetime.strptime(filtros_activos["Fecha Fin"], "%Y-%m-%d").date()
+    return filtros
+
+
+def consulta_notas_filtradas(session, filtros):
+    """Query de las notas vendidas que cumplen los filtros (de filtros_notas)."""
+    # Consulta base con join a Cliente
+    query = session.query(
+        NotaVenta.id_nota,
+        NotaVenta.fecha_venta,
+        # Una nota sin total se informa con 0, como antes de los serializadores compilados
+        func.coalesce(NotaVenta.total, 0).label("total"),
+        Cliente.nombre.label("nombre_cliente")
+    ).join(Cliente, NotaVenta.id_cliente == Cliente.id_cliente, isouter=True)\
+     .filter(NotaVenta.estado.ilike('%cancelado%'))
+
+    # Aplicar filtros
+    if filtros['id_venta']:
+        id_venta = filtros['id_venta']
+        # Búsqueda por prefijo sobre la clave primaria; un id no numérico no coincide con nada
+        query = query.filter(filtro_id_prefijo(NotaVenta.id_nota, id_venta) if es_numerico(id_venta) else false())
+
+    if filtros['cliente']:
+        query = query.filter(filtro_nombre(session, NotaVenta.id_cliente, Cliente.nombre, filtros['cliente']))
+
+    if filtros['fecha_inicio']:
+        query = query.filter(NotaVenta.fecha_venta >= filtros['fecha_inicio'])
+
+    if filtros['fecha_fin']:
+        query = query.filter(NotaVenta.fecha_venta <= filtros['fecha_fin'])
+
+    return query.order_by(NotaVenta.fecha_venta.asc(), NotaVenta.id_nota.asc())
+
+
+def notas_filtradas(session, filtros):
+    """Respuesta completa (no transmitida) de POST /api/notas/filtradas."""
+    try:
+        # Ejecutar consulta
+        query = consulta_notas_filtradas(session, filtros)
+        notas = query.all()
+
+        # Convertir resultados a diccionario
+        serializar = serializador_filas(query)
+        notas_dict = [serializar(nota) for nota in notas]
+
+        return {
+            'success': True,
+            'data': notas_dict,
+            'count': len(notas_dict)
+        }, 200
+
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+def prefiere_ndjson(request):
+    """True si la petición pide las notas como NDJSON (?stream=1 o Accept: application/x-ndjson)."""
+    if request.args.get('stream') == '1':
+        return True
+    # Solo si el cliente prefiere NDJSON; "*/*" o application/json mantienen la respuesta completa
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+
+class NotaInvalida(ValueError):
+    """Nota rechazada por la validación; estado es el código HTTP correspondiente."""
+    def __init__(self, mensaje, estado=400):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def _es_entero(valor):
+    # bool es subclase de int, pero true/false no son IDs ni cantidades
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+def _es_importe(valor):
+    return (_es_entero(valor) or isinstance(valor, (float, Decimal))) and valor >= 0
+
+
+def _campos_nota(data):
+    # Campos obligatorios y sus tipos, sin consultar la base de datos
+    id_cliente = data.get('id_cliente')
+    productos_cantidades = data.get('productos_cantidades', [])
+    if not id_cliente:
+        raise NotaInvalida('id_cliente es requerido')
+    if not _es_entero(id_cliente):
+        raise NotaInvalida('id_cliente debe ser un número entero')
+    if not productos_cantidades:
+        raise NotaInvalida('productos_cantidades es requerido')
+    if not isinstance(productos_cantidades, list):
+        raise NotaInvalida('productos_cantidades debe ser una lista')
+    return id_cliente, productos_cantidades, data.get('observaciones')
+
+
+def _validar_lineas(productos_cantidades):
+    # Forma y tipos de cada línea: después se agrupan (IDs en conjuntos) y se comparan con el stock
+    for producto_data in productos_cantidades:
+        if not isinstance(producto_data, list) or len(producto_data) != 5:
+            raise NotaInvalida('Cada producto debe tener: [id_producto, cantidad, precio_unitario, talla, color]')
+        id_producto, cantidad, precio_unitario, talla, color = producto_data
+        if not _es_entero(id_producto):
+            raise NotaInvalida('id_producto debe ser un número entero')
+        if not _es_entero(cantidad) or cantidad <= 0:
+            raise NotaInvalida(f'La cantidad del producto {id_producto} debe ser un entero mayor que 0')
+        if not _es_importe(precio_unitario):
+            raise NotaInvalida(f'El precio unitario del producto {id_producto} debe ser un número no negativo')
+        if not all(valor is None or isinstance(valor, str) for valor in (talla, color)):
+            raise NotaInvalida(f'Talla y color del producto {id_producto} deben ser texto')
+
+
+def _detalles_nota(productos_cantidades, productos):
+    # Verifica existencia y stock en memoria contra los productos ya cargados (cache.productos_cacheados)
+    total_venta = 0
+    detalles = []
+    for id_producto, cantidad, precio_unitario, talla, color in productos_cantidades:
+        producto = productos.get(id_producto)
+        if not producto:
+            raise NotaInvalida(f'El producto con ID {id_producto} no existe', 404)
+
+        if producto['stock'] < cantidad:
+            raise NotaInvalida(f'No hay suficiente stock para el producto {producto["nombre"]}. '
+                               f'Stock disponible: {producto["stock"]}')
+
+        subtotal = round(precio_unitario * cantidad, 2)
+        detalles.append({
+            'id_producto': id_producto,
+            'cantidad': cantidad,
+            'precio_unitario': precio_unitario,
+            'talla': talla,
+            'color': color,
+            'subtotal': subtotal
+        })
+        total_venta += subtotal
+    return detalles, total_venta
+
+
+def _insertar_nota(session, id_cliente, observaciones, detalles, total_venta):
+    # Crear nueva nota de venta
+    nueva_nota = NotaVenta(
+        id_cliente=id_cliente,
+        fecha=date.today(),
+        total=0,
+        estado="Pendiente",
+        observaciones=observaciones,
+        estado_pedido="ABIERTO"
+    )
+
+    session.add(nueva_nota)
+    session.flush()  # Para obtener el id_nota
+
+    # Insertar todos los detalles con un INSERT multi-fila
+    for detalle in detalles:
+        detalle['id_nota'] = nueva_nota.id_nota
+    insertar_detalles(session, detalles)
+
+    # Actualizar total de la nota
+    nueva_nota.total = round(total_venta, 2)
+    return nueva_nota
+
+
+def crear_nota(session, data):
+    """Alta de una nota de POST /api/notas (hace commit)."""
+    try:
+        if not data:
+            return _error('No se proporcionaron datos', 400)
+
+        try:
+            id_cliente, productos_cantidades, observaciones = _campos_nota(data)
+
+            # Verificar que el cliente existe
+            cliente = session.query(Cliente).filter_by(id_cliente=id_cliente).first()
+            if not cliente:
+                raise NotaInvalida('El cliente no existe', 404)
+
+            # Validar la forma de cada línea antes de tocar la base de datos
+            _validar_lineas(productos_cantidades)
+
+            # Productos referenciados: del cache, y los que falten en una sola consulta
+            productos = productos_cacheados(session, (producto_data[0] for producto_data in productos_cantidades))
+            detalles, total_venta = _detalles_nota(productos_cantidades, productos)
+        except NotaInvalida as e:
+            return _error(str(e), e.estado)
+
+        nueva_nota = _insertar_nota(session, id_cliente, observaciones, detalles, total_venta)
+        session.commit()
+
+        return {
+            'success': True,
+            'data': {
+                'id_nota': nueva_nota.id_nota,
+                'total': total_venta
+            },
+            'message': f'Nota de venta creada exitosamente con ID: {nueva_nota.id_nota}'
+        }, 201
+
+    except Exception as e:
+        session.rollback()
+        return _error(str(e), 500)
+
+
+def crear_notas_lote(session, data):
+    """
+    Alta de varias notas de POST /api/notas/batch (hace commit).
+    Clientes y productos de todo el lote se validan con una consulta IN cada uno (los
+    productos en cache no se consultan); las notas se insertan en una sola
+    transacción con un savepoint por nota.
+    """
+    try:
+        notas = (data or {}).get('notas')
+        if not notas or not isinstance(notas, list):
+            return _error('notas es requerido y debe ser una lista', 400)
+        if len(notas) > MAX_NOTAS_POR_LOTE:
+            return _error(f'Se admiten hasta {MAX_NOTAS_POR_LOTE} notas por lote', 400)
+
+        resultados = [None] * len(notas)
+        validas = []
+        for indice, nota in enumerate(notas):
+            try:
+                if not isinstance(nota, dict):
+                    raise NotaInvalida('Cada nota debe ser un objeto')
+                id_cliente, productos_cantidades, observaciones = _campos_nota(nota)
+                _validar_lineas(productos_cantidades)
+                validas.append((indice, id_cliente, productos_cantidades, observaciones))
+            except NotaInvalida as e:
+                resultados[indice] = {'success': False, 'error': str(e), 'estado': e.estado}
+
+        # Clientes y productos de todo el lote, a lo sumo una consulta para cada uno
+        ids_clientes = {id_cliente for _, id_cliente, _, _ in validas}
+        clientes = set(session.scalars(
+            select(Cliente.id_cliente).where(Cliente.id_cliente.in_(ids_clientes))
+        )) if ids_clientes else set()
+        productos = productos_cacheados(session, (
+            producto_data[0] for _, _, productos_cantidades, _ in validas for producto_data in productos_cantidades
+        ))
+
+        # Savepoint e INSERT por nota: no cuentan como N+1 (ver medicion_sql.py)
+        permitir_repeticiones(len(validas))
+        for indice, id_cliente, productos_cantidades, observaciones in validas:
+            try:
+                if id_cliente not in clientes:
+                    raise NotaInvalida('El cliente no existe', 404)
+                detalles, total_venta = _detalles_nota(productos_cantidades, productos)
+                # Un error al insertar deshace solo esta nota
+                with session.begin_nested():
+                    nueva_nota = _insertar_nota(session, id_cliente, observaciones, detalles, total_venta)
+                resultados[indice] = {'success': True, 'id_nota': nueva_nota.id_nota, 'total': total_venta}
+            except NotaInvalida as e:
+                resultados[indice] = {'success': False, 'error': str(e), 'estado': e.estado}
+            except SQLAlchemyError as e:
+                resultados[indice] = {'success': False, 'error': str(e), 'estado': 500}
+
+        session.commit()
+
+        creadas = sum(1 for resultado in resultados if resultado['success'])
+        return {
+            'success': True,
+            'data': resultados,
+            'creadas': creadas,
+            'fallidas': len(resultados) - creadas
+        }, 200
+
+    except Exception as e:
+        session.rollback()
+        return _error(str(e), 500)
+
+
+def confirmar_venta(session, id_nota):
+    """Confirmación de POST /api/notas/{id}/confirmar-venta (hace commit)."""
+    try:
+        # Descontar el stock de todas las líneas en un solo UPDATE condicionado
+        try:
+            nota = confirmar_nota(session, id_nota)
+        except StockInsuficiente as e:
+            # 404 si alguna línea apunta a un producto eliminado, 400 si solo falta stock
+            codigo = 404 if any(fallo.nombre is None for fallo in e.fallos) else 400
+            return {
+                'success': False,
+                'error': str(e),
+                'fallos': [dict(fallo._asdict(), mensaje=str(fallo)) for fallo in e.fallos]
+            }, codigo
+        except ValueError as e:
+            # 409 si la nota ya estaba vendida
+            return _error(str(e), 404 if str(e) == Text_Nota_Inexistente else 409)
+
+        session.commit()
+
+        return {
+            'success': True,
+            'message': f'Venta confirmada exitosamente para la Nota de Venta ID: {id_nota}',
+            'data': {
+                'id_nota': id_nota,
+                'estado': nota.estado,
+                'fecha_venta': serialize_date(nota.fecha_venta)
+            }
+        }, 200
+
+    except Exception as e:
+        session.rollback()
+        return _error(str(e), 500)
+
+
+def _resultado_rechazo(id_nota, error):
+    # Mismos códigos que /api/notas/<id>/confirmar-venta; 409 si la nota ya estaba vendida
+    if isinstance(error, StockInsuficiente):
+        return {
+            'id_nota': id_nota,
+            'success': False,
+            'error': str(error),
+            'estado': 404 if any(fallo.nombre is None for fallo in error.fallos) else 400,
+            'fallos': [dict(fallo._asdict(), mensaje=str(fallo)) for fallo in error.fallos]
+        }
+    return {
+        'id_nota': id_nota,
+        'success': False,
+        'error': str(error),
+        'estado': 404 if str(error) == Text_Nota_Inexistente else 409
+    }
+
+
+def confirmar_ventas_lote(session, data):
+    """
+    Confirmación en lote de POST /api/notas/confirmar-venta (hace commit).
+    Los productos se bloquean en orden de id y el stock se descuenta con un único UPDATE.
+    """
+    try:
+        data = data or {}
+        ids_notas = data.get('ids_notas')
+        if not ids_notas or not isinstance(ids_notas, list) \
+                or not all(isinstance(id_nota, int) for id_nota in ids_notas):
+            return _error('ids_notas es requerido y debe ser una lista de enteros', 400)
+        if len(ids_notas) > MAX_NOTAS_POR_LOTE:
+            return _error(f'Se admiten hasta {MAX_NOTAS_POR_LOTE} notas por lote', 400)
+        fecha_venta = data.get('fecha_venta')
+        try:
+            fecha_venta = datetime.strptime(fecha_venta, "%Y-%m-%d").date() if fecha_venta else None
+        except ValueError as e:
+            return _error(str(e), 400)
+
+        confirmadas, rechazadas = confirmar_notas(session, ids_notas, fecha_venta)
+        # Fechas leídas antes del commit, que expira las notas
+        confirmadas = {nota.id_nota: serialize_date(nota.fecha_venta) for nota in confirmadas}
+        session.commit()
+
+        resultados = []
+        for id_nota in dict.fromkeys(ids_notas):
+            if id_nota in confirmadas:
+                resultados.append({
+                    'id_nota': id_nota,
+                    'success': True,
+                    'fecha_venta': confirmadas[id_nota]
+                })
+            else:
+                resultados.append(_resultado_rechazo(id_nota, rechazadas[id_nota]))
+
+        return {
+            'success': True,
+            'data': resultados,
+            'confirmadas': len(confirmadas),
+            'fallidas': len(rechazadas)
+        }, 200
+
+    except Exception as e:
+        session.rollback()
+        return _error(str(e), 500)
+
+
+def parametros_reporte(args):
+    """
+    Valida los parámetros de GET /api/reportes/ventas.
+
+    :param args: Parámetros de la query string (MultiDict): formato, mes, anio, desde, hasta.
+    :return: Tupla (formato, mes, anio, desde, hasta); lanza ValueError si alguno es inválido.
+    """
+    formato = args.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato no soportado: {formato}. Opciones: {', '.join(FORMATOS_EXPORTACION)}")
+    desde = args.get('desde')
+    hasta = args.get('hasta')
+    desde = datetime.strptime(desde, "%Y-%m-%d").date() if desde else None
+    hasta = datetime.strptime(hasta, "%Y-%m-%d").date() if hasta else None
+    mes = args.get('mes', type=int)
+    anio = args.get('anio', type=int)
+    if mes is not None and not 1 <= mes <= 12:
+        raise ValueError("El mes debe estar entre 1 y 12")
+    return formato, mes, anio, desde, hasta
@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import json
+
+# Paginación por cursor (keyset): en lugar de OFFSET se filtra por el último id
+# visto, de modo que cualquier página cuesta lo mismo que la primera.
+
+
+def _huella_filtros(filtros):
+    # Identifica los filtros activos para rechazar cursores de otra búsqueda
+    texto = json.dumps(filtros, sort_keys=True, default=str)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:12]
+
+
+def codificar_cursor(ultimo_id, filtros):
+    """
+    Genera un cursor opaco a partir del último id entregado y los filtros activos.
+    """
+    datos = json.dumps({"id": ultimo_id, "f": _huella_filtros(filtros)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(datos.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor, filtros):
+    """
+    Devuelve el último id contenido en el cursor, o None si no hay cursor.
+
+    :raises ValueError: Si el cursor está corrupto o pertenece a otros filtros.
+    """
+    if not cursor:
+        return None
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        ultimo_id = int(datos["id"])
+        huella = datos["f"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Cursor de paginación inválido")
+    if huella != _huella_filtros(filtros):
+        raise ValueError("El cursor no corresponde a los filtros actuales")
+    return ultimo_id
+
+
+def paginar_por_cursor(query, columna_id, cursor, tamanio_pagina, filtros, ascendente=False):
+    """
+    Aplica paginación keyset sobre columna_id (descendente por defecto).
+
+    :param query: Consulta con los filtros ya aplicados (sin ORDER BY ni LIMIT).
+    :param columna_id: Columna de clave primaria por la que se ordena.
+    :param cursor: Cursor recibido de la página anterior, o None para la primera.
+    :param tamanio_pagina: Cantidad de filas por página.
+    :param filtros: Diccionario con los filtros activos (se firma en el cursor).
+    :param ascendente: Recorre de menor a mayor id en lugar de mayor a menor.
+    :return: Tupla (filas, siguiente_cursor); siguiente_cursor es None en la última página.
+    """
+    ultimo_id = decodificar_cursor(cursor, filtros)
+    if ultimo_id is not None:
+        query = query.filter(columna_id > ultimo_id if ascendente else columna_id < ultimo_id)
+    # Se pide una fila extra para saber si existe una página siguiente
+    orden = columna_id.asc() if ascendente else columna_id.desc()
+    filas = query.order_by(orden).limit(tamanio_pagina + 1).all()
+    siguiente_cursor = None
+    if len(filas) > tamanio_pagina:
+        filas = filas[:tamanio_pagina]
+        siguiente_cursor = codificar_cursor(getattr(filas[-1], columna_id.key), filtros)
+    return filas, siguiente_cursor
@@ -0,0 +1,147 @@
+import csv
+import io
+from calendar import monthrange
+from datetime import date
+from sqlalchemy import and_
+from db import Cliente, Producto, NotaVenta, DetalleNotaVenta
+
+# Reporte de ventas compartido por sistema.py (GUI) y apii.py (API), con lectura por lotes
+# y escritores CSV / XLSX de memoria constante.
+
+COLUMNAS_REPORTE = ("id_nota_venta", "producto", "cliente", "cantidad", "precio_unitario",
+                    "total_por_nota", "fecha_venta")
+# Filas que se piden al cursor del servidor en cada viaje
+TAMANIO_LOTE = 1000
+FORMATOS_EXPORTACION = ("csv", "xlsx")
+
+
+def consulta_reporte(session, mes=None, anio=None, fecha_desde=None, fecha_hasta=None):
+    """
+    Construye la consulta del reporte de ventas (una fila por detalle de nota).
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param mes: Mes a reportar (junto con anio) si no se indica un rango.
+    :param anio: Año a reportar (junto con mes).
+    :param fecha_desde: Inicio del rango de fechas de venta (inclusive).
+    :param fecha_hasta: Fin del rango de fechas de venta (inclusive).
+    :return: Query ordenada por fecha de venta e id de nota.
+    """
+    q = (
+        session.query(
+            NotaVenta.id_nota.label("id_nota_venta"),
+            Producto.nombre.label("producto"),
+            Cliente.nombre.label("cliente"),
+            DetalleNotaVenta.cantidad,
+            DetalleNotaVenta.precio_unitario,
+            NotaVenta.total.label("total_por_nota"),
+            NotaVenta.fecha_venta
+        )
+        .select_from(NotaVenta)
+        .join(DetalleNotaVenta, DetalleNotaVenta.id_nota == NotaVenta.id_nota)
+        .join(Producto, Producto.id_producto == DetalleNotaVenta.id_producto)
+        .join(Cliente, Cliente.id_cliente == NotaVenta.id_cliente)
+    )
+    # Filtro por rango de fechas si ambos están presentes
+    if fecha_desde and fecha_hasta:
+        q = q.filter(
+            and_(
+                NotaVenta.fecha_venta >= fecha_desde,
+                NotaVenta.fecha_venta <= fecha_hasta
+            )
+        )
+    # Si no hay rango, pero sí mes y año => construir rango del mes
+    elif mes and anio:
+        primer_dia = date(int(anio), int(mes), 1)
+        ultimo_dia = date(int(anio), int(mes), monthrange(int(anio), int(mes))[1])
+        q = q.filter(
+            and_(
+                NotaVenta.fecha_venta >= primer_dia,
+                NotaVenta.fecha_venta <= ultimo_dia
+            )
+        )
+    return q.order_by(NotaVenta.fecha_venta, NotaVenta.id_nota)
+
+
+def iterar_reporte(session, mes=None, anio=None, fecha_desde=None, fecha_hasta=None, tamanio_lote=TAMANIO_LOTE):
+    """
+    Recorre el reporte por lotes con un cursor del lado del servidor, sin
+    materializar todas las filas. La primera fila llega tras el primer lote.
+
+    :param tamanio_lote: Filas por lote pedidas al cursor.
+    :return: Generador de filas (mismas columnas que consulta_reporte).
+    """
+    consulta = consulta_reporte(session, mes, anio, fecha_desde, fecha_hasta)
+    yield from consulta.yield_per(tamanio_lote)
+
+
+def fragmentos_csv(filas, filas_por_fragmento=TAMANIO_LOTE, encabezado=True):
+    """
+    Convierte las filas del reporte en fragmentos de texto CSV (con encabezado),
+    listos para escribirse en un archivo o enviarse en una respuesta HTTP.
+
+    :param filas: Iterable de filas del reporte.
+    :param filas_por_fragmento: Filas acumuladas antes de emitir cada fragmento.
+    :param encabezado: False para continuar un CSV ya empezado (p. ej. por lotes).
+    :return: Generador de cadenas.
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if encabezado:
+        escritor.writerow(COLUMNAS_REPORTE)
+    pendientes = 0
+    for fila in filas:
+        escritor.writerow(fila)
+        pendientes += 1
+        if pendientes >= filas_por_fragmento:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue()
+
+
+def escribir_xlsx(filas, destino):
+    """
+    Escribe las filas del reporte en un libro XLSX en modo write_only de openpyxl,
+    que vuelca las filas a disco en lugar de mantener la hoja en memoria.
+
+    :param filas: Iterable de filas del reporte.
+    :param destino: Ruta o archivo binario donde guardar el libro.
+    :return: Cantidad de filas escritas (sin el encabezado).
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("La exportación a XLSX requiere el paquete openpyxl")
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet("Reporte")
+    hoja.append(COLUMNAS_REPORTE)
+    cantidad = 0
+    for fila in filas:
+        hoja.append(list(fila))
+        cantidad += 1
+    libro.save(destino)
+    return cantidad
+
+
+def exportar_reporte(filas, destino, formato="csv"):
+    """
+    Exporta las filas del reporte a un archivo.
+
+    :param filas: Iterable de filas del reporte (idealmente de iterar_reporte).
+    :param destino: Ruta del archivo de salida.
+    :param formato: "csv" o "xlsx".
+    :return: Cantidad de filas escritas (sin el encabezado).
+    """
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato no soportado: {formato}. Opciones: {', '.join(FORMATOS_EXPORTACION)}")
+    if formato == "xlsx":
+        return escribir_xlsx(filas, destino)
+    with open(destino, "w", newline="", encoding="utf-8") as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(COLUMNAS_REPORTE)
+        cantidad = 0
+        for fila in filas:
+            escritor.writerow(fila)
+            cantidad += 1
+    return cantidad
@@ -0,0 +1,125 @@
+from datetime import date, datetime
+from decimal import Decimal
+from operator import attrgetter
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import Date, DateTime, Numeric, inspect
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el módulo json estándar
+    orjson = None
+
+# Serialización de modelos y filas para la API: el conversor de cada modelo o forma
+# de fila se arma una sola vez y se reutiliza en cada respuesta.
+#   Decimal  -> float
+#   date     -> "AAAA-MM-DD"
+#   datetime -> ISO 8601
+
+
+def _convertidor(tipo):
+    # Conversión a aplicar a los valores de una columna según su tipo SQL (None = ninguna)
+    if isinstance(tipo, Numeric) and tipo.asdecimal:
+        return float
+    if isinstance(tipo, (Date, DateTime)):
+        return lambda valor: valor.isoformat()
+    return None
+
+
+def _compilar(nombres, tipos, obtener_valores):
+    nombres = tuple(nombres)
+    conversiones = tuple(
+        (indice, convertidor)
+        for indice, convertidor in enumerate(_convertidor(tipo) for tipo in tipos)
+        if convertidor is not None
+    )
+
+    def serializar(origen):
+        valores = obtener_valores(origen)
+        if conversiones:
+            valores = list(valores)
+            for indice, convertidor in conversiones:
+                valor = valores[indice]
+                if valor is not None:
+                    valores[indice] = convertidor(valor)
+        return dict(zip(nombres, valores))
+    return serializar
+
+
+_por_modelo = {}
+_por_forma = {}
+
+
+def serializador_modelo(modelo):
+    """
+    Devuelve (y memoriza) la función que convierte una instancia del modelo en dict
+    con todas sus columnas.
+
+    :param modelo: Clase mapeada (p. ej. Producto).
+    :return: Función instancia -> dict.
+    """
+    serializar = _por_modelo.get(modelo)
+    if serializar is None:
+        columnas = list(inspect(modelo).columns)
+        claves = [columna.key for columna in columnas]
+        if len(claves) == 1:
+            obtener_uno = attrgetter(claves[0])
+            obtener = lambda obj: (obtener_uno(obj),)
+        else:
+            obtener = attrgetter(*claves)
+        serializar = _compilar([columna.name for columna in columnas], [columna.type for columna in columnas], obtener)
+        _por_modelo[modelo] = serializar
+    return serializar
+
+
+def serializador_filas(query):
+    """
+    Devuelve (y memoriza por forma) la función que convierte las filas de una consulta
+    de columnas (session.query(A.x, B.y.label(...))) en dicts.
+
+    :param query: Query cuyas filas se van a serializar.
+    :return: Función fila -> dict.
+    """
+    descripciones = query.column_descriptions
+    forma = tuple((d['name'], type(d['type']), getattr(d['type'], 'asdecimal', None)) for d in descripciones)
+    serializar = _por_forma.get(forma)
+    if serializar is None:
+        serializar = _compilar([d['name'] for d in descripciones], [d['type'] for d in descripciones], tuple)
+        _por_forma[forma] = serializar
+    return serializar
+
+
+def serializar_instancia(obj):
+    """Convierte una instancia de cualquier modelo en dict (con el serializador de su clase)."""
+    return serializador_modelo(type(obj))(obj)
+
+
+def _valor_json(valor):
+    # Valores que pueden llegar sin pasar por un serializador (p. ej. armados a mano)
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    raise TypeError(f"Objeto de tipo {type(valor).__name__} no serializable a JSON")
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    """
+    Proveedor JSON de Flask: usa orjson si está instalado y, en cualquier caso,
+    convierte Decimal y fechas igual que los serializadores.
+    """
+    default = staticmethod(_valor_json)
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_valor_json, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        # orjson ya produce bytes: se evita decodificar y volver a codificar el cuerpo
+        obj = self._prepare_response_obj(args, kwargs)
+        cuerpo = orjson.dumps(obj, default=_valor_json, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(cuerpo, mimetype=self.mimetype)
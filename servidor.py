@@ -0,0 +1,118 @@
+"""
+Servidor de producción de la API WSGI (apii.py): gunicorn con varios procesos worker
+(pre-fork) y un pool de hilos por worker (gthread).
+
+- La aplicación se importa una sola vez en el proceso maestro (preload_app) y los
+  workers la heredan con fork. db.py descarta en cada hijo los engines heredados
+  (os.register_at_fork): cada worker abre sus propias conexiones.
+- Antes de aceptar tráfico cada worker abre las conexiones de su pool y carga el
+  cache de productos (post_worker_init).
+- Con SIGTERM (o SIGINT) el maestro deja de aceptar conexiones y espera a que los
+  workers terminen las peticiones en curso, hasta API_DRENADO_SEGUNDOS; después
+  cada worker cierra sus conexiones (worker_exit).
+
+Configuración (entorno): API_BIND (0.0.0.0:5000), API_WORKERS (2 x CPU + 1),
+API_HILOS (4), API_TIMEOUT_SEGUNDOS (60), API_DRENADO_SEGUNDOS (30) y
+API_PRECARGA_PRODUCTOS (1000). El pool de cada worker se configura con DB_POOL_SIZE
+y DB_MAX_OVERFLOW (ver db.configuracion_pool): conviene que alcance para API_HILOS.
+
+Importar la aplicación no crea el esquema: antes del primer arranque (y después de
+cada actualización que agregue tablas, columnas o índices) hay que ejecutar
+python db.py bootstrap, una sola vez y no desde cada worker.
+
+Uso:
+    python db.py bootstrap
+    python servidor.py
+    gunicorn -c servidor.py apii:app
+
+La variante ASGI (apii_async.py) se sirve con hypercorn. Requiere gunicorn (solo POSIX).
+"""
+import os
+from sqlalchemy import select
+from sqlalchemy.pool import QueuePool
+
+bind = os.getenv('API_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('API_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('API_HILOS', 4))
+# Una petición que supera este tiempo reinicia su worker
+timeout = int(os.getenv('API_TIMEOUT_SEGUNDOS', 60))
+# Espera máxima para terminar las peticiones en curso al apagar o reiniciar
+graceful_timeout = int(os.getenv('API_DRENADO_SEGUNDOS', 30))
+keepalive = 5
+preload_app = True
+accesslog = '-'
+
+# Productos a cargar en el cache de cada worker al arrancar
+PRECARGA_PRODUCTOS = int(os.getenv('API_PRECARGA_PRODUCTOS', 1000))
+
+
+def calentar_worker(conexiones, productos=PRECARGA_PRODUCTOS):
+    """
+    Abre hasta `conexiones` conexiones del pool (quedan abiertas en el pool) y carga
+    el cache de productos, para que las primeras peticiones no paguen ese costo.
+
+    :param conexiones: Conexiones a abrir (se acota al tamaño del pool).
+    :param productos: Productos a cargar en el cache.
+    :return: (conexiones abiertas, productos cargados).
+    """
+    from db import Session, get_engine
+    from cache import precargar_productos
+
+    engine = get_engine()
+    if isinstance(engine.pool, QueuePool):
+        conexiones = min(conexiones, engine.pool.size())
+    abiertas = []
+    try:
+        # Todas a la vez: de a una, el pool devolvería siempre la misma conexión
+        for _ in range(conexiones):
+            conexion = engine.connect()
+            abiertas.append(conexion)
+            conexion.execute(select(1))
+    finally:
+        for conexion in abiertas:
+            conexion.close()
+
+    session = Session()
+    try:
+        cargados = precargar_productos(session, productos)
+    finally:
+        session.close()
+    return len(abiertas), cargados
+
+
+def post_worker_init(worker):
+    # En el worker, antes de empezar a aceptar conexiones
+    try:
+        conexiones, cargados = calentar_worker(threads)
+        worker.log.info("Worker %s listo: %s conexiones abiertas, %s productos en cache",
+                        worker.pid, conexiones, cargados)
+    except Exception as e:
+        # Sin base disponible el worker arranca igual; /api/health lo reflejará
+        worker.log.warning("Worker %s sin precalentar: %s", worker.pid, e)
+
+
+def worker_exit(server, worker):
+    # Peticiones ya drenadas: se cierran las conexiones de este worker
+    from db import descartar_engines
+    descartar_engines()
+
+
+def _ejecutar():
+    from gunicorn.app.base import BaseApplication
+
+    class ServidorApi(BaseApplication):
+        def load_config(self):
+            for nombre, valor in globals().items():
+                if nombre in self.cfg.settings and valor is not None:
+                    self.cfg.set(nombre, valor)
+
+        def load(self):
+            from apii import app
+            return app
+
+    ServidorApi().run()
+
+
+if __name__ == '__main__':
+    _ejecutar()
@@ -1,16 +1,99 @@
-from db import Cliente, Producto, NotaVenta, DetalleNotaVenta, Session, Amortizacion
+from db import Cliente, Producto, NotaVenta, DetalleNotaVenta, VentaDiaria, Session, Amortizacion, saldos_por_nota, fijar_costos_unitarios
+from ventas import confirmar_nota, confirmar_notas, productos_por_id, insertar_detalles, acumular_ventas_diarias, resumen_ventas_diarias, totales_ventas
+from paginacion import paginar_por_cursor
+from reportes import consulta_reporte, iterar_reporte, exportar_reporte
+from busqueda import filtro_notas, filtro_productos, filtro_nombre, filtro_id_prefijo, es_numerico
 from datetime import date
-from sqlalchemy import cast, String, func, or_, and_
+from sqlalchemy import func, false
 import time
-from sqlalchemy.orm import joinedload
-from calendar import monthrange
-session = Session()
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from sqlalchemy.orm import joinedload, scoped_session
+# Cada función pública es una unidad de trabajo medida (sentencias SQL, ver medicion_sql.py)
+from medicion_sql import medido
+# Sesión por hilo: cada hilo que llama a estas funciones obtiene su propia Session, que se
+# cierra al terminar cada llamada (decorador operacion); las escrituras usan unidad_de_trabajo.
+# Los hilos de trabajo deben llamar a liberar_sesion_hilo() al terminar.
+session = scoped_session(Session)
 from tkinter import messagebox
 # Crear la sesión con la base de datos
 
 Text_exito = "Éxito"
 Text_Nota_Venta="La nota de venta no existe."
 
+@contextmanager
+def unidad_de_trabajo():
+    """
+    Unidad de trabajo sobre la sesión del hilo actual: hace commit si el bloque
+    termina sin errores, rollback si lanza una excepción y siempre cierra la sesión.
+
+    Uso:
+        with unidad_de_trabajo() as s:
+            s.add(...)
+    """
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+def liberar_sesion_hilo():
+    """
+    Cierra y descarta la sesión del hilo actual. Los hilos de trabajo deben
+    llamarla al terminar para no dejar conexiones ni sesiones retenidas.
+    """
+    session.remove()
+
+_llamada_en_curso = ContextVar('sistema_llamada_en_curso', default=False)
+
+def operacion(funcion):
+    """
+    Decorador de las funciones públicas: cada llamada es una unidad de trabajo medida
+    (medicion_sql.medido) y al terminar se cierra la sesión del hilo, de modo que el
+    mapa de identidad no crece entre llamadas. Los objetos devueltos quedan separados
+    de la sesión con los atributos y relaciones que ya se cargaron.
+    """
+    medida = medido(funcion)
+
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        # Una llamada anidada usa la sesión de la llamada de afuera
+        if _llamada_en_curso.get():
+            return medida(*args, **kwargs)
+        token = _llamada_en_curso.set(True)
+        try:
+            return medida(*args, **kwargs)
+        finally:
+            _llamada_en_curso.reset(token)
+            session.close()
+    return envoltura
+
+@contextmanager
+def edicion_de_nota(id_nota):
+    """
+    Envuelve la edición de los detalles de una nota. Si la nota ya está vendida
+    (estado "Cancelado"), sus líneas salen del acumulado diario antes de editarlas
+    y vuelven a sumarse después, en la misma transacción. Las líneas existentes
+    conservan el costo fijado al confirmar; las agregadas toman el costo actual.
+
+    Uso:
+        with unidad_de_trabajo(), edicion_de_nota(id_nota) as nota:
+            ...
+    """
+    nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
+    vendida = nota is not None and nota.estado == "Cancelado" and nota.fecha_venta is not None
+    if vendida:
+        acumular_ventas_diarias(session, id_nota, nota.fecha_venta, signo=-1)
+    yield nota
+    if vendida:
+        session.flush()
+        fijar_costos_unitarios(session, [id_nota])
+        acumular_ventas_diarias(session, id_nota, nota.fecha_venta)
+
+@operacion
 def agregar_cliente(nombre, direccion, telefono, dni):
     """
     Función que agrega un cliente a la base de datos
@@ -20,27 +103,24 @@ def agregar_cliente(nombre, direccion, telefono, dni):
         if not nombre or not dni:
             raise ValueError("El nombre y el DNI son campos obligatorios")
         
-        # Verificar si el cliente ya existe por nombre y DNI
-        cliente_existente = session.query(Cliente).filter_by(dni=dni, nombre=nombre).first()
-        if cliente_existente:
-            raise ValueError("El cliente ya existe con este DNI y nombre")
-        # Crear el nuevo cliente
-        nuevo_cliente = Cliente(
-            nombre=nombre,
-            direccion=direccion,
-            telefono=telefono,
-            dni=dni
-        )
-        session.add(nuevo_cliente)
-        session.commit()
+        with unidad_de_trabajo():
+            # Verificar si el cliente ya existe por nombre y DNI
+            cliente_existente = session.query(Cliente).filter_by(dni=dni, nombre=nombre).first()
+            if cliente_existente:
+                raise ValueError("El cliente ya existe con este DNI y nombre")
+            # Crear el nuevo cliente
+            nuevo_cliente = Cliente(
+                nombre=nombre,
+                direccion=direccion,
+                telefono=telefono,
+                dni=dni
+            )
+            session.add(nuevo_cliente)
         messagebox.showinfo(Text_exito, f"Cliente '{nombre}' creado exitosamente")
     
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", str(e))
-    
-    finally:
-        session.close()
+@operacion
 def agregar_producto(nombre, stock, costo, precio_inicial=None):
     """
     Función que agrega un producto a la base de datos
@@ -50,27 +130,24 @@ def agregar_producto(nombre, stock, costo, precio_inicial=None):
         if not nombre or not stock or not costo:
             raise ValueError("Todos los campos son obligatorios")
         
-        # Verificar si el producto ya existe
-        producto_existente = session.query(Producto).filter_by(nombre=nombre).first()
-        if producto_existente:
-            raise ValueError("El producto ya existe con este nombre")
-        # Crear el nuevo producto
-        nuevo_producto = Producto(
-            nombre=nombre,
-            stock=stock,
-            costo=costo,
-            precio_inicial=precio_inicial
-        )
-        session.add(nuevo_producto)
-        session.commit()
+        with unidad_de_trabajo():
+            # Verificar si el producto ya existe
+            producto_existente = session.query(Producto).filter_by(nombre=nombre).first()
+            if producto_existente:
+                raise ValueError("El producto ya existe con este nombre")
+            # Crear el nuevo producto
+            nuevo_producto = Producto(
+                nombre=nombre,
+                stock=stock,
+                costo=costo,
+                precio_inicial=precio_inicial
+            )
+            session.add(nuevo_producto)
         messagebox.showinfo(Text_exito, f"Producto '{nombre}' creado exitosamente")
     
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", str(e))
-    
-    finally:
-        session.close()
+@operacion
 def obtener_todos_los_clientes():
     """
     Función que obtiene todos los clientes de la base de datos.
@@ -81,9 +158,11 @@ def obtener_todos_los_clientes():
     except Exception as e:
         messagebox.showerror("Error", f"Error al obtener los clientes: {e}")
         return []
+@operacion
 def obtener_todos_los_productos():
     # Devuelve los productos ordenados por id_producto
     return session.query(Producto).order_by(Producto.id_producto).all()
+@operacion
 def obtener_todos_los_productos_1():
     # Devuelve los productos ordenados por id_producto
     try:
@@ -92,33 +171,31 @@ def obtener_todos_los_productos_1():
     except Exception as e:
         messagebox.showerror("Error", f"Error al obtener los productos: {e}")
         return []
+@operacion
 def obtener_todas_las_notas():
     """
     Función que obtiene todas las notas de venta de la base de datos.
     """
     try:
-        notas = session.query(NotaVenta).order_by(NotaVenta.id_nota.asc()).all()
+        notas = session.query(NotaVenta).options(joinedload(NotaVenta.cliente)).order_by(NotaVenta.id_nota.asc()).all()
         return notas
     except Exception as e:
         messagebox.showerror("Error", f"Error al obtener las notas de venta: {e}")
         return []
+def _filtrar_notas(query_base, filtro_texto, filtro_estado_pedido):
+    # Filtro por texto (nombre cliente, estado o id) usando los índices de búsqueda
+    if filtro_texto:
+        query_base = query_base.filter(filtro_notas(session, filtro_texto))
+    # Filtro por estado_pedido (columna NotaVenta.estado_pedido)
+    if filtro_estado_pedido:
+        query_base = query_base.filter(NotaVenta.estado_pedido == filtro_estado_pedido)
+    return query_base
+@operacion
 def obtener_notas_paginadas(filtro_texto="", page=1, per_page=50, filtro_estado_pedido=None):
     try:
         # Consulta base
         query_base = session.query(NotaVenta).join(Cliente).options(joinedload(NotaVenta.cliente))
-        # Filtro por texto (nombre cliente, estado o id)
-        if filtro_texto:
-            filtro_texto = f"%{filtro_texto.lower()}%"
-            query_base = query_base.filter(
-                or_(
-                    func.lower(Cliente.nombre).like(filtro_texto),
-                    func.lower(NotaVenta.estado).like(filtro_texto),
-                    func.cast(NotaVenta.id_nota, String).like(filtro_texto)
-                )
-            )
-        # Filtro por estado_pedido (columna NotaVenta.estado_pedido)
-        if filtro_estado_pedido:
-            query_base = query_base.filter(NotaVenta.estado_pedido == filtro_estado_pedido)
+        query_base = _filtrar_notas(query_base, filtro_texto, filtro_estado_pedido)
         # Contar total de registros antes de paginar
         total_registros = query_base.count()
         # Obtener datos paginados
@@ -129,6 +206,23 @@ def obtener_notas_paginadas(filtro_texto="", page=1, per_page=50, filtro_estado_
     except Exception as e:
         messagebox.showerror("Error", f"Error al obtener las notas de venta: {e}")
         return [], 0
+@operacion
+def obtener_notas_por_cursor(filtro_texto="", cursor=None, per_page=50, filtro_estado_pedido=None):
+    """
+    Variante keyset de obtener_notas_paginadas: el costo no depende de la página.
+    
+    :param cursor: Cursor devuelto por la llamada anterior, o None para la primera página.
+    :return: Tupla (notas, siguiente_cursor); siguiente_cursor es None en la última página.
+    """
+    try:
+        query_base = session.query(NotaVenta).join(Cliente).options(joinedload(NotaVenta.cliente))
+        query_base = _filtrar_notas(query_base, filtro_texto, filtro_estado_pedido)
+        filtros = {"texto": filtro_texto, "estado_pedido": filtro_estado_pedido}
+        return paginar_por_cursor(query_base, NotaVenta.id_nota, cursor, per_page, filtros)
+    except Exception as e:
+        messagebox.showerror("Error", f"Error al obtener las notas de venta: {e}")
+        return [], None
+@operacion
 def eliminar_cliente(id_cliente, tabla_clientes, selected_item):
     """
     Función para eliminar un cliente de la base de datos y de la tabla gráfica.
@@ -138,20 +232,22 @@ def eliminar_cliente(id_cliente, tabla_clientes, selected_item):
     :param selected_item: Referencia al item seleccionado en el Treeview.
     """
     try:
-        # Buscar al cliente en la base de datos
-        cliente = session.query(Cliente).filter_by(id_cliente=id_cliente).first()
+        with unidad_de_trabajo():
+            # Buscar al cliente en la base de datos
+            cliente = session.query(Cliente).filter_by(id_cliente=id_cliente).first()
+            if cliente:
+                nombre = cliente.nombre
+                # Eliminar el cliente de la base de datos
+                session.delete(cliente)
         if cliente:
-            # Eliminar el cliente de la base de datos
-            session.delete(cliente)
-            session.commit()
             # Eliminar la fila de la tabla gráfica
             tabla_clientes.delete(selected_item)
-            messagebox.showinfo(Text_exito, f"Cliente {cliente.nombre} eliminado correctamente")
+            messagebox.showinfo(Text_exito, f"Cliente {nombre} eliminado correctamente")
         else:
             messagebox.showerror("Error", "Cliente no encontrado en la base de datos")
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", f"No se pudo eliminar el cliente: {e}")
+@operacion
 def crear_nota_venta(id_cliente, productos_cantidades, observaciones=None):
     """
     Función para crear una nueva nota de venta.
@@ -160,7 +256,7 @@ def crear_nota_venta(id_cliente, productos_cantidades, observaciones=None):
     :param productos_cantidades: Lista de tuplas (id_producto, cantidad).
     :param observaciones: Observaciones adicionales de la nota de venta.
     """
-    try:
+    with unidad_de_trabajo():
         # Obtener el cliente
         cliente = session.query(Cliente).filter_by(id_cliente=id_cliente).first()
         if not cliente:
@@ -176,39 +272,38 @@ def crear_nota_venta(id_cliente, productos_cantidades, observaciones=None):
         )
         session.add(nueva_nota)
         session.flush()  # Para obtener el id_nota generado automáticamente
+        id_nota = nueva_nota.id_nota
+        # Cargar todos los productos de la nota en una sola consulta
+        productos = productos_por_id(session, (linea[0] for linea in productos_cantidades))
         # Total acumulado de la venta
         total_venta = 0
-        # Procesar los productos
+        detalles = []
+        # Validar los productos en memoria y preparar los detalles
         for id_producto, cantidad, precio_unitario, talla, color in productos_cantidades:
-            producto = session.query(Producto).filter_by(id_producto=id_producto).first()
+            producto = productos.get(id_producto)
             if not producto:
                 raise ValueError(f"El producto con ID {id_producto} no existe")
             if producto.stock < cantidad:
                 raise ValueError(f"No hay suficiente stock para el producto {producto.nombre}")
             subtotal = precio_unitario * cantidad
             subtotal = round(subtotal, 2)  # Redondear a 2 decimales
-            # Crear el detalle de la nota de venta
-            detalle_nota = DetalleNotaVenta(
-                id_nota=nueva_nota.id_nota,
-                id_producto=id_producto,
-                cantidad=cantidad,
-                precio_unitario=precio_unitario,
-                talla=talla,
-                color=color,
-                subtotal=subtotal
-            )
-            session.add(detalle_nota)
-            # Descontar el stock del producto
-            #producto.stock -= cantidad
+            detalles.append({
+                "id_nota": id_nota,
+                "id_producto": id_producto,
+                "cantidad": cantidad,
+                "precio_unitario": precio_unitario,
+                "talla": talla,
+                "color": color,
+                "subtotal": subtotal
+            })
             # Sumar al total de la venta
             total_venta += subtotal
+        # Insertar todos los detalles de la nota de una vez
+        insertar_detalles(session, detalles)
         # Actualizar el total de la nota de venta
         nueva_nota.total = round(total_venta,2)
-        session.commit()
-        return nueva_nota.id_nota, total_venta
-    except Exception as e:
-        session.rollback()
-        raise e
+    return id_nota, total_venta
+@operacion
 def obtener_producto_por_id(id_producto):
     """
     Función para obtener un producto por su ID.
@@ -217,6 +312,7 @@ def obtener_producto_por_id(id_producto):
     :return: Producto si existe, None si no existe.
     """
     return session.query(Producto).filter_by(id_producto=id_producto).first()
+@operacion
 def obtener_cliente_por_id(id_cliente):
     """
     Función para obtener un cliente por su ID.
@@ -225,14 +321,15 @@ def obtener_cliente_por_id(id_cliente):
     :return: Cliente si existe, None si no existe.
     """
     return session.query(Cliente).filter_by(id_cliente=id_cliente).first()
-def obtener_productos_paginados(filtro_texto=None, solo_stock=False, pagina=1, tamanio_pagina=50):
-    query = session.query(Producto)
+def _filtrar_productos(query, filtro_texto, solo_stock):
     if filtro_texto:
-        texto = f"%{filtro_texto.lower()}%"
-        query = query.filter(func.lower(Producto.nombre).like(texto) | 
-                             func.cast(Producto.id_producto, String).like(texto))
+        query = query.filter(filtro_productos(session, filtro_texto))
     if solo_stock:
         query = query.filter(Producto.stock > 0)
+    return query
+@operacion
+def obtener_productos_paginados(filtro_texto=None, solo_stock=False, pagina=1, tamanio_pagina=50):
+    query = _filtrar_productos(session.query(Producto), filtro_texto, solo_stock)
     total = query.count()  # Cantidad total de registros que cumplen el filtro
     productos = (query
                 .order_by(Producto.id_producto.desc())
@@ -240,6 +337,18 @@ def obtener_productos_paginados(filtro_texto=None, solo_stock=False, pagina=1, t
                 .limit(tamanio_pagina)
                 .all())
     return productos, total
+@operacion
+def obtener_productos_por_cursor(filtro_texto=None, solo_stock=False, cursor=None, tamanio_pagina=50):
+    """
+    Variante keyset de obtener_productos_paginados.
+    
+    :param cursor: Cursor devuelto por la llamada anterior, o None para la primera página.
+    :return: Tupla (productos, siguiente_cursor); siguiente_cursor es None en la última página.
+    """
+    query = _filtrar_productos(session.query(Producto), filtro_texto, solo_stock)
+    filtros = {"texto": filtro_texto, "solo_stock": bool(solo_stock)}
+    return paginar_por_cursor(query, Producto.id_producto, cursor, tamanio_pagina, filtros)
+@operacion
 def obtener_detalles_nota_por_id_nota(id_nota):
     """
     Función para obtener los detalles de una nota de venta por su ID.
@@ -247,30 +356,26 @@ def obtener_detalles_nota_por_id_nota(id_nota):
     :param id_nota: ID de la nota de venta.
     :return: Lista de detalles de la nota de venta.
     """
-    return session.query(DetalleNotaVenta).filter_by(id_nota=id_nota).all()
+    return session.query(DetalleNotaVenta).options(joinedload(DetalleNotaVenta.producto)).filter_by(id_nota=id_nota).all()
+@operacion
 def obtener_nota_venta_por_id(id_nota):
-    return session.query(NotaVenta).filter_by(id_nota=id_nota).first()
+    return session.query(NotaVenta).options(joinedload(NotaVenta.cliente)).filter_by(id_nota=id_nota).first()
+@operacion
 def agregar_amortizacion(id_nota, monto):
-    try:
+    with unidad_de_trabajo():
         nueva_amortizacion = Amortizacion(
             id_nota=id_nota,
             monto=monto
         )
         session.add(nueva_amortizacion)
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        raise e 
+@operacion
 def eliminar_amortizacion(id_amortizacion):
-    try:
+    with unidad_de_trabajo():
         amortizacion = session.query(Amortizacion).filter_by(id_amortizacion=id_amortizacion).first()
         if not amortizacion:
             raise ValueError("La amortización no existe.")
         session.delete(amortizacion)
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        raise e
+@operacion
 def obtener_amortizaciones_por_id_nota(id_nota):
     """
     Función para obtener todas las amortizaciones asociadas a una nota de venta por su ID.
@@ -279,73 +384,75 @@ def obtener_amortizaciones_por_id_nota(id_nota):
     :return: Lista de amortizaciones asociadas a la nota de venta.
     """
     return session.query(Amortizacion).filter_by(id_nota=id_nota).all()
+@operacion
 def agregar_venta(id_nota):
     try:
-        # Obtener la nota de venta
-        nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-        if not nota:
-            raise ValueError(Text_Nota_Venta)
-        # Verificar que haya suficientes productos en stock antes de proceder
-        detalles = session.query(DetalleNotaVenta).filter_by(id_nota=id_nota).all()
-        for detalle in detalles:
-            producto = session.query(Producto).filter_by(id_producto=detalle.id_producto).first()
-            if not producto:
-                raise ValueError(f"El producto con ID {detalle.id_producto} no existe.")
-            if producto.stock < detalle.cantidad:
-                raise ValueError(f"El producto '{producto.nombre}' no tiene suficiente stock. Disponible: {producto.stock}, Requerido: {detalle.cantidad}.")
-        # Reducir el stock de los productos asociados a la nota de venta
-        for detalle in detalles:
-            producto = session.query(Producto).filter_by(id_producto=detalle.id_producto).first()
-            producto.stock -= detalle.cantidad
-        # Cambiar el estado de la nota de venta a "Cancelado"
-        nota.estado = "Cancelado"
-        nota.fecha_venta = date.today()
-        
-        session.commit()
+        with unidad_de_trabajo():
+            # Descuenta el stock de todas las líneas en un solo UPDATE condicionado;
+            # si alguna línea no alcanza se lanza StockInsuficiente con el detalle
+            confirmar_nota(session, id_nota)
         messagebox.showinfo(Text_exito, f"Venta confirmada exitosamente para la Nota de Venta ID: {id_nota}")
     
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", f"No se pudo confirmar la venta: {e}")
+@operacion
+def agregar_ventas(ids_notas):
+    """
+    Confirma la venta de varias notas (p. ej. en el cierre del día) en una sola transacción.
+    Las notas que no se pueden confirmar se informan sin impedir las demás.
     
-    finally:
-        session.close()
+    :param ids_notas: IDs de las notas a confirmar.
+    :return: Tupla (ids confirmados, {id_nota: motivo del rechazo}).
+    """
+    try:
+        with unidad_de_trabajo():
+            confirmadas, rechazadas = confirmar_notas(session, ids_notas)
+            ids_confirmados = [nota.id_nota for nota in confirmadas]
+        rechazos = {id_nota: str(error) for id_nota, error in rechazadas.items()}
+        mensaje = f"Ventas confirmadas: {len(ids_confirmados)}"
+        if rechazos:
+            detalle = "\n".join(f"Nota {id_nota}: {motivo}" for id_nota, motivo in rechazos.items())
+            messagebox.showwarning("Atención", f"{mensaje}\nNo se pudieron confirmar {len(rechazos)}:\n{detalle}")
+        else:
+            messagebox.showinfo(Text_exito, mensaje)
+        return ids_confirmados, rechazos
+    
+    except Exception as e:
+        messagebox.showerror("Error", f"No se pudieron confirmar las ventas: {e}")
+        return [], {}
+@operacion
 def modificar_producto(id_producto, nombre, stock, costo, precio_inicial=None):
     """
     Modificando función para incluir precio_inicial
     """
     try:
-        # Obtener el producto existente
-        producto = session.query(Producto).filter_by(id_producto=id_producto).first()
-        if not producto:
-            raise ValueError("El producto no existe.")
-        # Actualizar los campos del producto
-        producto.nombre = nombre
-        producto.stock = stock
-        producto.costo = costo
-        producto.precio_inicial = precio_inicial
-        session.commit()
-        messagebox.showinfo(Text_exito, f"Producto '{producto.nombre}' modificado exitosamente.")
+        with unidad_de_trabajo():
+            # Obtener el producto existente
+            producto = session.query(Producto).filter_by(id_producto=id_producto).first()
+            if not producto:
+                raise ValueError("El producto no existe.")
+            # Actualizar los campos del producto
+            producto.nombre = nombre
+            producto.stock = stock
+            producto.costo = costo
+            producto.precio_inicial = precio_inicial
+        messagebox.showinfo(Text_exito, f"Producto '{nombre}' modificado exitosamente.")
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", f"No se pudo modificar el producto: {e}")
-    finally:
-        session.close()
+@operacion
 def eliminar_producto(id_producto):
     try:
-        # Obtener el producto existente
-        producto = session.query(Producto).filter_by(id_producto=id_producto).first()
-        if not producto:
-            raise ValueError("El producto no existe.")
-        # Confirmar la eliminación
-        session.delete(producto)
-        session.commit()
+        with unidad_de_trabajo():
+            # Obtener el producto existente
+            producto = session.query(Producto).filter_by(id_producto=id_producto).first()
+            if not producto:
+                raise ValueError("El producto no existe.")
+            # Confirmar la eliminación
+            session.delete(producto)
         messagebox.showinfo(Text_exito, f"Producto con ID {id_producto} eliminado exitosamente.")
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", f"No se pudo eliminar el producto: {e}")
-    finally:
-        session.close()
+@operacion
 def obtener_costo_total_inventario():
     """
     Calcula la sumatoria del costo total del inventario.
@@ -357,160 +464,151 @@ def obtener_costo_total_inventario():
     except Exception as e:
         messagebox.showerror("Error", f"Error al calcular el costo total del inventario: {e}")
         return 0
+@operacion
 def modificar_cliente(id_cliente, nombre, direccion, telefono, dni):
     try:
-        # Obtener el cliente existente
-        cliente = session.query(Cliente).filter_by(id_cliente=id_cliente).first()
-        if not cliente:
-            raise ValueError("El cliente no existe.")
-        # Actualizar los datos del cliente
-        cliente.nombre = nombre
-        cliente.direccion = direccion
-        cliente.telefono = telefono
-        cliente.dni = dni
-        session.commit()
+        with unidad_de_trabajo():
+            # Obtener el cliente existente
+            cliente = session.query(Cliente).filter_by(id_cliente=id_cliente).first()
+            if not cliente:
+                raise ValueError("El cliente no existe.")
+            # Actualizar los datos del cliente
+            cliente.nombre = nombre
+            cliente.direccion = direccion
+            cliente.telefono = telefono
+            cliente.dni = dni
         messagebox.showinfo(Text_exito, f"Cliente '{nombre}' modificado exitosamente.")
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", f"No se pudo modificar el cliente: {e}")
-    finally:
-        session.close()
+@operacion
 def eliminar_nota_venta(id_nota):
     try:
-        # Obtener la nota de venta existente
-        nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-        if not nota:
-            raise ValueError(Text_Nota_Venta)
-        # Confirmar la eliminación
-        session.delete(nota)
-        session.commit()
+        with unidad_de_trabajo():
+            # Obtener la nota de venta existente
+            nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
+            if not nota:
+                raise ValueError(Text_Nota_Venta)
+            # Una nota ya vendida deja de contar en el acumulado diario
+            if nota.estado == "Cancelado" and nota.fecha_venta:
+                acumular_ventas_diarias(session, id_nota, nota.fecha_venta, signo=-1)
+            # Confirmar la eliminación
+            session.delete(nota)
         messagebox.showinfo(Text_exito, f"Nota de Venta con ID {id_nota} eliminada exitosamente.")
     except Exception as e:
-        session.rollback()
         messagebox.showerror("Error", f"No se pudo eliminar la nota de venta: {e}")
-    finally:
-        session.close()
+@operacion
 def actualizar_observaciones_nota(id_nota, observaciones):
     """
     Nueva función para actualizar observaciones de una nota de venta
     """
-    try:
+    with unidad_de_trabajo():
         nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
         if not nota:
             raise ValueError(Text_Nota_Venta)
         
         nota.observaciones = observaciones
-        session.commit()
-        return True
-    except Exception as e:
-        session.rollback()
-        raise e
+    return True
+@operacion
 def obtener_observaciones_nota(id_nota):
-    try:
-        nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-        if not nota:
-            raise ValueError(Text_Nota_Venta)
-        
-        return nota.observaciones
-    except Exception as e:
-        session.rollback()
-        raise e
+    nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
+    if not nota:
+        raise ValueError(Text_Nota_Venta)
+    
+    return nota.observaciones
+@operacion
 def actualizar_nota_venta_mejorada(id_nota, nuevos_detalles, productos_a_eliminar):
     """
     Versión mejorada que permite actualizar productos existentes sin eliminar todo
     """
     try:
-        # Primero eliminar solo los productos marcados para eliminar
-        for id_producto in productos_a_eliminar:
-            session.query(DetalleNotaVenta).filter_by(id_nota=id_nota, id_producto=id_producto).delete()
-        detalles_existentes = session.query(DetalleNotaVenta).filter_by(id_nota=id_nota).all()
+        with unidad_de_trabajo(), edicion_de_nota(id_nota) as nota:
+            # Primero eliminar solo los productos marcados para eliminar
+            for id_producto in productos_a_eliminar:
+                session.query(DetalleNotaVenta).filter_by(id_nota=id_nota, id_producto=id_producto).delete()
+            detalles_existentes = session.query(DetalleNotaVenta).filter_by(id_nota=id_nota).all()
         
-        # Crear diccionario de detalles existentes por id_producto
-        detalles_dict = {detalle.id_producto: detalle for detalle in detalles_existentes}
+            # Crear diccionario de detalles existentes por id_producto
+            detalles_dict = {detalle.id_producto: detalle for detalle in detalles_existentes}
         
-        total = 0
-        productos_procesados = set()
+            total = 0
+            productos_procesados = set()
         
-        for detalle_data in nuevos_detalles:
-            id_producto, cantidad, precio_unitario, color, talla, subtotal = detalle_data
-            productos_procesados.add(id_producto)
+            for detalle_data in nuevos_detalles:
+                id_producto, cantidad, precio_unitario, color, talla, subtotal = detalle_data
+                productos_procesados.add(id_producto)
             
-            if id_producto in detalles_dict:
-                detalle_existente = detalles_dict[id_producto]
-                detalle_existente.cantidad = cantidad
-                detalle_existente.precio_unitario = precio_unitario
-                detalle_existente.color = color
-                detalle_existente.talla = talla
-                detalle_existente.subtotal = round(subtotal, 2)
-            else:
-                nuevo_detalle = DetalleNotaVenta(
-                    id_nota=id_nota,
-                    id_producto=id_producto,
-                    cantidad=cantidad,
-                    precio_unitario=precio_unitario,
-                    color=color,
-                    talla=talla,
-                    subtotal=round(subtotal, 2)
-                )
-                session.add(nuevo_detalle)
+                if id_producto in detalles_dict:
+                    detalle_existente = detalles_dict[id_producto]
+                    detalle_existente.cantidad = cantidad
+                    detalle_existente.precio_unitario = precio_unitario
+                    detalle_existente.color = color
+                    detalle_existente.talla = talla
+                    detalle_existente.subtotal = round(subtotal, 2)
+                else:
+                    nuevo_detalle = DetalleNotaVenta(
+                        id_nota=id_nota,
+                        id_producto=id_producto,
+                        cantidad=cantidad,
+                        precio_unitario=precio_unitario,
+                        color=color,
+                        talla=talla,
+                        subtotal=round(subtotal, 2)
+                    )
+                    session.add(nuevo_detalle)
             
-            total += subtotal
-        
-        for id_producto, detalle in detalles_dict.items():
-            if id_producto not in productos_procesados:
-                session.delete(detalle)
+                total += subtotal
         
-        # Actualizar el total de la nota de venta
-        nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-        if nota:
-            nota.total = round(total, 2)
-        session.commit()
+            for id_producto, detalle in detalles_dict.items():
+                if id_producto not in productos_procesados:
+                    session.delete(detalle)
         
+            # Actualizar el total de la nota de venta
+            if nota:
+                nota.total = round(total, 2)
     except Exception as e:
-        session.rollback()
         print(f"Error al actualizar la nota de venta: {e}")
         raise e
+@operacion
 def actualizar_detalle_producto(id_nota, id_producto, cantidad=None, precio_unitario=None, color=None, talla=None):
     """
     Actualiza campos específicos de un detalle de producto sin afectar otros
     """
     try:
-        detalle = session.query(DetalleNotaVenta).filter_by(
-            id_nota=id_nota, 
-            id_producto=id_producto
-        ).first()
-        
-        if not detalle:
-            raise ValueError(f"No se encontró el detalle para el producto {id_producto} en la nota {id_nota}")
-        
-        # Actualizar solo los campos proporcionados
-        if cantidad is not None:
-            detalle.cantidad = cantidad
-        if precio_unitario is not None:
-            detalle.precio_unitario = precio_unitario
-        if color is not None:
-            detalle.color = color
-        if talla is not None:
-            detalle.talla = talla
+        with unidad_de_trabajo(), edicion_de_nota(id_nota) as nota:
+            detalle = session.query(DetalleNotaVenta).filter_by(
+                id_nota=id_nota, 
+                id_producto=id_producto
+            ).first()
             
-        # Recalcular subtotal
-        detalle.subtotal = round(detalle.cantidad * detalle.precio_unitario, 2)
-        
-        # Recalcular total de la nota
-        total_nota = session.query(func.sum(DetalleNotaVenta.subtotal)).filter_by(id_nota=id_nota).scalar() or 0
-        nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-        if nota:
-            nota.total = round(total_nota, 2)
+            if not detalle:
+                raise ValueError(f"No se encontró el detalle para el producto {id_producto} en la nota {id_nota}")
+            
+            # Actualizar solo los campos proporcionados
+            if cantidad is not None:
+                detalle.cantidad = cantidad
+            if precio_unitario is not None:
+                detalle.precio_unitario = precio_unitario
+            if color is not None:
+                detalle.color = color
+            if talla is not None:
+                detalle.talla = talla
+                
+            # Recalcular subtotal
+            detalle.subtotal = round(detalle.cantidad * detalle.precio_unitario, 2)
+            
+            # Recalcular total de la nota
+            total_nota = session.query(func.sum(DetalleNotaVenta.subtotal)).filter_by(id_nota=id_nota).scalar() or 0
+            if nota:
+                nota.total = round(total_nota, 2)
         
-        session.commit()
         print(f"Detalle del producto {id_producto} actualizado exitosamente")
         
     except Exception as e:
-        session.rollback()
         print(f"Error al actualizar detalle del producto: {e}")
         raise e
+@operacion
 def agregar_detalle_nota(id_nota, id_producto, cantidad, precio_unitario, color, talla, subtotal):
-    try:
+    with unidad_de_trabajo(), edicion_de_nota(id_nota):
         nuevo_detalle = DetalleNotaVenta(
             id_nota=id_nota,
             id_producto=id_producto,
@@ -521,10 +619,7 @@ def agregar_detalle_nota(id_nota, id_producto, cantidad, precio_unitario, color,
             subtotal=subtotal
         )
         session.add(nuevo_detalle)
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        raise e
+@operacion
 def eliminar_detalle_nota(id_nota, id_producto):
     """
     Elimina un detalle de una nota de venta.
@@ -532,25 +627,23 @@ def eliminar_detalle_nota(id_nota, id_producto):
     :param id_producto: ID del producto a eliminar del detalle.
     """
     try:
-        # Buscar el detalle a eliminar
-        detalle = session.query(DetalleNotaVenta).filter_by(id_nota=id_nota, id_producto=id_producto).first()
-        if not detalle:
-            raise ValueError("El detalle no existe en la nota de venta.")
-        # Eliminar el detalle
-        session.delete(detalle)
-        # Recalcular el total de la nota
-        nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-        if nota:
+        with unidad_de_trabajo(), edicion_de_nota(id_nota) as nota:
+            # Buscar el detalle a eliminar
+            detalle = session.query(DetalleNotaVenta).filter_by(id_nota=id_nota, id_producto=id_producto).first()
+            if not detalle:
+                raise ValueError("El detalle no existe en la nota de venta.")
+            # Eliminar el detalle
+            session.delete(detalle)
+            # Recalcular el total de la nota
+            if not nota:
+                raise ValueError(Text_Nota_Venta)
             nota.total -= detalle.subtotal  # Resta el subtotal del detalle eliminado
-            session.commit()
-            print(f"Detalle del producto ID {id_producto} eliminado de la nota de venta ID {id_nota}.")
-        else:
-            raise ValueError(Text_Nota_Venta)
+        print(f"Detalle del producto ID {id_producto} eliminado de la nota de venta ID {id_nota}.")
     
     except Exception as e:
-        session.rollback()
         raise ValueError(f"No se pudo eliminar el detalle de la nota de venta: {e}")
 # Ganancias
+@operacion
 def obtener_ventas_por_fecha(fecha_inicio, fecha_fin):
     # Cargamos las ventas canceladas con sus detalles en una sola consulta
     ventas = session.query(NotaVenta).filter(
@@ -560,24 +653,74 @@ def obtener_ventas_por_fecha(fecha_inicio, fecha_fin):
         joinedload(NotaVenta.detalles).joinedload(DetalleNotaVenta.producto)  # Carga los detalles y productos en una sola consulta
     ).all()
     return ventas
+def _costo_de_linea(detalle):
+    # Misma regla que ventas.costo_de_linea: el costo fijado al confirmar o, si falta, el actual del producto
+    if detalle.costo_unitario is not None:
+        return detalle.costo_unitario
+    return (detalle.producto.costo if detalle.producto else None) or 0
+@operacion
 def calcular_ganancia(ventas):
     return sum(
-        (detalle.precio_unitario - detalle.producto.costo) * detalle.cantidad
+        (detalle.precio_unitario - _costo_de_linea(detalle)) * detalle.cantidad
         for venta in ventas
         for detalle in venta.detalles
     )
+@operacion
 def calcular_total(ventas):
     return sum(
         detalle.precio_unitario * detalle.cantidad
         for venta in ventas
         for detalle in venta.detalles
     )
+@operacion
 def calcular_costo_total(ventas):
     return sum(
-        detalle.producto.costo * detalle.cantidad
+        _costo_de_linea(detalle) * detalle.cantidad
         for venta in ventas
         for detalle in venta.detalles
     )
+@operacion
+def obtener_ventas_diarias(fecha_inicio, fecha_fin):
+    """
+    Ventas confirmadas de un rango leídas del acumulado diario (ventas_diarias):
+    una fila por día y producto, con unidades, ingresos y costo, sin recorrer las
+    notas ni sus detalles. Para los totales del rango ver obtener_resumen_ventas.
+    
+    :param fecha_inicio: Primer día del rango (inclusive).
+    :param fecha_fin: Último día del rango (inclusive).
+    :return: Lista de VentaDiaria con su producto cargado.
+    """
+    return session.query(VentaDiaria).filter(
+        VentaDiaria.fecha_venta.between(fecha_inicio, fecha_fin)
+    ).options(
+        joinedload(VentaDiaria.producto)  # Carga los productos en la misma consulta
+    ).order_by(VentaDiaria.fecha_venta, VentaDiaria.id_producto).all()
+@operacion
+def obtener_resumen_ventas(fecha_inicio, fecha_fin, por_producto=False):
+    """
+    Ganancia, total y costo de un rango de fechas leídos del acumulado diario
+    (ventas_diarias), sin cargar las notas ni sus detalles.
+    
+    :param fecha_inicio: Primer día del rango (inclusive).
+    :param fecha_fin: Último día del rango (inclusive).
+    :param por_producto: Si es True devuelve una fila por producto vendido.
+    :return: Diccionario con unidades, total, costo y ganancia (o lista por producto).
+    """
+    return resumen_ventas_diarias(session, fecha_inicio, fecha_fin, por_producto)
+@operacion
+def obtener_totales_ventas(fecha_inicio, fecha_fin, agrupar_por=None):
+    """
+    Ganancia, total y costo de las ventas de un rango calculados en SQL en una
+    sola consulta; mismo resultado que calcular_ganancia, calcular_total y
+    calcular_costo_total sobre obtener_ventas_por_fecha, sin cargar los objetos.
+    
+    :param fecha_inicio: Primer día del rango (inclusive).
+    :param fecha_fin: Último día del rango (inclusive).
+    :param agrupar_por: None, "producto", "cliente" o "dia".
+    :return: Diccionario con unidades, total, costo y ganancia (o lista por grupo).
+    """
+    return totales_ventas(session, fecha_inicio, fecha_fin, agrupar_por)
+@operacion
 def obtener_productos_vendidos(ventas):
     return [
         {
@@ -585,11 +728,32 @@ def obtener_productos_vendidos(ventas):
             'cantidad': detalle.cantidad,
             'precio_unitario': detalle.precio_unitario,
             'subtotal': detalle.precio_unitario * detalle.cantidad,
-            'costo': detalle.producto.costo
+            'costo': _costo_de_linea(detalle)
         }
         for venta in ventas
         for detalle in venta.detalles
     ]
+@operacion
+def obtener_productos_vendidos_por_dia(ventas_diarias):
+    """
+    Productos vendidos a partir de las filas de obtener_ventas_diarias: una por día
+    y producto, con precio_unitario y costo promedio por unidad.
+    
+    :param ventas_diarias: Lista de VentaDiaria.
+    :return: Lista de diccionarios con fecha_venta, producto, cantidad, precio_unitario, subtotal y costo.
+    """
+    return [
+        {
+            'fecha_venta': venta.fecha_venta,
+            'producto': venta.producto.nombre if venta.producto else None,
+            'cantidad': venta.unidades,
+            'precio_unitario': venta.ingresos / venta.unidades,
+            'subtotal': venta.ingresos,
+            'costo': venta.costo / venta.unidades
+        }
+        for venta in ventas_diarias
+    ]
+@operacion
 def obtener_notas_filtradas(filtros_activos):
     query = session.query(
         NotaVenta.id_nota,
@@ -598,66 +762,58 @@ def obtener_notas_filtradas(filtros_activos):
         Cliente.nombre.label("nombre_cliente")  # Traer directamente el nombre del cliente
     ).join(Cliente, NotaVenta.id_cliente == Cliente.id_cliente, isouter=True).filter(NotaVenta.estado.ilike('%cancelado%'))
     if filtros_activos.get("ID Venta"):
-        query = query.filter(cast(NotaVenta.id_nota, String).ilike(f"%{filtros_activos['ID Venta']}%"))
+        id_venta = str(filtros_activos["ID Venta"])
+        # Un id no numérico no puede coincidir con ninguna nota
+        query = query.filter(filtro_id_prefijo(NotaVenta.id_nota, id_venta) if es_numerico(id_venta) else false())
     if filtros_activos.get("Cliente"):
-        query = query.filter(Cliente.nombre.ilike(f"%{filtros_activos['Cliente']}%"))
+        query = query.filter(filtro_nombre(session, NotaVenta.id_cliente, Cliente.nombre, filtros_activos["Cliente"]))
     if filtros_activos.get("Fecha Inicio"):
         query = query.filter(NotaVenta.fecha_venta >= filtros_activos["Fecha Inicio"])
     if filtros_activos.get("Fecha Fin"):
         query = query.filter(NotaVenta.fecha_venta <= filtros_activos["Fecha Fin"])
     return query.order_by(NotaVenta.fecha_venta.asc(), NotaVenta.id_nota.asc()).all()
+@operacion
 def total_menos_amortizacion(id_nota):
-    nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
-    amortizaciones = session.query(Amortizacion).filter_by(id_nota=id_nota).all()
-    total = nota.total
-    for amortizacion in amortizaciones:
-        total -= amortizacion.monto
-    return total
+    # NotaVenta.saldo se mantiene al cambiar el total o las amortizaciones (ver db.py)
+    return session.query(NotaVenta.saldo).filter_by(id_nota=id_nota).scalar()
+@operacion
+def obtener_saldos(ids_notas):
+    """
+    Saldo pendiente (total menos amortizaciones) de varias notas en una sola consulta.
+    
+    :param ids_notas: Lista de IDs de nota.
+    :return: Diccionario {id_nota: saldo}.
+    """
+    return saldos_por_nota(session, ids_notas)
+@operacion
 def actualizar_estado_pedido(id_nota, nuevo_estado):
-    try:
+    with unidad_de_trabajo():
         nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
         if not nota:
             raise ValueError(Text_Nota_Venta)
         
         nota.estado_pedido = nuevo_estado
-        session.commit()
-        return True
-    except Exception as e:
-        session.rollback()
-        raise e
+    return True
+@operacion
 def obtener_reporte(mes=None, anio=None, fecha_desde=None, fecha_hasta=None):
-    q = (
-        session.query(
-            NotaVenta.id_nota.label("id_nota_venta"),
-            Producto.nombre.label("producto"),
-            Cliente.nombre.label("cliente"),
-            DetalleNotaVenta.cantidad,
-            DetalleNotaVenta.precio_unitario,
-            NotaVenta.total.label("total_por_nota"),
-            NotaVenta.fecha_venta
-        )
-        .select_from(NotaVenta)
-        .join(DetalleNotaVenta, DetalleNotaVenta.id_nota == NotaVenta.id_nota)
-        .join(Producto, Producto.id_producto == DetalleNotaVenta.id_producto)
-        .join(Cliente, Cliente.id_cliente == NotaVenta.id_cliente)
-    )
-    # Filtro por rango de fechas si ambos están presentes
-    if fecha_desde and fecha_hasta:
-        q = q.filter(
-            and_(
-                NotaVenta.fecha_venta >= fecha_desde,
-                NotaVenta.fecha_venta <= fecha_hasta
-            )
-        )
-    # Si no hay rango, pero sí mes y año => construir rango del mes
-    elif mes and anio:
-        primer_dia = date(int(anio), int(mes), 1)
-        ultimo_dia = date(int(anio), int(mes), monthrange(int(anio), int(mes))[1])
-        q = q.filter(
-            and_(
-                NotaVenta.fecha_venta >= primer_dia,
-                NotaVenta.fecha_venta <= ultimo_dia
-            )
-        )
-    q = q.order_by(NotaVenta.fecha_venta, NotaVenta.id_nota)
-    return q.all()
\ No newline at end of file
+    return consulta_reporte(session, mes, anio, fecha_desde, fecha_hasta).all()
+def iterar_reporte_ventas(mes=None, anio=None, fecha_desde=None, fecha_hasta=None):
+    """
+    Variante de obtener_reporte que entrega las filas por lotes (cursor del servidor)
+    en lugar de cargarlas todas en memoria. La sesión del hilo se cierra al terminar
+    de recorrerlas.
+    """
+    try:
+        yield from iterar_reporte(session, mes, anio, fecha_desde, fecha_hasta)
+    finally:
+        session.close()
+@operacion
+def exportar_reporte_ventas(destino, formato="csv", mes=None, anio=None, fecha_desde=None, fecha_hasta=None):
+    """
+    Exporta el reporte de ventas a un archivo CSV o XLSX con memoria constante.
+    
+    :param destino: Ruta del archivo de salida.
+    :param formato: "csv" o "xlsx".
+    :return: Cantidad de filas exportadas.
+    """
+    return exportar_reporte(iterar_reporte(session, mes, anio, fecha_desde, fecha_hasta), destino, formato)
\ No newline at end of file
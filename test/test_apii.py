@@ -0,0 +1,610 @@
+import pytest
+import os
+import sys
+from unittest.mock import patch
+from decimal import Decimal
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Agregar la raíz del proyecto al path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from db import Base, Cliente, Producto, NotaVenta, DetalleNotaVenta
+import apii
+from cache import CacheLRU, cache_productos
+
+
+class TestApi:
+    """Suite de tests para los endpoints de apii.py"""
+
+    @pytest.fixture(scope="function")
+    def test_session_factory(self):
+        """Fixture para una base en memoria compartida por todas las sesiones de la API"""
+        test_engine = create_engine("sqlite://", connect_args={"check_same_thread": False},
+                                    poolclass=StaticPool)
+        Base.metadata.create_all(test_engine)
+        TestSession = sessionmaker(bind=test_engine)
+        # El cache de productos es del proceso: cada base nueva empieza con el cache vacío
+        cache_productos.invalidar()
+        with patch('apii.Session', TestSession):
+            yield TestSession
+        test_engine.dispose()
+
+    @pytest.fixture
+    def client(self, test_session_factory):
+        """Cliente de pruebas de Flask"""
+        apii.app.config['TESTING'] = True
+        return apii.app.test_client()
+
+    @pytest.fixture
+    def productos(self, test_session_factory):
+        """Catálogo de ejemplo"""
+        session = test_session_factory()
+        session.add_all([
+            Producto(nombre=f"Camisa {i}" if i % 2 else f"Pantalón {i}", stock=i % 4,
+                     costo=Decimal("10.00"), precio_inicial=Decimal("19.90"))
+            for i in range(1, 13)
+        ])
+        session.commit()
+        session.close()
+
+    def test_productos_paginados_por_cursor(self, client, productos):
+        """Test para recorrer el catálogo por páginas con next_cursor"""
+        vistos = []
+        cursor = None
+        while True:
+            url = '/api/productos?limit=5' + (f'&cursor={cursor}' if cursor else '')
+            respuesta = client.get(url).get_json()
+            assert respuesta['success'] is True
+            assert respuesta['count'] <= 5
+            vistos.extend(p['id_producto'] for p in respuesta['data'])
+            cursor = respuesta['next_cursor']
+            if cursor is None:
+                break
+        assert vistos == list(range(1, 13))
+
+    def test_productos_filtros_y_proyeccion(self, client, productos):
+        """Test para los filtros de nombre y stock y la proyección de columnas"""
+        respuesta = client.get('/api/productos?nombre=camisa&stock_min=2&fields=nombre,stock').get_json()
+
+        assert [p['nombre'] for p in respuesta['data']] == ["Camisa 3", "Camisa 7", "Camisa 11"]
+        assert set(respuesta['data'][0]) == {'id_producto', 'nombre', 'stock'}
+
+        # El cursor queda ligado a los filtros con los que se generó
+        cursor = client.get('/api/productos?limit=2&stock_min=1').get_json()['next_cursor']
+        assert client.get(f'/api/productos?limit=2&stock_min=2&cursor={cursor}').status_code == 400
+
+    def test_productos_parametros_invalidos(self, client, productos):
+        """Test para rechazar campos desconocidos y tamaños de página fuera de rango"""
+        respuesta = client.get('/api/productos?fields=nombre,password')
+        assert respuesta.status_code == 400
+        assert 'password' in respuesta.get_json()['error']
+        assert client.get('/api/productos?limit=0').status_code == 400
+        assert client.get('/api/productos?limit=100000').status_code == 400
+
+    def test_serializacion_decimal_y_fechas(self, client, test_session_factory):
+        """Test para la conversión uniforme de Decimal y fechas, con y sin orjson"""
+        from datetime import date
+        import serializadores
+        
+        session = test_session_factory()
+        cliente = Cliente(nombre="Juan Pérez", dni="1", direccion="Test", telefono="1")
+        producto = Producto(nombre="Camisa", stock=3, costo=Decimal("10.25"), precio_inicial=None)
+        session.add_all([cliente, producto])
+        session.flush()
+        session.add(NotaVenta(id_cliente=cliente.id_cliente, fecha=date(2024, 3, 1), total=Decimal("99.90"),
+                              estado="Cancelado", fecha_venta=date(2024, 3, 2)))
+        session.add(NotaVenta(id_cliente=cliente.id_cliente, fecha=date(2024, 3, 1), total=None,
+                              estado="Cancelado", fecha_venta=date(2024, 3, 3)))
+        session.commit()
+        id_producto = producto.id_producto
+        session.close()
+        
+        for orjson in (serializadores.orjson, None):
+            with patch('serializadores.orjson', orjson):
+                producto = client.get(f'/api/productos/{id_producto}').get_json()['data']
+                assert producto['costo'] == 10.25
+                assert producto['precio_inicial'] is None
+                nota, sin_total = client.post('/api/notas/filtradas', json={}).get_json()['data']
+                assert nota == {'id_nota': 1, 'fecha_venta': '2024-03-02', 'total': 99.9,
+                                'nombre_cliente': 'Juan Pérez'}
+                # Una nota sin total se informa con 0
+                assert sin_total['total'] == 0
+        
+        # El serializador de cada modelo se arma una sola vez
+        assert serializadores.serializador_modelo(Producto) is serializadores.serializador_modelo(Producto)
+
+    def test_get_condicional_catalogo(self, client, productos, test_session_factory):
+        """Test para ETag/Last-Modified del catálogo: 304 sin consultar productos y nueva versión tras escribir"""
+        from sqlalchemy import event
+        from ventas import confirmar_nota
+        
+        respuesta = client.get('/api/productos?limit=5')
+        etag = respuesta.headers['ETag']
+        assert respuesta.status_code == 200 and respuesta.headers['Last-Modified']
+        assert client.get('/api/productos?limit=6').headers['ETag'] != etag
+        
+        sentencias = []
+        motor = test_session_factory.kw['bind']
+        registrar = lambda *args: sentencias.append(args[2])
+        event.listen(motor, "before_cursor_execute", registrar)
+        try:
+            no_modificado = client.get('/api/productos?limit=5', headers={'If-None-Match': etag})
+            por_fecha = client.get('/api/productos?limit=5',
+                                   headers={'If-Modified-Since': respuesta.headers['Last-Modified']})
+        finally:
+            event.remove(motor, "before_cursor_execute", registrar)
+        assert no_modificado.status_code == 304 and no_modificado.headers['ETag'] == etag
+        assert por_fecha.status_code == 304
+        assert sentencias and not any("FROM productos" in sentencia for sentencia in sentencias)
+        
+        # Una modificación de producto cambia la versión
+        session = test_session_factory()
+        session.query(Producto).filter_by(id_producto=1).one().stock = 50
+        session.commit()
+        respuesta = client.get('/api/productos?limit=5', headers={'If-None-Match': etag})
+        assert respuesta.status_code == 200
+        etag = respuesta.headers['ETag']
+        
+        # Un descuento de stock por venta también
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1")
+        session.add(cliente)
+        session.flush()
+        nota = NotaVenta(id_cliente=cliente.id_cliente, total=Decimal("10"), estado="Pendiente")
+        session.add(nota)
+        session.flush()
+        session.add(DetalleNotaVenta(id_nota=nota.id_nota, id_producto=1, cantidad=1,
+                                     precio_unitario=Decimal("10"), subtotal=Decimal("10")))
+        session.commit()
+        sin_cambios = client.get('/api/productos?limit=5', headers={'If-None-Match': etag})
+        assert sin_cambios.status_code == 304
+        confirmar_nota(session, nota.id_nota)
+        session.commit()
+        session.close()
+        assert client.get('/api/productos?limit=5', headers={'If-None-Match': etag}).status_code == 200
+        
+        detalle = client.get('/api/productos/1')
+        assert client.get('/api/productos/1', headers={'If-None-Match': detalle.headers['ETag']}).status_code == 304
+
+    def test_compresion_negociada(self, client, test_session_factory):
+        """Test para gzip/brotli por encima del umbral y compresión de respuestas transmitidas"""
+        import gzip
+        import json
+        from datetime import date
+        import compresion
+        
+        session = test_session_factory()
+        session.add_all([Producto(nombre=f"Producto {i}", stock=5, costo=Decimal("10.00")) for i in range(200)])
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1")
+        session.add(cliente)
+        session.flush()
+        for i in range(50):
+            nota = NotaVenta(id_cliente=cliente.id_cliente, total=Decimal("10"), estado="Cancelado",
+                             fecha_venta=date(2024, 3, 1))
+            session.add(nota)
+            session.flush()
+            session.add(DetalleNotaVenta(id_nota=nota.id_nota, id_producto=1, cantidad=1,
+                                         precio_unitario=Decimal("10"), subtotal=Decimal("10")))
+        session.commit()
+        session.close()
+        
+        plano = client.get('/api/productos?limit=200')
+        comprimido = client.get('/api/productos?limit=200', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in plano.headers
+        assert comprimido.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in comprimido.headers['Vary']
+        assert json.loads(gzip.decompress(comprimido.data)) == plano.get_json()
+        assert len(comprimido.data) * 5 < len(plano.data)
+        assert comprimido.headers['ETag'].startswith('W/')
+        
+        # Las respuestas chicas no se comprimen
+        pequenia = client.get('/api/health', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in pequenia.headers
+        
+        # El CSV transmitido se comprime por fragmentos
+        reporte = client.get('/api/reportes/ventas?mes=3&anio=2024', headers={'Accept-Encoding': 'gzip'})
+        assert reporte.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(reporte.data).decode('utf-8').count('\n') == 51
+        
+        if compresion.brotli is not None:
+            br = client.get('/api/productos?limit=200', headers={'Accept-Encoding': 'gzip, br'})
+            assert br.headers['Content-Encoding'] == 'br'
+            assert json.loads(compresion.brotli.decompress(br.data)) == plano.get_json()
+        solo_gzip = client.get('/api/productos?limit=200', headers={'Accept-Encoding': 'br;q=0, gzip'})
+        assert solo_gzip.headers['Content-Encoding'] == 'gzip'
+
+    def test_notas_filtradas_ndjson(self, client, test_session_factory):
+        """Test para el modo NDJSON de /api/notas/filtradas (Accept o ?stream=1)"""
+        import json
+        from datetime import date
+        
+        session = test_session_factory()
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1")
+        session.add(cliente)
+        session.flush()
+        session.add_all([
+            NotaVenta(id_cliente=cliente.id_cliente, total=Decimal("10.50"), estado="Cancelado",
+                      fecha_venta=date(2024, 3, 1 + i % 20))
+            for i in range(1200)
+        ])
+        session.commit()
+        session.close()
+        
+        filtros = {'Fecha Inicio': '2024-03-02'}
+        completo = client.post('/api/notas/filtradas', json=filtros).get_json()
+        respuesta = client.post('/api/notas/filtradas', json=filtros,
+                                headers={'Accept': 'application/x-ndjson'})
+        assert respuesta.mimetype == 'application/x-ndjson'
+        assert respuesta.is_streamed
+        lineas = respuesta.get_data(as_text=True).splitlines()
+        assert [json.loads(linea) for linea in lineas] == completo['data']
+        assert len(lineas) == completo['count'] == 1140
+        
+        # La primera fila se envía sola, el resto en fragmentos de varias filas
+        fragmentos = list(client.post('/api/notas/filtradas?stream=1', json=filtros).response)
+        assert fragmentos[0].count(b'\n') == 1
+        assert len(fragmentos) < len(lineas)
+        
+        # Un Accept genérico mantiene la respuesta JSON completa; filtros inválidos fallan antes de transmitir
+        assert client.post('/api/notas/filtradas', json=filtros, headers={'Accept': '*/*'}).get_json()['count'] == 1140
+        invalido = client.post('/api/notas/filtradas?stream=1', json={'Fecha Fin': '31/12/2024'})
+        assert invalido.status_code == 500 and invalido.get_json()['success'] is False
+
+    def test_idempotency_key(self, client, productos, test_session_factory):
+        """Test para Idempotency-Key: reintentos sin duplicar notas ni descontar stock dos veces"""
+        from datetime import datetime
+        from db import ClaveIdempotencia, purgar_claves_idempotencia
+        
+        session = test_session_factory()
+        session.add(Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1"))
+        session.commit()
+        
+        cuerpo = {'id_cliente': 1, 'productos_cantidades': [[3, 1, 25.0, "M", "Rojo"]]}
+        primera = client.post('/api/notas', json=cuerpo, headers={'Idempotency-Key': 'nota-1'})
+        reintento = client.post('/api/notas', json=cuerpo, headers={'Idempotency-Key': 'nota-1'})
+        assert primera.status_code == reintento.status_code == 201
+        assert reintento.get_json() == primera.get_json()
+        assert reintento.headers['Idempotent-Replayed'] == 'true'
+        assert session.query(NotaVenta).count() == 1
+        
+        # La misma clave con otro cuerpo es un error del cliente
+        otro = client.post('/api/notas', json={**cuerpo, 'observaciones': 'x'}, headers={'Idempotency-Key': 'nota-1'})
+        assert otro.status_code == 422
+        
+        id_nota = primera.get_json()['data']['id_nota']
+        url = f'/api/notas/{id_nota}/confirmar-venta'
+        confirmada = client.post(url, headers={'Idempotency-Key': 'confirmar-1'})
+        assert client.post(url, headers={'Idempotency-Key': 'confirmar-1'}).get_json() == confirmada.get_json()
+        session.expire_all()
+        assert session.get(Producto, 3).stock == 2
+        
+        # Las respuestas de error no se guardan: el reintento vuelve a ejecutarse
+        sin_cliente = {'id_cliente': 99, 'productos_cantidades': [[3, 1, 25.0, "M", "Rojo"]]}
+        assert client.post('/api/notas', json=sin_cliente, headers={'Idempotency-Key': 'nota-2'}).status_code == 404
+        assert session.get(ClaveIdempotencia, 'nota-2') is None
+        
+        # Una clave vencida se ejecuta de nuevo, y la purga borra las vencidas
+        session.get(ClaveIdempotencia, 'nota-1').expira = datetime(2000, 1, 1)
+        session.commit()
+        assert client.post('/api/notas', json=cuerpo, headers={'Idempotency-Key': 'nota-1'}).status_code == 201
+        assert session.query(NotaVenta).count() == 2
+        assert purgar_claves_idempotencia(session, datetime(2100, 1, 1)) == 2
+        session.commit()
+        session.close()
+
+    def test_crear_notas_lote(self, client, productos, test_session_factory):
+        """Test para POST /api/notas/batch: resultado por nota y validación con consultas IN"""
+        from sqlalchemy import event
+        
+        session = test_session_factory()
+        session.add_all([Cliente(nombre=f"Cliente {i}", dni=str(i), direccion="Test", telefono="1") for i in (1, 2)])
+        session.commit()
+        
+        notas = [
+            {'id_cliente': 1, 'productos_cantidades': [[1, 1, 19.9, "M", "Rojo"], [3, 2, 10.0, "L", "Azul"]]},
+            {'id_cliente': 99, 'productos_cantidades': [[1, 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 2, 'productos_cantidades': [[500, 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 2, 'productos_cantidades': [[3, 1, 10.0]]},
+            {'id_cliente': 2, 'productos_cantidades': [[2, 1, 19.9, "S", "Negro"]], 'observaciones': 'offline'},
+        ]
+        sentencias = []
+        motor = test_session_factory.kw['bind']
+        registrar = lambda *args: sentencias.append(args[2])
+        event.listen(motor, "before_cursor_execute", registrar)
+        try:
+            respuesta = client.post('/api/notas/batch', json={'notas': notas})
+        finally:
+            event.remove(motor, "before_cursor_execute", registrar)
+        
+        assert respuesta.status_code == 200
+        cuerpo = respuesta.get_json()
+        assert (cuerpo['creadas'], cuerpo['fallidas']) == (2, 3)
+        resultados = cuerpo['data']
+        assert resultados[0]['success'] and resultados[0]['total'] == 39.9
+        assert [r.get('estado') for r in resultados] == [None, 404, 404, 400, None]
+        # Clientes y productos se validan con una consulta cada uno para todo el lote
+        assert sum(1 for s in sentencias if "FROM clientes" in s) == 1
+        assert sum(1 for s in sentencias if "FROM productos" in s) == 1
+        
+        ids = [resultados[0]['id_nota'], resultados[4]['id_nota']]
+        guardadas = session.query(NotaVenta).filter(NotaVenta.id_nota.in_(ids)).order_by(NotaVenta.id_nota).all()
+        assert [nota.observaciones for nota in guardadas] == [None, 'offline']
+        assert session.query(DetalleNotaVenta).count() == 3
+        
+        assert client.post('/api/notas/batch', json={'notas': []}).status_code == 400
+        assert client.post('/api/notas/batch', json={'notas': [{}] * 501}).status_code == 400
+        session.close()
+
+    def test_crear_notas_lote_con_datos_mal_formados(self, client, productos, test_session_factory):
+        """Test para POST /api/notas/batch: los tipos inválidos se rechazan por nota sin afectar a las demás"""
+        session = test_session_factory()
+        session.add(Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1"))
+        session.commit()
+        
+        valida = {'id_cliente': 1, 'productos_cantidades': [[1, 1, 19.9, "M", "Rojo"]]}
+        mal_formadas = [
+            {'id_cliente': 1, 'productos_cantidades': [[1, "2", 19.9, "M", "Rojo"]]},
+            {'id_cliente': [1], 'productos_cantidades': [[1, 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': "1", 'productos_cantidades': [[1, 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': True, 'productos_cantidades': [[1, 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[[1], 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[{"id": 1}, 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[1, 0, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[1, 1, "19.9", "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[1, 1, -5, "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[1, 1, 19.9, ["M"], "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': "1,1,19.9"},
+            {'id_cliente': 1, 'productos_cantidades': ["12345"]},
+        ]
+        respuesta = client.post('/api/notas/batch', json={'notas': [valida] + mal_formadas + [valida]})
+        
+        assert respuesta.status_code == 200
+        cuerpo = respuesta.get_json()
+        assert (cuerpo['creadas'], cuerpo['fallidas']) == (2, len(mal_formadas))
+        resultados = cuerpo['data']
+        assert resultados[0]['success'] and resultados[-1]['success']
+        assert all(r['estado'] == 400 for r in resultados[1:-1])
+        assert session.query(NotaVenta).count() == 2
+        
+        # La misma validación en POST /api/notas
+        for nota in mal_formadas:
+            assert client.post('/api/notas', json=nota).status_code == 400
+        assert session.query(NotaVenta).count() == 2
+        session.close()
+
+    def test_confirmar_ventas_lote(self, client, productos, test_session_factory):
+        """Test para POST /api/notas/confirmar-venta: productos bloqueados en orden y un UPDATE de stock"""
+        from sqlalchemy import event
+        
+        session = test_session_factory()
+        session.add(Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1"))
+        session.commit()
+        creadas = client.post('/api/notas/batch', json={'notas': [
+            {'id_cliente': 1, 'productos_cantidades': [[7, 1, 19.9, "M", "Rojo"], [3, 1, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[3, 3, 19.9, "M", "Rojo"]]},
+            {'id_cliente': 1, 'productos_cantidades': [[2, 1, 19.9, "M", "Rojo"], [7, 1, 19.9, "M", "Rojo"]]},
+        ]}).get_json()['data']
+        ids = [resultado['id_nota'] for resultado in creadas]
+        
+        sentencias = []
+        motor = test_session_factory.kw['bind']
+        registrar = lambda *args: sentencias.append(args[2])
+        event.listen(motor, "before_cursor_execute", registrar)
+        try:
+            respuesta = client.post('/api/notas/confirmar-venta',
+                                    json={'ids_notas': ids + [999], 'fecha_venta': '2024-03-01'})
+        finally:
+            event.remove(motor, "before_cursor_execute", registrar)
+        
+        cuerpo = respuesta.get_json()
+        assert respuesta.status_code == 200
+        assert (cuerpo['confirmadas'], cuerpo['fallidas']) == (2, 2)
+        assert [r['success'] for r in cuerpo['data']] == [True, False, True, False]
+        assert cuerpo['data'][0]['fecha_venta'] == '2024-03-01'
+        assert cuerpo['data'][1]['estado'] == 400 and cuerpo['data'][1]['fallos'][0]['disponible'] == 2
+        assert cuerpo['data'][3]['estado'] == 404
+        # Notas y productos leídos en orden de id; notas y stock actualizados con un UPDATE cada uno
+        lecturas = [s for s in sentencias if s.lstrip().startswith("SELECT")]
+        assert "ORDER BY notas_venta.id_nota" in next(s for s in lecturas if "FROM notas_venta" in s)
+        assert "ORDER BY productos.id_producto" in next(s for s in lecturas if "FROM productos" in s)
+        assert sum(1 for s in sentencias if s.lstrip().startswith("UPDATE notas_venta")) == 1
+        assert sum(1 for s in sentencias if s.lstrip().startswith("UPDATE productos")) == 1
+        session.expire_all()
+        assert [session.get(Producto, i).stock for i in (2, 3, 7)] == [1, 2, 1]
+        
+        # Reconfirmar una nota ya vendida devuelve 409
+        repetida = client.post('/api/notas/confirmar-venta', json={'ids_notas': [ids[0]]}).get_json()
+        assert repetida['data'][0]['estado'] == 409
+        assert client.post('/api/notas/confirmar-venta', json={'ids_notas': ['x']}).status_code == 400
+        session.close()
+
+    def test_cache_productos(self, client, productos, test_session_factory):
+        """Test para el cache de productos: lecturas repetidas sin consultar la tabla e invalidación al escribir"""
+        from sqlalchemy import event
+        
+        session = test_session_factory()
+        session.add(Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1"))
+        session.commit()
+        
+        sentencias = []
+        motor = test_session_factory.kw['bind']
+        registrar = lambda *args: sentencias.append(args[2])
+        lecturas_productos = lambda: sum(1 for s in sentencias if s.lstrip().startswith("SELECT")
+                                         and "FROM productos" in s)
+        previas = cache_productos.estadisticas()
+        event.listen(motor, "before_cursor_execute", registrar)
+        try:
+            primera = client.get('/api/productos/3').get_json()
+            segunda = client.get('/api/productos/3').get_json()
+            assert lecturas_productos() == 1
+            # La verificación de stock al crear la nota también sale del cache
+            creada = client.post('/api/notas', json={'id_cliente': 1,
+                                                     'productos_cantidades': [[3, 3, 19.9, "M", "Rojo"]]})
+            assert creada.status_code == 201
+            assert lecturas_productos() == 1
+            
+            # Confirmar la venta descuenta stock e invalida el producto
+            id_nota = creada.get_json()['data']['id_nota']
+            assert client.post(f'/api/notas/{id_nota}/confirmar-venta').status_code == 200
+            assert client.get('/api/productos/3').get_json()['data']['stock'] == 0
+            sin_stock = client.post('/api/notas', json={'id_cliente': 1,
+                                                        'productos_cantidades': [[3, 1, 19.9, "M", "Rojo"]]})
+            assert sin_stock.status_code == 400
+        finally:
+            event.remove(motor, "before_cursor_execute", registrar)
+        assert primera == segunda and primera['data']['stock'] == 3
+        
+        # Escrituras por el ORM desde cualquier sesión del proceso
+        client.get('/api/productos/5')
+        producto = session.get(Producto, 5)
+        producto.nombre = "Camisa renombrada"
+        session.commit()
+        assert client.get('/api/productos/5').get_json()['data']['nombre'] == "Camisa renombrada"
+        session.delete(session.get(Producto, 5))
+        session.commit()
+        assert client.get('/api/productos/5').status_code == 404
+        
+        estadisticas = client.get('/api/health').get_json()['cache_productos']
+        assert estadisticas['aciertos'] - previas['aciertos'] == 3
+        assert estadisticas['invalidaciones'] > previas['invalidaciones']
+        
+        # Escritura de otro proceso (sin pasar por la sesión ni invalidar el cache): con la
+        # nueva versión del catálogo en el ETag ya no se sirve la fila vieja
+        from sqlalchemy import update
+        from db import incrementar_version_catalogo
+        anterior = client.get('/api/productos/4')
+        assert client.get('/api/productos/4').get_json() == anterior.get_json()
+        with motor.begin() as conexion:
+            conexion.execute(update(Producto.__table__).where(Producto.id_producto == 4).values(nombre="Otro proceso"))
+            incrementar_version_catalogo(conexion)
+        nueva = client.get('/api/productos/4', headers={'If-None-Match': anterior.headers['ETag']})
+        assert nueva.status_code == 200 and nueva.headers['ETag'] != anterior.headers['ETag']
+        assert nueva.get_json()['data']['nombre'] == "Otro proceso"
+        assert client.get('/api/productos/4', headers={'If-None-Match': nueva.headers['ETag']}).status_code == 304
+        session.close()
+        
+        # LRU acotado y con vencimiento
+        ahora = [0]
+        cache = CacheLRU(tamanio_maximo=2, ttl_segundos=10, reloj=lambda: ahora[0])
+        for clave in ('a', 'b'):
+            cache.guardar(clave, clave.upper(), cache.generacion, 1)
+        cache.obtener_muchos(['a'])
+        cache.guardar('c', 'C', cache.generacion, 1)
+        assert cache.obtener_muchos(['a', 'b', 'c']) == ({'a': 'A', 'c': 'C'}, ['b'])
+        generacion = cache.generacion
+        cache.invalidar(['c'])
+        cache.guardar('c', 'viejo', generacion, 1)
+        # Una versión más nueva vence las entradas leídas con versiones anteriores
+        assert cache.obtener_muchos(['a'], version=2) == ({}, ['a'])
+        cache.guardar('a', 'viejo', cache.generacion, 1)
+        cache.guardar('b', 'B', cache.generacion, 2)
+        assert cache.obtener_muchos(['a', 'b']) == ({'b': 'B'}, ['a'])
+        ahora[0] = 11
+        assert cache.obtener_muchos(['b', 'c']) == ({}, ['b', 'c'])
+        assert cache.estadisticas()['descartes'] == 1
+
+    def test_metricas(self, client, productos):
+        """Test para GET /api/metrics: latencia por ruta, SQL por petición, pool y cache en formato Prometheus"""
+        def series():
+            respuesta = client.get('/api/metrics')
+            assert respuesta.status_code == 200
+            assert respuesta.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            valores = {}
+            for linea in respuesta.get_data(as_text=True).splitlines():
+                if linea and not linea.startswith('#'):
+                    nombre, valor = linea.rsplit(' ', 1)
+                    valores[nombre] = float(valor)
+            return valores
+        
+        ruta = 'metodo="GET",ruta="/api/productos/<int:id_producto>"'
+        previas = series()
+        client.get('/api/productos/2')
+        client.get('/api/productos/2')
+        client.get('/api/productos/999')
+        client.get('/api/no-existe/123')
+        actuales = series()
+        delta = lambda nombre: actuales.get(nombre, 0) - previas.get(nombre, 0)
+        
+        assert delta(f'api_peticiones_total{{{ruta},estado="200"}}') == 2
+        assert delta(f'api_peticiones_total{{{ruta},estado="404"}}') == 1
+        assert delta('api_peticiones_total{metodo="GET",ruta="<sin ruta>",estado="404"}') == 1
+        assert delta(f'api_peticion_duracion_segundos_count{{{ruta}}}') == 3
+        assert delta(f'api_peticion_duracion_segundos_bucket{{{ruta},le="+Inf"}}') == 3
+        # Versión del catálogo en las tres; el producto 2 se lee una vez y luego sale del cache
+        assert delta(f'api_sql_sentencias_por_peticion_sum{{{ruta}}}') == 5
+        assert delta(f'api_sql_segundos_por_peticion_count{{{ruta}}}') == 3
+        assert delta('cache_productos_aciertos_total') == 1
+        # La petición de /api/metrics en curso
+        assert actuales['api_peticiones_en_curso'] == 1
+        # El engine de los tests usa StaticPool: no hay series del pool medido
+        assert 'db_pool_espera_checkout_segundos_count' not in actuales
+
+    def test_health_y_metricas_describen_el_engine_de_la_api(self, client, tmp_path):
+        """Test para /api/health y /api/metrics: informan el pool del engine de Session, no el de DATABASE_URL"""
+        from db import crear_engine
+        
+        motor = crear_engine(f"sqlite:///{tmp_path / 'api.db'}")
+        Base.metadata.create_all(motor)
+        with patch('apii.Session', sessionmaker(bind=motor)), \
+                patch.dict(os.environ, {"DATABASE_URL": ""}), patch('db._engine', None):
+            assert client.get('/api/productos').status_code == 200
+            pool = client.get('/api/health').get_json()['pool']
+            metricas = client.get('/api/metrics').get_data(as_text=True)
+        assert pool['clase'] == 'PoolMedido'
+        assert pool['checkouts'] >= 1
+        assert f"db_pool_espera_checkout_segundos_count {pool['checkouts']}" in metricas
+        motor.dispose()
+
+    def test_server_timing_y_sentencias_repetidas(self, client, productos, test_session_factory):
+        """Test para Server-Timing, la forma normalizada de las sentencias y el aviso de N+1"""
+        import re
+        import medicion_sql
+        from medicion_sql import medir_sql, normalizar_sentencia, SentenciaRepetida, SentenciaRepetidaAviso
+        
+        respuesta = client.get('/api/productos/2')
+        valor = respuesta.headers['Server-Timing']
+        assert re.fullmatch(r'db;dur=[\d.]+;desc="2 sentencias", app;dur=[\d.]+', valor)
+        medicion = medicion_sql.ultimas_mediciones()[-1]
+        assert medicion.nombre == 'GET /api/productos/<int:id_producto>' and medicion.sentencias == 2
+        # La segunda lectura sale del cache de productos
+        assert 'desc="1 sentencias"' in client.get('/api/productos/2').headers['Server-Timing']
+        
+        # Misma forma con otros valores y listas IN de otro largo
+        assert normalizar_sentencia("SELECT * FROM productos WHERE id_producto IN (?, ?, ?) AND nombre = 'x'") == \
+            normalizar_sentencia("SELECT *  FROM productos\nWHERE id_producto IN (%(id_1)s) AND nombre = 'y'") == \
+            "SELECT * FROM productos WHERE id_producto IN (?) AND nombre = ?"
+        assert normalizar_sentencia("INSERT INTO t (a, b) VALUES (?, ?), (?, ?)") == "INSERT INTO t (a, b) VALUES (?)"
+        
+        session = test_session_factory()
+        with pytest.warns(SentenciaRepetidaAviso, match="N\\+1"):
+            with medir_sql("bucle", maximo_repeticiones=3, fallar=False) as bucle:
+                for id_producto in range(1, 6):
+                    session.query(Producto).filter_by(id_producto=id_producto).first()
+        assert bucle.repetidas()[0][1] == 5
+        with pytest.raises(SentenciaRepetida):
+            with medir_sql("bucle", maximo_repeticiones=3, fallar=True):
+                for id_producto in range(1, 6):
+                    session.query(Producto).filter_by(id_producto=id_producto).first()
+        session.close()
+
+    def test_confirmar_venta_ya_confirmada(self, client, productos, test_session_factory):
+        """Test para POST /api/notas/{id}/confirmar-venta repetido: 409 sin descontar dos veces"""
+        from db import VentaDiaria
+        
+        session = test_session_factory()
+        session.add(Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1"))
+        session.commit()
+        id_nota = client.post('/api/notas', json={
+            'id_cliente': 1, 'productos_cantidades': [[3, 2, 19.9, "M", "Rojo"]]
+        }).get_json()['data']['id_nota']
+        
+        assert client.post(f'/api/notas/{id_nota}/confirmar-venta').status_code == 200
+        repetida = client.post(f'/api/notas/{id_nota}/confirmar-venta')
+        assert repetida.status_code == 409
+        assert repetida.get_json()['error'] == "La venta de la nota ya fue confirmada."
+        session.expire_all()
+        assert session.get(Producto, 3).stock == 1
+        assert [fila.unidades for fila in session.query(VentaDiaria)] == [2]
+        assert client.post('/api/notas/999/confirmar-venta').status_code == 404
+        session.close()
@@ -0,0 +1,200 @@
+import pytest
+import asyncio
+import os
+import sys
+from unittest.mock import patch
+from decimal import Decimal
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Agregar la raíz del proyecto al path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# La variante ASGI necesita quart, greenlet y aiosqlite
+pytest.importorskip("quart")
+pytest.importorskip("greenlet")
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from db import Base, Cliente, Producto, url_async
+import apii
+import apii_async
+from cache import cache_productos
+
+# Mismas peticiones contra las dos variantes: (método, ruta, json, cabeceras)
+ESCENARIO = [
+    ('GET', '/api/productos?limit=3', None, {}),
+    ('GET', '/api/productos?limit=2&fields=nombre,stock&stock_min=2', None, {}),
+    ('GET', '/api/productos?fields=password', None, {}),
+    ('GET', '/api/productos/2', None, {}),
+    ('GET', '/api/productos/999', None, {}),
+    ('POST', '/api/notas', {'id_cliente': 1, 'productos_cantidades': [[5, 2, 19.9, "M", "Rojo"]]},
+     {'Idempotency-Key': 'nota-1'}),
+    ('POST', '/api/notas', {'id_cliente': 1, 'productos_cantidades': [[5, 2, 19.9, "M", "Rojo"]]},
+     {'Idempotency-Key': 'nota-1'}),
+    ('POST', '/api/notas', {'id_cliente': 1, 'productos_cantidades': [[1, 99, 19.9, "M", "Rojo"]]}, {}),
+    ('POST', '/api/notas', {'id_cliente': 7, 'productos_cantidades': [[1, 1, 19.9, "M", "Rojo"]]}, {}),
+    ('POST', '/api/notas/batch', {'notas': [
+        {'id_cliente': 1, 'productos_cantidades': [[2, 1, 10.0, "S", "Azul"]]},
+        {'id_cliente': 1, 'productos_cantidades': [[3, 1, 10.0]]},
+    ]}, {}),
+    ('POST', '/api/notas/1/confirmar-venta', None, {}),
+    ('POST', '/api/notas/99/confirmar-venta', None, {}),
+    ('POST', '/api/notas/confirmar-venta', {'ids_notas': [2, 1, 50], 'fecha_venta': '2024-03-01'}, {}),
+    ('POST', '/api/notas/filtradas', {'Fecha Inicio': '2024-01-01'}, {}),
+    ('POST', '/api/notas/filtradas', {'Fecha Fin': '31/12/2024'}, {}),
+    ('GET', '/api/reportes/ventas?mes=13', None, {}),
+    ('GET', '/api/no-existe', None, {}),
+]
+
+
+def _poblar(url):
+    motor = create_engine(url)
+    Base.metadata.create_all(motor)
+    session = sessionmaker(bind=motor)()
+    session.add(Cliente(nombre="Juan Pérez", dni="1", direccion="Test", telefono="1"))
+    session.add_all([Producto(nombre=f"Producto {i}", stock=i, costo=Decimal("10.00"),
+                              precio_inicial=Decimal("19.90")) for i in range(1, 6)])
+    session.commit()
+    session.close()
+    # Base nueva: el cache de productos del proceso no debe traer filas de otra
+    cache_productos.invalidar()
+    return motor
+
+
+class TestApiAsync:
+    """Suite de tests para la variante ASGI (apii_async.py)"""
+
+    @pytest.fixture
+    def url_base(self, tmp_path):
+        """Cada variante usa su propio archivo SQLite con los mismos datos"""
+        def crear(nombre):
+            url = f"sqlite:///{tmp_path / nombre}"
+            _poblar(url).dispose()
+            return url
+        return crear
+
+    def _respuestas_sync(self, url):
+        motor = create_engine(url, connect_args={"check_same_thread": False})
+        respuestas = []
+        with patch('apii.Session', sessionmaker(bind=motor)):
+            client = apii.app.test_client()
+            for metodo, ruta, cuerpo, cabeceras in ESCENARIO:
+                respuesta = client.open(ruta, method=metodo, json=cuerpo, headers=cabeceras)
+                respuestas.append((respuesta.status_code, respuesta.get_json()))
+        motor.dispose()
+        return respuestas
+
+    def _respuestas_async(self, url):
+        async def ejecutar():
+            motor = create_async_engine(url_async(url))
+            respuestas = []
+            with patch('apii_async.SessionAsync', async_sessionmaker(bind=motor)):
+                client = apii_async.app.test_client()
+                for metodo, ruta, cuerpo, cabeceras in ESCENARIO:
+                    respuesta = await client.open(ruta, method=metodo, json=cuerpo, headers=cabeceras)
+                    respuestas.append((respuesta.status_code, await respuesta.get_json()))
+            await motor.dispose()
+            return respuestas
+        return asyncio.run(ejecutar())
+
+    def test_mismo_contrato_que_la_variante_wsgi(self, url_base):
+        """Test para verificar que ambas variantes responden lo mismo a las mismas peticiones"""
+        esperadas = self._respuestas_sync(url_base("wsgi.db"))
+        obtenidas = self._respuestas_async(url_base("asgi.db"))
+
+        for (metodo, ruta, _, _), esperada, obtenida in zip(ESCENARIO, esperadas, obtenidas):
+            assert obtenida == esperada, f"{metodo} {ruta}"
+        # El escenario recorre éxitos y errores de cada ruta
+        assert {estado for estado, _ in esperadas} >= {200, 201, 400, 404, 500}
+
+    def test_transmisiones_y_condicionales(self, url_base):
+        """Test para NDJSON, CSV transmitido y 304 del catálogo en la variante ASGI"""
+        url = url_base("asgi.db")
+
+        async def ejecutar():
+            motor = create_async_engine(url_async(url))
+            with patch('apii_async.SessionAsync', async_sessionmaker(bind=motor)):
+                client = apii_async.app.test_client()
+                for _ in range(3):
+                    await client.post('/api/notas', json={'id_cliente': 1,
+                                                          'productos_cantidades': [[5, 1, 19.9, "M", "Rojo"]]})
+                await client.post('/api/notas/confirmar-venta',
+                                  json={'ids_notas': [1, 2, 3], 'fecha_venta': '2024-03-01'})
+
+                ndjson = await client.post('/api/notas/filtradas', json={},
+                                           headers={'Accept': 'application/x-ndjson'})
+                csv = await client.get('/api/reportes/ventas?mes=3&anio=2024')
+                vacio = await client.get('/api/reportes/ventas?mes=1&anio=2020')
+                catalogo = await client.get('/api/productos?limit=2')
+                revalidado = await client.get('/api/productos?limit=2',
+                                              headers={'If-None-Match': catalogo.headers['ETag']})
+                resultado = (ndjson.mimetype, (await ndjson.get_data(as_text=True)).splitlines(),
+                             (await csv.get_data(as_text=True)).splitlines(),
+                             (await vacio.get_data(as_text=True)).splitlines(), revalidado.status_code)
+            await motor.dispose()
+            return resultado
+
+        mimetype, lineas, csv, vacio, revalidado = asyncio.run(ejecutar())
+        assert mimetype == 'application/x-ndjson'
+        assert [linea.count('"id_nota"') for linea in lineas] == [1, 1, 1]
+        assert len(csv) == 4 and csv[0].startswith('id_nota_venta,')
+        assert vacio == [csv[0]]
+        assert revalidado == 304
+
+    def test_reporte_xlsx_fuera_del_event_loop(self, url_base):
+        """Test para el reporte XLSX armado en un hilo con una sesión sincrónica"""
+        import io
+        import threading
+        openpyxl = pytest.importorskip("openpyxl")
+        url = url_base("asgi.db")
+        motor_sync = create_engine(url, connect_args={"check_same_thread": False})
+        hilos = []
+        escribir_xlsx = apii_async.escribir_xlsx
+
+        def escribir_registrando(filas, archivo):
+            hilos.append(threading.get_ident())
+            return escribir_xlsx(filas, archivo)
+
+        async def ejecutar():
+            motor = create_async_engine(url_async(url))
+            with patch('apii_async.SessionAsync', async_sessionmaker(bind=motor)), \
+                    patch('apii_async.Session', sessionmaker(bind=motor_sync)), \
+                    patch('apii_async.escribir_xlsx', escribir_registrando):
+                client = apii_async.app.test_client()
+                await client.post('/api/notas', json={'id_cliente': 1,
+                                                      'productos_cantidades': [[5, 2, 19.9, "M", "Rojo"]]})
+                await client.post('/api/notas/confirmar-venta', json={'ids_notas': [1], 'fecha_venta': '2024-03-01'})
+                respuesta = await client.get('/api/reportes/ventas?formato=xlsx&mes=3&anio=2024')
+                resultado = (respuesta.status_code, await respuesta.get_data(), threading.get_ident())
+            await motor.dispose()
+            return resultado
+
+        estado, contenido, hilo_loop = asyncio.run(ejecutar())
+        motor_sync.dispose()
+        assert estado == 200
+        assert hilos and hilos[0] != hilo_loop
+        filas = list(openpyxl.load_workbook(io.BytesIO(contenido)).active.iter_rows(values_only=True))
+        assert filas[0][0] == 'id_nota_venta' and len(filas) == 2
+
+    def test_health_y_metricas_describen_el_engine_de_la_api(self, url_base):
+        """Test para /api/health y /api/metrics: informan el pool del engine de SessionAsync"""
+        from db import crear_engine_async
+        url = url_base("asgi.db")
+
+        async def ejecutar():
+            motor = crear_engine_async(url)
+            with patch('apii_async.SessionAsync', async_sessionmaker(bind=motor)), \
+                    patch.dict(os.environ, {"DATABASE_URL": ""}), patch('db._engine_async', None):
+                client = apii_async.app.test_client()
+                assert (await client.get('/api/productos')).status_code == 200
+                pool = (await (await client.get('/api/health')).get_json())['pool']
+                metricas = await (await client.get('/api/metrics')).get_data(as_text=True)
+            await motor.dispose()
+            return pool, metricas
+
+        pool, metricas = asyncio.run(ejecutar())
+        assert pool['clase'] == 'PoolMedidoAsync'
+        assert pool['checkouts'] >= 1
+        assert f"db_pool_espera_checkout_segundos_count {pool['checkouts']}" in metricas
+
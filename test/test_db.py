@@ -319,6 +319,195 @@ class TestDatabaseModels:
         assert "Rojo" in colores
         assert "Azul" in colores
     
+    def test_crear_indices_faltantes(self):
+        """Test para agregar los índices declarados a una base existente sin recrearla"""
+        from sqlalchemy import inspect
+        from db import crear_indices_faltantes
+        
+        test_engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(test_engine)
+        # Simular una base creada antes de declarar los índices
+        with test_engine.begin() as conn:
+            for tabla in Base.metadata.sorted_tables:
+                for indice in tabla.indexes:
+                    indice.drop(conn)
+        
+        creados = crear_indices_faltantes(test_engine)
+        
+        assert "ix_notas_venta_estado_fecha_venta" in creados
+        assert "ix_detalle_nota_venta_id_nota_id_producto" in creados
+        indices = inspect(test_engine).get_indexes("notas_venta")
+        compuesto = [i for i in indices if i["name"] == "ix_notas_venta_estado_fecha_venta"][0]
+        assert compuesto["column_names"] == ["estado", "fecha_venta"]
+        # Una segunda ejecución no crea nada
+        assert crear_indices_faltantes(test_engine) == []
+
+    def test_pool_configurable_y_estadisticas(self, tmp_path):
+        """Test para configurar el pool desde el entorno y leer sus estadísticas"""
+        from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+        from db import crear_engine, estadisticas_pool, PoolMedido
+        
+        entorno = {"DB_POOL_SIZE": "2", "DB_MAX_OVERFLOW": "0", "DB_POOL_TIMEOUT": "0.05",
+                   "DB_POOL_PRE_PING": "true"}
+        with patch.dict(os.environ, entorno):
+            test_engine = crear_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+        
+        assert isinstance(test_engine.pool, PoolMedido)
+        assert test_engine.pool._pre_ping is True
+        conexiones = [test_engine.connect(), test_engine.connect()]
+        with pytest.raises(PoolTimeoutError):
+            test_engine.connect()
+        
+        estadisticas = estadisticas_pool(test_engine)
+        assert estadisticas["tamanio"] == 2
+        assert estadisticas["en_uso"] == 2
+        assert estadisticas["checkouts"] == 3
+        assert estadisticas["timeouts"] == 1
+        assert sum(estadisticas["espera_ms"]["buckets"].values()) == 3
+        assert estadisticas["espera_ms"]["maximo"] >= 50
+        
+        for conexion in conexiones:
+            conexion.close()
+        assert estadisticas_pool(test_engine)["en_uso"] == 0
+        test_engine.dispose()
+    
+    def test_pool_sqlite_en_memoria_y_espera_sin_conexion(self):
+        """Test para las URL de SQLite en memoria y la espera medida sin el tiempo de conectar"""
+        import sqlite3
+        import time
+        from db import crear_engine, PoolMedido
+        
+        for url in ("sqlite://", "sqlite:///:memory:"):
+            test_engine = crear_engine(url)
+            assert not isinstance(test_engine.pool, PoolMedido), url
+            test_engine.dispose()
+        
+        def conectar_lento():
+            time.sleep(0.1)
+            return sqlite3.connect(":memory:")
+        pool = PoolMedido(conectar_lento, pool_size=1, max_overflow=0)
+        pool.connect().close()
+        pool.connect().close()
+        assert pool.esperas_ms.cantidad == 2
+        assert pool.esperas_ms.maximo < 50
+        pool.dispose()
+
+    def test_importar_no_crea_engine_ni_esquema(self, tmp_path):
+        """Test para verificar que importar db, sistema y apii no conecta ni crea tablas"""
+        import subprocess
+        from sqlalchemy import inspect
+        
+        ruta = tmp_path / "arranque.db"
+        raiz = os.path.join(os.path.dirname(__file__), '..')
+        codigo = "import db, sistema, apii; assert db._engine is None"
+        entorno = dict(os.environ, DATABASE_URL=f"sqlite:///{ruta}")
+        subprocess.run([sys.executable, "-c", codigo], cwd=raiz, env=entorno, check=True)
+        assert not ruta.exists()
+        
+        from db import inicializar_esquema
+        test_engine = create_engine(f"sqlite:///{ruta}")
+        inicializar_esquema(test_engine)
+        assert "notas_venta" in inspect(test_engine).get_table_names()
+        test_engine.dispose()
+
+    def test_crear_columnas_faltantes_agrega_saldo(self):
+        """Test para agregar la columna saldo a una base anterior y calcularla desde las amortizaciones"""
+        from sqlalchemy import inspect, text
+        from db import crear_columnas_faltantes
+        
+        test_engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(test_engine)
+        with test_engine.begin() as conn:
+            conn.execute(text("DROP TABLE amortizaciones"))
+            conn.execute(text("DROP TABLE notas_venta"))
+            conn.execute(text("CREATE TABLE notas_venta (id_nota INTEGER PRIMARY KEY, id_cliente INTEGER, "
+                              "fecha DATE, total NUMERIC, estado VARCHAR, fecha_venta DATE, "
+                              "observaciones TEXT, estado_pedido VARCHAR)"))
+            conn.execute(text("INSERT INTO notas_venta (id_nota, total) VALUES (1, 100), (2, 80)"))
+        Amortizacion.__table__.create(test_engine)
+        with test_engine.begin() as conn:
+            conn.execute(text("INSERT INTO amortizaciones (id_nota, monto) VALUES (1, 30), (1, 20)"))
+        
+        assert crear_columnas_faltantes(test_engine) == ["notas_venta.saldo"]
+        
+        assert "saldo" in {c["name"] for c in inspect(test_engine).get_columns("notas_venta")}
+        with test_engine.connect() as conn:
+            saldos = dict(conn.execute(text("SELECT id_nota, saldo FROM notas_venta")).all())
+        assert saldos == {1: 50, 2: 80}
+        assert crear_columnas_faltantes(test_engine) == []
+
+    def test_crear_columnas_faltantes_fija_costos_unitarios(self):
+        """Test para agregar costo_unitario a una base anterior: solo las líneas de notas vendidas toman el costo actual"""
+        from sqlalchemy import text
+        from db import crear_columnas_faltantes
+        
+        test_engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(test_engine)
+        with test_engine.begin() as conn:
+            conn.execute(text("DROP TABLE detalle_nota_venta"))
+            conn.execute(text("CREATE TABLE detalle_nota_venta (id_detalle INTEGER PRIMARY KEY, id_nota INTEGER, "
+                              "id_producto INTEGER, cantidad INTEGER, precio_unitario NUMERIC, talla VARCHAR, "
+                              "color VARCHAR, subtotal NUMERIC)"))
+            conn.execute(text("INSERT INTO productos (id_producto, nombre, stock, costo) VALUES (1, 'Camisa', 10, 7.5)"))
+            conn.execute(text("INSERT INTO notas_venta (id_nota, total, saldo, estado) "
+                              "VALUES (1, 30, 0, 'Cancelado'), (2, 15, 15, 'Pendiente')"))
+            conn.execute(text("INSERT INTO detalle_nota_venta (id_detalle, id_nota, id_producto, cantidad, precio_unitario) "
+                              "VALUES (1, 1, 1, 2, 15), (2, 2, 1, 1, 15)"))
+        
+        assert crear_columnas_faltantes(test_engine) == ["detalle_nota_venta.costo_unitario"]
+        with test_engine.connect() as conn:
+            costos = dict(conn.execute(text("SELECT id_detalle, costo_unitario FROM detalle_nota_venta")).all())
+        assert costos == {1: 7.5, 2: None}
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="fork solo existe en POSIX")
+    def test_engine_nuevo_en_cada_proceso_hijo(self, tmp_path):
+        """Test para verificar que tras un fork el hijo arma su propio pool y no toca las conexiones del padre"""
+        import subprocess
+        
+        raiz = os.path.join(os.path.dirname(__file__), '..')
+        codigo = "\n".join([
+            "import os, db",
+            "from sqlalchemy import text",
+            "motor = db.get_engine()",
+            "with motor.connect() as c: c.execute(text('SELECT 1'))",
+            "pid = os.fork()",
+            "if pid == 0:",
+            "    ok = db._engine is None and db.get_engine() is not motor and db.get_engine().pool.checkedin() == 0",
+            "    with db.get_engine().connect() as c: c.execute(text('SELECT 1'))",
+            "    os._exit(0 if ok else 1)",
+            "_, estado = os.waitpid(pid, 0)",
+            "assert os.waitstatus_to_exitcode(estado) == 0",
+            "assert db.get_engine() is motor and motor.pool.checkedin() == 1",
+            "with motor.connect() as c: c.execute(text('SELECT 1'))",
+        ])
+        entorno = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'fork.db'}")
+        subprocess.run([sys.executable, "-c", codigo], cwd=raiz, env=entorno, check=True)
+
+    def test_calentar_worker(self, tmp_path):
+        """Test para el precalentado de cada worker de servidor.py: conexiones del pool y cache de productos"""
+        from db import crear_engine
+        from cache import cache_productos
+        from servidor import calentar_worker
+        
+        with patch.dict(os.environ, {"DB_POOL_SIZE": "2"}):
+            test_engine = crear_engine(f"sqlite:///{tmp_path / 'worker.db'}")
+        Base.metadata.create_all(test_engine)
+        TestSession = sessionmaker(bind=test_engine)
+        session = TestSession()
+        session.add_all([Producto(nombre=f"Producto {i}", stock=i, costo=Decimal("1.00")) for i in range(1, 4)])
+        session.commit()
+        session.close()
+        
+        cache_productos.invalidar()
+        with patch('db.get_engine', return_value=test_engine), patch('db.Session', TestSession):
+            assert calentar_worker(4, productos=2) == (2, 2)
+        assert test_engine.pool.checkedin() == 2
+        encontrados, faltantes = cache_productos.obtener_muchos([1, 2, 3])
+        assert sorted(encontrados) == [1, 2] and faltantes == [3]
+        assert encontrados[2]['stock'] == 2
+        cache_productos.invalidar()
+        test_engine.dispose()
+
 """    def test_cascade_delete_amortizaciones(self, test_session, sample_cliente):
         #Test para verificar la eliminación en cascada de amortizaciones
         test_session.add(sample_cliente)
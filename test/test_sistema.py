@@ -4,9 +4,10 @@ import sys
 from unittest.mock import patch, MagicMock, call
 from decimal import Decimal
 from datetime import date
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
 
 # Agregar la raíz del proyecto al path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -21,7 +22,9 @@ class TestSistemaFunctions:
     @pytest.fixture(scope="function")
     def test_session(self):
         """Fixture para crear una sesión de test"""
-        test_engine = create_engine("sqlite:///:memory:")
+        # Una sola conexión: la sesión del test y la de sistema.py ven la misma base en memoria
+        test_engine = create_engine("sqlite:///:memory:", poolclass=StaticPool,
+                                    connect_args={"check_same_thread": False})
         TestSession = sessionmaker(bind=test_engine)
         Base.metadata.create_all(test_engine)
         
@@ -31,9 +34,24 @@ class TestSistemaFunctions:
     
     @pytest.fixture
     def mock_sistema_session(self, test_session):
-        """Mock de la sesión de sistema.py"""
-        with patch('sistema.session', test_session) as mock_session:
-            yield mock_session
+        """
+        Sesión del test; sistema.py usa su propia sesión por hilo sobre la misma base,
+        que se cierra al terminar cada llamada.
+        """
+        fabrica = sessionmaker(bind=test_session.get_bind())
+        # Lo que confirma sistema.py se vuelve a leer en la sesión del test
+        event.listen(fabrica, 'after_commit', lambda session: test_session.expire_all())
+        sesion_sistema = scoped_session(fabrica)
+        with patch('sistema.session', sesion_sistema):
+            yield test_session
+        sesion_sistema.remove()
+    
+    @staticmethod
+    def _acumular_ventas(session):
+        """Arma el acumulado diario de las notas vendidas creadas directamente en la sesión del test"""
+        from ventas import reconstruir_ventas_diarias
+        reconstruir_ventas_diarias(session)
+        session.commit()
     
     @pytest.fixture
     def sample_cliente_data(self):
@@ -617,7 +635,7 @@ class TestSistemaFunctions:
         from sistema import obtener_todos_los_clientes
         
         # Simular error en la consulta
-        with patch.object(mock_sistema_session, 'query', side_effect=Exception("Database error")):
+        with patch('sistema.session.query', side_effect=Exception("Database error")):
             clientes = obtener_todos_los_clientes()
             
             assert clientes == []
@@ -927,7 +945,7 @@ class TestSistemaFunctions:
         from sistema import obtener_todos_los_clientes
         
         # Simular error en la consulta
-        with patch.object(mock_sistema_session, 'query', side_effect=Exception("Database error")):
+        with patch('sistema.session.query', side_effect=Exception("Database error")):
             clientes = obtener_todos_los_clientes()
             
             assert clientes == []
@@ -940,7 +958,7 @@ class TestSistemaFunctions:
         from sistema import obtener_todos_los_productos_1
         
         # Simular error en la consulta
-        with patch.object(mock_sistema_session, 'query', side_effect=Exception("Database error")):
+        with patch('sistema.session.query', side_effect=Exception("Database error")):
             productos = obtener_todos_los_productos_1()
             
             assert productos == []
@@ -953,7 +971,7 @@ class TestSistemaFunctions:
         from sistema import obtener_costo_total_inventario
         
         # Simular error en la consulta
-        with patch.object(mock_sistema_session, 'query', side_effect=Exception("Database error")):
+        with patch('sistema.session.query', side_effect=Exception("Database error")):
             costo = obtener_costo_total_inventario()
             
             assert costo == 0
@@ -1885,4 +1903,831 @@ class TestSistemaFunctions:
         # Obtener reporte sin filtros
         reporte = obtener_reporte()
         
-        assert len(reporte) >= 1
\ No newline at end of file
+        assert len(reporte) >= 1
+
+    @patch('sistema.messagebox')
+    def test_agregar_venta_exitosa_descuenta_stock(self, mock_messagebox, mock_sistema_session):
+        """Test para confirmar venta descontando el stock de todas las líneas"""
+        from sistema import agregar_venta
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        producto1 = Producto(nombre="Producto 1", stock=10, costo=Decimal("10.00"))
+        producto2 = Producto(nombre="Producto 2", stock=5, costo=Decimal("15.00"))
+        mock_sistema_session.add_all([cliente, producto1, producto2])
+        mock_sistema_session.commit()
+        
+        nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(), 
+                        total=Decimal("100.00"), estado="Pendiente")
+        mock_sistema_session.add(nota)
+        mock_sistema_session.commit()
+        
+        # El producto 1 aparece en dos líneas: se descuenta la suma (3 + 4)
+        mock_sistema_session.add_all([
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=producto1.id_producto, cantidad=3,
+                             precio_unitario=Decimal("10.00"), talla="M", color="Rojo", subtotal=Decimal("30.00")),
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=producto1.id_producto, cantidad=4,
+                             precio_unitario=Decimal("10.00"), talla="L", color="Azul", subtotal=Decimal("40.00")),
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=producto2.id_producto, cantidad=2,
+                             precio_unitario=Decimal("15.00"), talla="S", color="Negro", subtotal=Decimal("30.00")),
+        ])
+        mock_sistema_session.commit()
+        id_nota, id_p1, id_p2 = nota.id_nota, producto1.id_producto, producto2.id_producto
+        
+        agregar_venta(id_nota)
+        
+        mock_messagebox.showinfo.assert_called_once()
+        assert mock_sistema_session.get(Producto, id_p1).stock == 3
+        assert mock_sistema_session.get(Producto, id_p2).stock == 3
+        nota_confirmada = mock_sistema_session.get(NotaVenta, id_nota)
+        assert nota_confirmada.estado == "Cancelado"
+        assert nota_confirmada.fecha_venta == date.today()
+
+    @patch('sistema.messagebox')
+    def test_agregar_venta_fallo_no_descuenta_parcialmente(self, mock_messagebox, mock_sistema_session):
+        """Test para verificar que una línea sin stock no deja descuentos parciales"""
+        from sistema import agregar_venta
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        producto1 = Producto(nombre="Producto 1", stock=10, costo=Decimal("10.00"))
+        producto2 = Producto(nombre="Producto 2", stock=1, costo=Decimal("15.00"))
+        mock_sistema_session.add_all([cliente, producto1, producto2])
+        mock_sistema_session.commit()
+        
+        nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(), 
+                        total=Decimal("100.00"), estado="Pendiente")
+        mock_sistema_session.add(nota)
+        mock_sistema_session.commit()
+        
+        mock_sistema_session.add_all([
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=producto1.id_producto, cantidad=2,
+                             precio_unitario=Decimal("10.00"), talla="M", color="Rojo", subtotal=Decimal("20.00")),
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=producto2.id_producto, cantidad=3,
+                             precio_unitario=Decimal("15.00"), talla="S", color="Negro", subtotal=Decimal("45.00")),
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=999, cantidad=1,
+                             precio_unitario=Decimal("5.00"), talla="S", color="Negro", subtotal=Decimal("5.00")),
+        ])
+        mock_sistema_session.commit()
+        id_nota, id_p1, id_p2 = nota.id_nota, producto1.id_producto, producto2.id_producto
+        
+        agregar_venta(id_nota)
+        
+        # El mensaje trae una línea corta por cada producto que falló
+        mock_messagebox.showerror.assert_called_once()
+        mensaje = mock_messagebox.showerror.call_args[0][1]
+        assert "'Producto 2' no tiene suficiente stock. Disponible: 1, Requerido: 3" in mensaje
+        assert "El producto con ID 999 no existe" in mensaje
+        assert "Producto 1" not in mensaje
+        
+        # Ningún stock cambió y la nota sigue pendiente
+        assert mock_sistema_session.get(Producto, id_p1).stock == 10
+        assert mock_sistema_session.get(Producto, id_p2).stock == 1
+        assert mock_sistema_session.get(NotaVenta, id_nota).estado == "Pendiente"
+
+    def test_confirmar_nota_devuelve_fallos_estructurados(self, mock_sistema_session):
+        """Test para verificar la lista estructurada de fallos del motor de confirmación"""
+        from ventas import confirmar_nota, StockInsuficiente, FalloStock
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        producto = Producto(nombre="Producto Test", stock=2, costo=Decimal("10.00"))
+        mock_sistema_session.add_all([cliente, producto])
+        mock_sistema_session.commit()
+        
+        nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(), 
+                        total=Decimal("50.00"), estado="Pendiente")
+        mock_sistema_session.add(nota)
+        mock_sistema_session.commit()
+        mock_sistema_session.add(DetalleNotaVenta(
+            id_nota=nota.id_nota, id_producto=producto.id_producto, cantidad=5,
+            precio_unitario=Decimal("10.00"), talla="M", color="Rojo", subtotal=Decimal("50.00")))
+        mock_sistema_session.commit()
+        id_nota, id_producto = nota.id_nota, producto.id_producto
+        
+        with pytest.raises(StockInsuficiente) as exc_info:
+            confirmar_nota(mock_sistema_session, id_nota)
+        
+        assert exc_info.value.fallos == [FalloStock(id_producto, "Producto Test", 2, 5)]
+
+    def test_confirmar_nota_conserva_transaccion_del_llamador(self, mock_sistema_session):
+        """Test para verificar que un rechazo solo deshace los cambios de la confirmación"""
+        from ventas import confirmar_nota, StockInsuficiente, Text_Nota_Ya_Confirmada
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        productos = [Producto(nombre=f"Producto {i}", stock=3, costo=Decimal("10.00")) for i in range(2)]
+        mock_sistema_session.add_all([cliente] + productos)
+        mock_sistema_session.commit()
+        
+        # Nota y líneas sin commit: la primera línea alcanza y la segunda no
+        nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(), total=Decimal("50.00"), estado="Pendiente")
+        mock_sistema_session.add(nota)
+        mock_sistema_session.flush()
+        mock_sistema_session.add_all([
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=productos[0].id_producto, cantidad=2,
+                             precio_unitario=Decimal("10.00"), talla="M", color="Rojo", subtotal=Decimal("20.00")),
+            DetalleNotaVenta(id_nota=nota.id_nota, id_producto=productos[1].id_producto, cantidad=5,
+                             precio_unitario=Decimal("10.00"), talla="M", color="Rojo", subtotal=Decimal("50.00")),
+        ])
+        mock_sistema_session.flush()
+        
+        with pytest.raises(StockInsuficiente) as exc_info:
+            confirmar_nota(mock_sistema_session, nota.id_nota)
+        assert [fallo.id_producto for fallo in exc_info.value.fallos] == [productos[1].id_producto]
+        mock_sistema_session.expire_all()
+        assert [producto.stock for producto in productos] == [3, 3]
+        assert nota.estado == "Pendiente" and len(nota.detalles) == 2
+        
+        # Con stock suficiente se confirma una sola vez
+        productos[1].stock = 5
+        confirmar_nota(mock_sistema_session, nota.id_nota)
+        mock_sistema_session.commit()
+        with pytest.raises(ValueError, match=Text_Nota_Ya_Confirmada):
+            confirmar_nota(mock_sistema_session, nota.id_nota)
+        mock_sistema_session.commit()
+        mock_sistema_session.expire_all()
+        assert [producto.stock for producto in productos] == [1, 0]
+        assert nota.estado == "Cancelado"
+
+    def test_crear_nota_venta_varias_lineas(self, mock_sistema_session):
+        """Test para crear nota de venta con varias líneas validadas e insertadas en bloque"""
+        from sistema import crear_nota_venta
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        productos = [Producto(nombre=f"Producto {i}", stock=50, costo=Decimal("10.00")) for i in range(30)]
+        mock_sistema_session.add(cliente)
+        mock_sistema_session.add_all(productos)
+        mock_sistema_session.commit()
+        
+        productos_cantidades = [
+            (producto.id_producto, (i % 3) + 1, Decimal("12.35"), "M", "Rojo")
+            for i, producto in enumerate(productos)
+        ]
+        # El mismo producto puede repetirse en otra línea
+        productos_cantidades.append((productos[0].id_producto, 2, Decimal("9.99"), "L", "Azul"))
+        
+        id_nota, total = crear_nota_venta(cliente.id_cliente, productos_cantidades)
+        
+        esperado = sum(round(precio * cantidad, 2) for _, cantidad, precio, _, _ in productos_cantidades)
+        assert total == esperado
+        nota = mock_sistema_session.query(NotaVenta).filter_by(id_nota=id_nota).first()
+        assert nota.total == round(esperado, 2)
+        detalles = mock_sistema_session.query(DetalleNotaVenta).filter_by(id_nota=id_nota).all()
+        assert len(detalles) == 31
+        assert sum(detalle.subtotal for detalle in detalles) == esperado
+
+    @patch('sistema.messagebox')
+    def test_obtener_notas_por_cursor(self, mock_messagebox, mock_sistema_session):
+        """Test para recorrer las notas con paginación por cursor"""
+        from sistema import obtener_notas_por_cursor
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        mock_sistema_session.add(cliente)
+        mock_sistema_session.commit()
+        for i in range(7):
+            mock_sistema_session.add(NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(),
+                                               total=Decimal("10"), estado="Pendiente",
+                                               estado_pedido="ABIERTO" if i % 2 == 0 else "CERRADO"))
+        mock_sistema_session.commit()
+        
+        # Recorrer todas las páginas abiertas de 2 en 2
+        vistos, cursor = [], None
+        while True:
+            notas, cursor = obtener_notas_por_cursor(cursor=cursor, per_page=2, filtro_estado_pedido="ABIERTO")
+            vistos.extend(nota.id_nota for nota in notas)
+            if cursor is None:
+                break
+        
+        assert vistos == [7, 5, 3, 1]
+        mock_messagebox.showerror.assert_not_called()
+
+    @patch('sistema.messagebox')
+    def test_obtener_notas_por_cursor_filtros_distintos(self, mock_messagebox, mock_sistema_session):
+        """Test para rechazar un cursor generado con otros filtros"""
+        from sistema import obtener_notas_por_cursor
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        mock_sistema_session.add(cliente)
+        mock_sistema_session.commit()
+        for _ in range(3):
+            mock_sistema_session.add(NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(),
+                                               total=Decimal("10"), estado="Pendiente"))
+        mock_sistema_session.commit()
+        
+        _, cursor = obtener_notas_por_cursor(per_page=1)
+        notas, siguiente = obtener_notas_por_cursor(filtro_texto="otro", cursor=cursor, per_page=1)
+        
+        assert notas == [] and siguiente is None
+        assert "filtros" in mock_messagebox.showerror.call_args[0][1]
+
+    def test_obtener_productos_por_cursor(self, mock_sistema_session):
+        """Test para paginar productos por cursor respetando los filtros"""
+        from sistema import obtener_productos_por_cursor, obtener_productos_paginados
+        
+        mock_sistema_session.add_all([
+            Producto(nombre=f"Camisa {i}", stock=i % 2, costo=Decimal("10.00")) for i in range(6)
+        ])
+        mock_sistema_session.commit()
+        
+        primera, cursor = obtener_productos_por_cursor(solo_stock=True, tamanio_pagina=2)
+        segunda, fin = obtener_productos_por_cursor(solo_stock=True, cursor=cursor, tamanio_pagina=2)
+        
+        assert [p.nombre for p in primera] == ["Camisa 5", "Camisa 3"]
+        assert [p.nombre for p in segunda] == ["Camisa 1"]
+        assert fin is None
+        
+        # La paginación por número de página sigue devolviendo lo mismo
+        pagina, total = obtener_productos_paginados(solo_stock=True, pagina=1, tamanio_pagina=2)
+        assert [p.id_producto for p in pagina] == [p.id_producto for p in primera]
+        assert total == 3
+
+    @patch('sistema.messagebox')
+    def test_busqueda_indexada_fts5(self, mock_messagebox, mock_sistema_session):
+        """Test para la búsqueda por texto con la tabla FTS5 sincronizada por triggers"""
+        from sistema import obtener_notas_paginadas, obtener_productos_paginados, obtener_notas_filtradas
+        from busqueda import preparar_busqueda, modo_busqueda
+        
+        preparar_busqueda(mock_sistema_session.get_bind())
+        assert modo_busqueda(mock_sistema_session) == "fts5"
+        
+        # Los datos se insertan después de crear la tabla FTS: los triggers la mantienen al día
+        cliente1 = Cliente(nombre="Juan Pérez", dni="111", direccion="Test", telefono="111")
+        cliente2 = Cliente(nombre="María García", dni="222", direccion="Test", telefono="222")
+        mock_sistema_session.add_all([cliente1, cliente2,
+                                      Producto(nombre="Camisa Azul", stock=5, costo=Decimal("10.00")),
+                                      Producto(nombre="Pantalón Negro", stock=5, costo=Decimal("10.00"))])
+        mock_sistema_session.commit()
+        mock_sistema_session.add_all([
+            NotaVenta(id_cliente=cliente1.id_cliente, fecha=date.today(), total=Decimal("10"),
+                      estado="Cancelado", fecha_venta=date.today()),
+            NotaVenta(id_cliente=cliente2.id_cliente, fecha=date.today(), total=Decimal("20"),
+                      estado="Pendiente", fecha_venta=date.today()),
+        ])
+        mock_sistema_session.commit()
+        
+        notas, total = obtener_notas_paginadas(filtro_texto="pérez")
+        assert total == 1 and notas[0].cliente.nombre == "Juan Pérez"
+        # El estado de la nota sigue siendo buscable
+        notas, total = obtener_notas_paginadas(filtro_texto="pendiente")
+        assert total == 1 and notas[0].cliente.nombre == "María García"
+        productos, total = obtener_productos_paginados(filtro_texto="azu")
+        assert [p.nombre for p in productos] == ["Camisa Azul"]
+        assert len(obtener_notas_filtradas({"Cliente": "juan"})) == 1
+        
+        # Un cambio de nombre se refleja en la búsqueda
+        cliente1.nombre = "Juana Torres"
+        mock_sistema_session.commit()
+        assert obtener_notas_paginadas(filtro_texto="pérez")[1] == 0
+        assert obtener_notas_paginadas(filtro_texto="torres")[1] == 1
+        
+        # El trigger de UPDATE solo se dispara al cambiar el nombre
+        definicion = mock_sistema_session.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'productos_fts_au'")
+        ).scalar_one()
+        assert "AFTER UPDATE OF nombre ON productos" in definicion
+        preparar_busqueda(mock_sistema_session.get_bind())
+        mock_sistema_session.query(Producto).filter_by(nombre="Camisa Azul").update({"stock": 3})
+        mock_sistema_session.commit()
+        assert [p.nombre for p in obtener_productos_paginados(filtro_texto="azu")[0]] == ["Camisa Azul"]
+
+    def test_busqueda_numerica_por_prefijo_de_id(self, mock_sistema_session):
+        """Test para la búsqueda numérica por prefijo de la clave primaria"""
+        from sistema import obtener_productos_paginados
+        
+        mock_sistema_session.add_all([
+            Producto(id_producto=i, nombre=f"Producto {i}", stock=1, costo=Decimal("1.00"))
+            for i in (1, 12, 120, 129, 130, 1205, 212)
+        ])
+        mock_sistema_session.commit()
+        
+        productos, total = obtener_productos_paginados(filtro_texto="12")
+        
+        assert sorted(p.id_producto for p in productos) == [12, 120, 129, 1205]
+        assert total == 4
+
+    @patch('sistema.messagebox')
+    def test_sesion_por_hilo_en_paralelo(self, mock_messagebox, tmp_path):
+        """Test para verificar que cada hilo usa su propia sesión y puede escribir en paralelo"""
+        import threading
+        from sqlalchemy.orm import scoped_session
+        import sistema
+        
+        test_engine = create_engine(f"sqlite:///{tmp_path / 'hilos.db'}",
+                                    connect_args={"check_same_thread": False})
+        Base.metadata.create_all(test_engine)
+        sesiones = scoped_session(sessionmaker(bind=test_engine))
+        vistas = []
+        
+        def trabajo(indice):
+            try:
+                vistas.append(sesiones())
+                sistema.agregar_producto(f"Producto hilo {indice}", 5, Decimal("1.00"))
+            finally:
+                sistema.liberar_sesion_hilo()
+        
+        with patch('sistema.session', sesiones):
+            hilos = [threading.Thread(target=trabajo, args=(i,)) for i in range(4)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+        
+        assert len({id(s) for s in vistas}) == 4
+        mock_messagebox.showerror.assert_not_called()
+        verificacion = sessionmaker(bind=test_engine)()
+        assert verificacion.query(Producto).count() == 4
+        verificacion.close()
+        test_engine.dispose()
+
+    def test_unidad_de_trabajo_commit_y_rollback(self, mock_sistema_session):
+        """Test para la unidad de trabajo: commit al salir bien, rollback ante errores"""
+        from sistema import unidad_de_trabajo
+        
+        with unidad_de_trabajo() as s:
+            s.add(Producto(nombre="Confirmado", stock=1, costo=Decimal("1.00")))
+        with pytest.raises(ValueError):
+            with unidad_de_trabajo() as s:
+                s.add(Producto(nombre="Descartado", stock=1, costo=Decimal("1.00")))
+                s.flush()
+                raise ValueError("fallo")
+        
+        nombres = [p.nombre for p in mock_sistema_session.query(Producto).all()]
+        assert nombres == ["Confirmado"]
+
+    @patch('sistema.messagebox')
+    def test_resumen_ventas_desde_acumulado_diario(self, mock_messagebox, mock_sistema_session):
+        """Test para el acumulado diario: se mantiene al vender y eliminar y coincide con el cálculo en Python"""
+        from sistema import (crear_nota_venta, agregar_venta, eliminar_nota_venta, obtener_resumen_ventas,
+                             obtener_ventas_por_fecha, calcular_ganancia, calcular_total, calcular_costo_total)
+        from ventas import reconstruir_ventas_diarias
+        from db import VentaDiaria
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        camisa = Producto(nombre="Camisa", stock=100, costo=Decimal("10.00"))
+        pantalon = Producto(nombre="Pantalón", stock=100, costo=Decimal("25.50"))
+        mock_sistema_session.add_all([cliente, camisa, pantalon])
+        mock_sistema_session.commit()
+        
+        notas = [
+            crear_nota_venta(cliente.id_cliente, [(camisa.id_producto, 2, Decimal("15.00"), "M", "Rojo"),
+                                                  (pantalon.id_producto, 1, Decimal("40.00"), "L", "Azul")])[0],
+            crear_nota_venta(cliente.id_cliente, [(camisa.id_producto, 3, Decimal("14.50"), "S", "Verde")])[0],
+            crear_nota_venta(cliente.id_cliente, [(pantalon.id_producto, 4, Decimal("39.99"), "M", "Negro")])[0],
+        ]
+        for id_nota in notas:
+            agregar_venta(id_nota)
+        mock_messagebox.showerror.assert_not_called()
+        hoy = date.today()
+        
+        def esperado():
+            ventas = obtener_ventas_por_fecha(hoy, hoy)
+            return calcular_total(ventas), calcular_costo_total(ventas), calcular_ganancia(ventas)
+        
+        resumen = obtener_resumen_ventas(hoy, hoy)
+        assert esperado() == (Decimal("273.46"), Decimal("177.50"), Decimal("95.96"))
+        assert (resumen["total"], resumen["costo"], resumen["ganancia"]) == esperado()
+        assert resumen["unidades"] == 10
+        por_producto = obtener_resumen_ventas(hoy, hoy, por_producto=True)
+        assert [(f["producto"], f["unidades"]) for f in por_producto] == [("Camisa", 5), ("Pantalón", 5)]
+        
+        # Eliminar una nota vendida la descuenta del acumulado
+        eliminar_nota_venta(notas[2])
+        resumen = obtener_resumen_ventas(hoy, hoy)
+        assert esperado() == (Decimal("113.50"), Decimal("75.50"), Decimal("38.00"))
+        assert (resumen["total"], resumen["costo"], resumen["ganancia"]) == esperado()
+        
+        # La reconstrucción reproduce el mismo acumulado
+        antes = sorted((f.id_producto, f.unidades, f.ingresos, f.costo)
+                       for f in mock_sistema_session.query(VentaDiaria).all())
+        assert reconstruir_ventas_diarias(mock_sistema_session) == 2
+        mock_sistema_session.commit()
+        despues = sorted((f.id_producto, f.unidades, f.ingresos, f.costo)
+                         for f in mock_sistema_session.query(VentaDiaria).all())
+        assert despues == antes
+        assert obtener_resumen_ventas(date(2000, 1, 1), date(2000, 12, 31))["total"] == 0
+
+    def test_obtener_totales_ventas_coincide_con_calculo_en_python(self, mock_sistema_session):
+        """Test para la agregación en SQL: mismos importes que calcular_* y agrupaciones"""
+        import random
+        from sistema import (obtener_totales_ventas, obtener_ventas_por_fecha,
+                             calcular_ganancia, calcular_total, calcular_costo_total)
+        
+        rnd = random.Random(3)
+        clientes = [Cliente(nombre=f"Cliente {i}", dni=str(i), direccion="Test", telefono="1") for i in range(3)]
+        productos = [Producto(nombre=f"Producto {i}", stock=100, costo=Decimal(f"{5 + i}.{15 * i:02d}"))
+                     for i in range(4)]
+        mock_sistema_session.add_all(clientes + productos)
+        mock_sistema_session.commit()
+        dias = [date(2024, 3, d) for d in (1, 2, 3)]
+        for n in range(12):
+            nota = NotaVenta(id_cliente=clientes[n % 3].id_cliente, fecha=dias[n % 3], total=0,
+                             estado="Cancelado" if n < 10 else "Pendiente", fecha_venta=dias[n % 3])
+            mock_sistema_session.add(nota)
+            mock_sistema_session.flush()
+            for producto in rnd.sample(productos, 2):
+                cantidad = rnd.randrange(1, 6)
+                precio = Decimal(rnd.randrange(1000, 5000)) / 100
+                mock_sistema_session.add(DetalleNotaVenta(id_nota=nota.id_nota, id_producto=producto.id_producto,
+                                                          cantidad=cantidad, precio_unitario=precio,
+                                                          subtotal=precio * cantidad))
+        mock_sistema_session.commit()
+        
+        ventas = obtener_ventas_por_fecha(dias[0], dias[-1])
+        totales = obtener_totales_ventas(dias[0], dias[-1])
+        assert totales["total"] == calcular_total(ventas)
+        assert totales["costo"] == calcular_costo_total(ventas)
+        assert totales["ganancia"] == calcular_ganancia(ventas)
+        
+        for agrupacion, clave in (("producto", "id_producto"), ("cliente", "id_cliente"), ("dia", "fecha_venta")):
+            grupos = obtener_totales_ventas(dias[0], dias[-1], agrupar_por=agrupacion)
+            assert sum(g["ganancia"] for g in grupos) == totales["ganancia"]
+            assert sum(g["unidades"] for g in grupos) == totales["unidades"]
+            assert len({g[clave] for g in grupos}) == len(grupos)
+        por_dia = obtener_totales_ventas(dias[0], dias[-1], agrupar_por="dia")
+        ventas_dia = obtener_ventas_por_fecha(dias[1], dias[1])
+        assert por_dia[1]["fecha_venta"] == dias[1]
+        assert por_dia[1]["total"] == calcular_total(ventas_dia)
+        assert obtener_totales_ventas(dias[0], dias[-1], agrupar_por="cliente")[0]["cliente"] == "Cliente 0"
+        
+        with pytest.raises(ValueError):
+            obtener_totales_ventas(dias[0], dias[-1], agrupar_por="mes")
+
+    @patch('sistema.messagebox')
+    def test_totales_ventas_con_costos_de_mas_de_dos_decimales(self, mock_messagebox, mock_sistema_session):
+        """Test para importes exactos (sin redondear al centavo) con costos de más de dos decimales"""
+        from sistema import crear_nota_venta, agregar_venta, obtener_totales_ventas, obtener_resumen_ventas
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        producto = Producto(nombre="Tela", stock=10, costo=Decimal("10.333"))
+        mock_sistema_session.add_all([cliente, producto])
+        mock_sistema_session.commit()
+        id_nota = crear_nota_venta(cliente.id_cliente, [(producto.id_producto, 3, Decimal("20.00"), "M", "Rojo")])[0]
+        agregar_venta(id_nota)
+        mock_messagebox.showerror.assert_not_called()
+        hoy = date.today()
+        
+        for importes in (obtener_totales_ventas(hoy, hoy), obtener_resumen_ventas(hoy, hoy)):
+            assert (importes["total"], importes["costo"], importes["ganancia"]) == \
+                (Decimal("60"), Decimal("30.999"), Decimal("29.001"))
+            assert str(importes["total"]) == "60.00" and str(importes["costo"]) == "30.999"
+
+    def test_exportar_reporte_ventas_csv_y_xlsx(self, mock_sistema_session, tmp_path):
+        """Test para exportar el reporte por lotes a CSV y XLSX con las mismas filas que obtener_reporte"""
+        import csv
+        from sistema import obtener_reporte, iterar_reporte_ventas, exportar_reporte_ventas
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        producto = Producto(nombre="Producto Test", stock=100, costo=Decimal("10.00"))
+        mock_sistema_session.add_all([cliente, producto])
+        mock_sistema_session.commit()
+        for dia in range(1, 26):
+            nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date(2024, 3, dia), total=Decimal("25.00"),
+                             estado="Cancelado", fecha_venta=date(2024, 3, dia))
+            mock_sistema_session.add(nota)
+            mock_sistema_session.flush()
+            mock_sistema_session.add(DetalleNotaVenta(id_nota=nota.id_nota, id_producto=producto.id_producto,
+                                                      cantidad=1, precio_unitario=Decimal("25.00"),
+                                                      subtotal=Decimal("25.00")))
+        mock_sistema_session.commit()
+        
+        esperado = obtener_reporte(mes=3, anio=2024)
+        assert list(iterar_reporte_ventas(mes=3, anio=2024)) == esperado
+        
+        ruta_csv = tmp_path / "reporte.csv"
+        assert exportar_reporte_ventas(str(ruta_csv), "csv", mes=3, anio=2024) == 25
+        with open(ruta_csv, newline="", encoding="utf-8") as archivo:
+            filas = list(csv.reader(archivo))
+        assert filas[0][:3] == ["id_nota_venta", "producto", "cliente"]
+        assert len(filas) == 26
+        assert filas[1][6] == "2024-03-01"
+        
+        with pytest.raises(ValueError):
+            exportar_reporte_ventas(str(tmp_path / "reporte.pdf"), "pdf", mes=3, anio=2024)
+        
+        openpyxl = pytest.importorskip("openpyxl")
+        ruta_xlsx = tmp_path / "reporte.xlsx"
+        assert exportar_reporte_ventas(str(ruta_xlsx), "xlsx", mes=3, anio=2024) == 25
+        hoja = openpyxl.load_workbook(ruta_xlsx, read_only=True)["Reporte"]
+        assert sum(1 for _ in hoja.iter_rows()) == 26
+
+    def test_saldo_se_mantiene_y_consulta_masiva(self, mock_sistema_session):
+        """Test para el saldo mantenido en NotaVenta y su consulta en bloque"""
+        from sqlalchemy import event
+        from sistema import (crear_nota_venta, agregar_amortizacion, eliminar_amortizacion,
+                             actualizar_detalle_producto, eliminar_detalle_nota,
+                             total_menos_amortizacion, obtener_saldos)
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        camisa = Producto(nombre="Camisa", stock=100, costo=Decimal("10.00"))
+        pantalon = Producto(nombre="Pantalón", stock=100, costo=Decimal("20.00"))
+        mock_sistema_session.add_all([cliente, camisa, pantalon])
+        mock_sistema_session.commit()
+        id_camisa, id_pantalon = camisa.id_producto, pantalon.id_producto
+        
+        id_nota, _ = crear_nota_venta(cliente.id_cliente, [(id_camisa, 2, Decimal("15.00"), "M", "Rojo"),
+                                                           (id_pantalon, 1, Decimal("40.00"), "L", "Azul")])
+        assert total_menos_amortizacion(id_nota) == Decimal("70.00")
+        
+        agregar_amortizacion(id_nota, Decimal("30.00"))
+        agregar_amortizacion(id_nota, Decimal("5.00"))
+        assert total_menos_amortizacion(id_nota) == Decimal("35.00")
+        
+        amortizacion = mock_sistema_session.query(Amortizacion).filter_by(monto=Decimal("5.00")).first()
+        eliminar_amortizacion(amortizacion.id_amortizacion)
+        assert total_menos_amortizacion(id_nota) == Decimal("40.00")
+        
+        actualizar_detalle_producto(id_nota, id_camisa, cantidad=4)
+        assert total_menos_amortizacion(id_nota) == Decimal("70.00")
+        eliminar_detalle_nota(id_nota, id_pantalon)
+        assert total_menos_amortizacion(id_nota) == Decimal("30.00")
+        
+        otra_nota, _ = crear_nota_venta(cliente.id_cliente, [(id_camisa, 1, Decimal("12.00"), "S", "Negro")])
+        consultas = []
+        motor = mock_sistema_session.get_bind()
+        registrar = lambda *args: consultas.append(args[2])
+        event.listen(motor, "before_cursor_execute", registrar)
+        try:
+            saldos = obtener_saldos([id_nota, otra_nota, 9999])
+        finally:
+            event.remove(motor, "before_cursor_execute", registrar)
+        assert saldos == {id_nota: Decimal("30.00"), otra_nota: Decimal("12.00")}
+        assert len(consultas) == 1
+
+    @patch('sistema.messagebox')
+    def test_escrituras_de_productos_incrementan_version_catalogo(self, mock_messagebox, mock_sistema_session):
+        """Test para la versión del catálogo: cada alta, cambio o baja de producto la incrementa"""
+        from sistema import agregar_producto, modificar_producto, eliminar_producto, agregar_cliente
+        from db import version_catalogo
+        
+        assert version_catalogo(mock_sistema_session) == (0, None)
+        agregar_producto("Camisa", 10, Decimal("5.00"))
+        assert version_catalogo(mock_sistema_session)[0] == 1
+        producto = mock_sistema_session.query(Producto).filter_by(nombre="Camisa").first()
+        modificar_producto(producto.id_producto, "Camisa Azul", 8, Decimal("5.00"))
+        assert version_catalogo(mock_sistema_session)[0] == 2
+        # Escrituras que no tocan productos no cambian la versión
+        agregar_cliente("Juan", "Dirección", "123", "999")
+        assert version_catalogo(mock_sistema_session)[0] == 2
+        eliminar_producto(producto.id_producto)
+        version, actualizado = version_catalogo(mock_sistema_session)
+        assert version == 3 and actualizado is not None
+        mock_messagebox.showerror.assert_not_called()
+
+    @patch('sistema.messagebox')
+    def test_agregar_ventas_confirma_en_lote(self, mock_messagebox, mock_sistema_session):
+        """Test para la confirmación en lote: stock compartido entre notas y resultado por nota"""
+        from sistema import agregar_ventas
+        from db import VentaDiaria
+        
+        cliente = Cliente(nombre="Cliente Test", dni="123", direccion="Test", telefono="123")
+        camisa = Producto(nombre="Camisa", stock=5, costo=Decimal("10.00"))
+        pantalon = Producto(nombre="Pantalón", stock=10, costo=Decimal("20.00"))
+        mock_sistema_session.add_all([cliente, camisa, pantalon])
+        mock_sistema_session.commit()
+        
+        ids_notas = []
+        # Las tres primeras piden 3 camisas cada una: solo alcanza para la primera y la tercera no
+        for cantidad_camisa, cantidad_pantalon in ((3, 1), (3, 1), (2, 2)):
+            nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date.today(), total=Decimal("0"), estado="Pendiente")
+            mock_sistema_session.add(nota)
+            mock_sistema_session.flush()
+            mock_sistema_session.add_all([
+                DetalleNotaVenta(id_nota=nota.id_nota, id_producto=camisa.id_producto, cantidad=cantidad_camisa,
+                                 precio_unitario=Decimal("15.00"), subtotal=Decimal("0")),
+                DetalleNotaVenta(id_nota=nota.id_nota, id_producto=pantalon.id_producto, cantidad=cantidad_pantalon,
+                                 precio_unitario=Decimal("30.00"), subtotal=Decimal("0")),
+            ])
+            ids_notas.append(nota.id_nota)
+        mock_sistema_session.commit()
+        id_camisa, id_pantalon = camisa.id_producto, pantalon.id_producto
+        
+        confirmadas, rechazos = agregar_ventas(ids_notas + [9999])
+        
+        assert confirmadas == [ids_notas[0], ids_notas[2]]
+        assert set(rechazos) == {ids_notas[1], 9999}
+        assert "no tiene suficiente stock" in rechazos[ids_notas[1]]
+        mock_messagebox.showwarning.assert_called_once()
+        assert mock_sistema_session.get(Producto, id_camisa).stock == 0
+        assert mock_sistema_session.get(Producto, id_pantalon).stock == 7
+        assert mock_sistema_session.get(NotaVenta, ids_notas[1]).estado == "Pendiente"
+        unidades = {fila.id_producto: fila.unidades for fila in mock_sistema_session.query(VentaDiaria)}
+        assert unidades == {id_camisa: 5, id_pantalon: 3}
+        
+        # Una nota ya vendida no vuelve a descontar stock
+        confirmadas, rechazos = agregar_ventas([ids_notas[0]])
+        assert confirmadas == [] and "ya fue confirmada" in rechazos[ids_notas[0]]
+        assert mock_sistema_session.get(Producto, id_pantalon).stock == 7
+        mock_messagebox.showerror.assert_not_called()
+        
+        # Una nota vendida por otra transacción se rechaza aunque la sesión la tenga como pendiente
+        from ventas import confirmar_notas
+        pendiente = mock_sistema_session.get(NotaVenta, ids_notas[1])
+        assert pendiente.estado == "Pendiente"
+        mock_sistema_session.execute(
+            NotaVenta.__table__.update().where(NotaVenta.id_nota == ids_notas[1]).values(estado="Cancelado"))
+        confirmadas, rechazadas = confirmar_notas(mock_sistema_session, [ids_notas[1]])
+        assert confirmadas == [] and "ya fue confirmada" in str(rechazadas[ids_notas[1]])
+        mock_sistema_session.rollback()
+
+    def test_medicion_sql_por_llamada(self, mock_sistema_session):
+        """Test para la medición de sentencias por llamada a sistema y la detección de N+1"""
+        import medicion_sql
+        from sistema import obtener_producto_por_id, obtener_ventas_por_fecha, calcular_ganancia
+        
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Test", telefono="1")
+        producto = Producto(nombre="Producto", stock=10, costo=Decimal("5.00"))
+        mock_sistema_session.add_all([cliente, producto])
+        mock_sistema_session.flush()
+        for _ in range(3):
+            nota = NotaVenta(id_cliente=cliente.id_cliente, fecha=date(2024, 3, 1), fecha_venta=date(2024, 3, 1),
+                             total=Decimal("20.00"), estado="Cancelado", estado_pedido="ABIERTO")
+            nota.detalles.append(DetalleNotaVenta(id_producto=producto.id_producto, cantidad=2,
+                                                  precio_unitario=Decimal("10.00"), subtotal=Decimal("20.00")))
+            mock_sistema_session.add(nota)
+        mock_sistema_session.commit()
+        
+        obtener_producto_por_id(producto.id_producto)
+        medicion = medicion_sql.ultimas_mediciones()[-1]
+        assert medicion.nombre == "obtener_producto_por_id"
+        assert medicion.sentencias == 1 and medicion.duracion >= medicion.segundos > 0
+        
+        with patch.dict(medicion_sql._config, {'maximo_repeticiones': 2, 'fallar': True}):
+            # Con los detalles cargados en la misma consulta no hay sentencias repetidas
+            ventas = obtener_ventas_por_fecha(date(2024, 3, 1), date(2024, 3, 31))
+            assert calcular_ganancia(ventas) == Decimal("30.00")
+            assert medicion_sql.ultimas_mediciones()[-1].sentencias == 0
+            
+            # Notas sin sus detalles: una consulta perezosa por nota
+            mock_sistema_session.expunge_all()
+            notas = mock_sistema_session.query(NotaVenta).all()
+            with pytest.raises(medicion_sql.SentenciaRepetida, match="calcular_ganancia.*N\\+1"):
+                calcular_ganancia(notas)
+        
+        repetidas = medicion_sql.ultimas_mediciones()[-1].repetidas()
+        assert repetidas[0][1] == 3 and "FROM detalle_nota_venta WHERE ? =" in repetidas[0][0]
+
+    @patch('sistema.messagebox')
+    def test_sesion_se_cierra_al_terminar_cada_llamada(self, mock_messagebox, mock_sistema_session):
+        """Cada llamada deja vacía la sesión del hilo; lo devuelto conserva lo que se cargó"""
+        import sistema
+        from sistema import (agregar_producto, agregar_venta, crear_nota_venta, iterar_reporte_ventas,
+                             obtener_detalles_nota_por_id_nota, obtener_nota_venta_por_id,
+                             obtener_todos_los_productos_1)
+        
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Dir", telefono="1")
+        mock_sistema_session.add(cliente)
+        mock_sistema_session.commit()
+        agregar_producto("Producto", 10, Decimal("5.00"), Decimal("10.00"))
+        assert len(sistema.session.identity_map) == 0
+        
+        productos = obtener_todos_los_productos_1()
+        assert len(sistema.session.identity_map) == 0
+        id_nota, _ = crear_nota_venta(cliente.id_cliente, [(productos[0].id_producto, 2, Decimal("10.00"), "M", "Rojo")])
+        assert len(sistema.session.identity_map) == 0
+        
+        # Relaciones cargadas antes de cerrar la sesión
+        assert obtener_nota_venta_por_id(id_nota).cliente.nombre == "Cliente"
+        assert obtener_detalles_nota_por_id_nota(id_nota)[0].producto.nombre == "Producto"
+        assert len(sistema.session.identity_map) == 0
+        
+        # El reporte por lotes cierra la sesión al terminar de recorrerlo
+        agregar_venta(id_nota)
+        filas = list(iterar_reporte_ventas(fecha_desde=date.today(), fecha_hasta=date.today()))
+        assert len(filas) == 1
+        assert len(sistema.session.identity_map) == 0
+        
+        # Una escritura que falla no deja cambios a medias en la sesión
+        agregar_producto("Producto", 10, Decimal("5.00"), Decimal("10.00"))
+        mock_messagebox.showerror.assert_called_once()
+        assert not sistema.session.new and len(sistema.session.identity_map) == 0
+
+    @patch('sistema.messagebox')
+    def test_editar_detalles_de_nota_vendida_mantiene_acumulado(self, mock_messagebox, mock_sistema_session):
+        """Editar los detalles de una nota vendida corrige el acumulado diario en la misma transacción"""
+        from sistema import (crear_nota_venta, agregar_venta, actualizar_detalle_producto, agregar_detalle_nota,
+                             eliminar_detalle_nota, actualizar_nota_venta_mejorada, obtener_resumen_ventas)
+        from ventas import reconstruir_ventas_diarias
+        from db import VentaDiaria
+        
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Dir", telefono="1")
+        camisa = Producto(nombre="Camisa", stock=100, costo=Decimal("10.00"))
+        pantalon = Producto(nombre="Pantalón", stock=100, costo=Decimal("25.50"))
+        mock_sistema_session.add_all([cliente, camisa, pantalon])
+        mock_sistema_session.commit()
+        id_camisa, id_pantalon = camisa.id_producto, pantalon.id_producto
+        vendida = crear_nota_venta(cliente.id_cliente, [(id_camisa, 2, Decimal("15.00"), "M", "Rojo")])[0]
+        agregar_venta(vendida)
+        pendiente = crear_nota_venta(cliente.id_cliente, [(id_pantalon, 1, Decimal("40.00"), "L", "Azul")])[0]
+        hoy = date.today()
+        
+        def acumulado():
+            return sorted((f.fecha_venta, f.id_producto, f.unidades, Decimal(f.ingresos).quantize(Decimal("0.01")),
+                           Decimal(f.costo).quantize(Decimal("0.01")))
+                          for f in mock_sistema_session.query(VentaDiaria).all())
+        
+        def coincide_con_reconstruccion():
+            mantenido = acumulado()
+            reconstruir_ventas_diarias(mock_sistema_session)
+            reconstruido = acumulado()
+            mock_sistema_session.rollback()
+            return mantenido == reconstruido
+        
+        actualizar_detalle_producto(vendida, id_camisa, cantidad=3, precio_unitario=Decimal("16.00"))
+        assert coincide_con_reconstruccion()
+        assert obtener_resumen_ventas(hoy, hoy)["total"] == Decimal("48.00")
+        
+        agregar_detalle_nota(vendida, id_pantalon, 1, Decimal("40.00"), "Azul", "L", Decimal("40.00"))
+        assert coincide_con_reconstruccion()
+        assert obtener_resumen_ventas(hoy, hoy)["unidades"] == 4
+        
+        eliminar_detalle_nota(vendida, id_camisa)
+        assert coincide_con_reconstruccion()
+        assert obtener_resumen_ventas(hoy, hoy)["total"] == Decimal("40.00")
+        
+        actualizar_nota_venta_mejorada(vendida, [(id_camisa, 1, Decimal("15.00"), "Rojo", "M", Decimal("15.00")),
+                                                 (id_pantalon, 2, Decimal("40.00"), "Azul", "L", Decimal("80.00"))], [])
+        assert coincide_con_reconstruccion()
+        resumen = obtener_resumen_ventas(hoy, hoy)
+        assert (resumen["unidades"], resumen["total"], resumen["costo"]) == (3, Decimal("95.00"), Decimal("61.00"))
+        
+        # Una edición que falla no deja el acumulado descontado
+        with pytest.raises(ValueError):
+            actualizar_detalle_producto(vendida, 999, cantidad=1)
+        assert obtener_resumen_ventas(hoy, hoy)["total"] == Decimal("95.00")
+        
+        # Las notas sin vender no tocan el acumulado
+        antes = acumulado()
+        actualizar_detalle_producto(pendiente, id_pantalon, cantidad=5)
+        assert acumulado() == antes
+
+    @patch('sistema.messagebox')
+    def test_costo_de_la_venta_fijado_al_confirmar(self, mock_messagebox, mock_sistema_session):
+        """Cambiar el costo de un producto no altera las ventas ya confirmadas ni deja filas en cero al eliminarlas"""
+        from sistema import (crear_nota_venta, agregar_venta, modificar_producto, eliminar_nota_venta,
+                             agregar_detalle_nota, obtener_resumen_ventas, obtener_totales_ventas,
+                             obtener_ventas_por_fecha, calcular_ganancia, calcular_costo_total)
+        from ventas import reconstruir_ventas_diarias
+        from db import VentaDiaria
+        
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Dir", telefono="1")
+        camisa = Producto(nombre="Camisa", stock=100, costo=Decimal("10.00"))
+        mock_sistema_session.add_all([cliente, camisa])
+        mock_sistema_session.commit()
+        id_camisa = camisa.id_producto
+        hoy = date.today()
+        vendida = crear_nota_venta(cliente.id_cliente, [(id_camisa, 2, Decimal("15.00"), "M", "Rojo")])[0]
+        agregar_venta(vendida)
+        modificar_producto(id_camisa, "Camisa", 98, Decimal("12.00"))
+        mock_messagebox.showerror.assert_not_called()
+        
+        # Todas las vías usan el costo fijado al confirmar
+        ventas = obtener_ventas_por_fecha(hoy, hoy)
+        assert (calcular_costo_total(ventas), calcular_ganancia(ventas)) == (Decimal("20.00"), Decimal("10.00"))
+        totales = obtener_totales_ventas(hoy, hoy)
+        resumen = obtener_resumen_ventas(hoy, hoy)
+        assert (totales["costo"], totales["ganancia"]) == (resumen["costo"], resumen["ganancia"]) == \
+            (Decimal("20.00"), Decimal("10.00"))
+        
+        # Una línea agregada después de confirmar toma el costo de ese momento; la reconstrucción coincide
+        agregar_detalle_nota(vendida, id_camisa, 1, Decimal("15.00"), "Azul", "L", Decimal("15.00"))
+        assert obtener_resumen_ventas(hoy, hoy)["costo"] == Decimal("32.00")
+        antes = sorted((f.id_producto, f.unidades, f.ingresos, f.costo)
+                       for f in mock_sistema_session.query(VentaDiaria).all())
+        reconstruir_ventas_diarias(mock_sistema_session)
+        mock_sistema_session.commit()
+        assert sorted((f.id_producto, f.unidades, f.ingresos, f.costo)
+                      for f in mock_sistema_session.query(VentaDiaria).all()) == antes
+        
+        # Al eliminarla se descuenta exactamente lo sumado: no quedan filas en cero ni costos negativos
+        eliminar_nota_venta(vendida)
+        mock_messagebox.showerror.assert_not_called()
+        assert mock_sistema_session.query(VentaDiaria).count() == 0
+        resumen = obtener_resumen_ventas(hoy, hoy)
+        assert (resumen["unidades"], resumen["costo"], resumen["ganancia"]) == (0, 0, 0)
+        assert obtener_resumen_ventas(hoy, hoy, por_producto=True) == []
+
+    @patch('sistema.messagebox')
+    def test_obtener_ventas_diarias_y_productos_vendidos_por_dia(self, mock_messagebox, mock_sistema_session):
+        """Test para las ventas leídas del acumulado diario: una fila por día y producto con promedios por unidad"""
+        from sistema import crear_nota_venta, agregar_venta, obtener_ventas_diarias, obtener_productos_vendidos_por_dia
+        
+        cliente = Cliente(nombre="Cliente", dni="1", direccion="Dir", telefono="1")
+        camisa = Producto(nombre="Camisa", stock=100, costo=Decimal("10.00"))
+        pantalon = Producto(nombre="Pantalón", stock=100, costo=Decimal("25.50"))
+        mock_sistema_session.add_all([cliente, camisa, pantalon])
+        mock_sistema_session.commit()
+        for lineas in ([(camisa.id_producto, 2, Decimal("15.00"), "M", "Rojo")],
+                       [(camisa.id_producto, 2, Decimal("17.00"), "S", "Verde"),
+                        (pantalon.id_producto, 1, Decimal("40.00"), "L", "Azul")]):
+            agregar_venta(crear_nota_venta(cliente.id_cliente, lineas)[0])
+        mock_messagebox.showerror.assert_not_called()
+        hoy = date.today()
+        
+        ventas = obtener_ventas_diarias(hoy, hoy)
+        assert [(v.producto.nombre, v.unidades, v.ingresos, v.costo) for v in ventas] == [
+            ("Camisa", 4, Decimal("64.00"), Decimal("40.00")),
+            ("Pantalón", 1, Decimal("40.00"), Decimal("25.50")),
+        ]
+        productos = obtener_productos_vendidos_por_dia(ventas)
+        assert productos[0] == {'fecha_venta': hoy, 'producto': "Camisa", 'cantidad': 4,
+                                'precio_unitario': Decimal("16.00"), 'subtotal': Decimal("64.00"),
+                                'costo': Decimal("10.00")}
+        assert obtener_ventas_diarias(date(2000, 1, 1), date(2000, 12, 31)) == []
+
@@ -0,0 +1,521 @@
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import select, update, insert, delete, func, or_, case
+from sqlalchemy.dialects import postgresql, sqlite
+from db import Cliente, Producto, NotaVenta, DetalleNotaVenta, VentaDiaria, fijar_costos_unitarios, marcar_catalogo_modificado
+
+# Motor de confirmación de ventas compartido por sistema.py (GUI) y apii.py (API).
+
+Text_Nota_Inexistente = "La nota de venta no existe."
+Text_Nota_Ya_Confirmada = "La venta de la nota ya fue confirmada."
+# Filas por sentencia en los INSERT multi-fila (mantiene los parámetros por debajo del límite de SQLite)
+FILAS_POR_INSERT = 100
+# Los importes sumados en SQL se devuelven con al menos dos decimales
+CENTAVO = Decimal("0.01")
+# SQLite suma DECIMAL como REAL: sus sumas se redondean a esta escala, exacta para
+# importes de hasta 6 decimales y totales por debajo de ~1e9
+ESCALA_SUMA_REAL = Decimal("0.000001")
+# Agrupaciones admitidas por totales_ventas: columnas que identifican cada grupo
+AGRUPACIONES = {
+    "producto": (DetalleNotaVenta.id_producto.label("id_producto"), Producto.nombre.label("producto")),
+    "cliente": (NotaVenta.id_cliente.label("id_cliente"), Cliente.nombre.label("cliente")),
+    "dia": (NotaVenta.fecha_venta.label("fecha_venta"),),
+}
+
+
+class FalloStock(namedtuple("FalloStock", ["id_producto", "nombre", "disponible", "requerido"])):
+    """
+    Línea de una nota que no se pudo descontar del stock.
+    nombre es None cuando el producto ya no existe.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        if self.nombre is None:
+            return f"El producto con ID {self.id_producto} no existe."
+        return (f"El producto '{self.nombre}' no tiene suficiente stock. "
+                f"Disponible: {self.disponible}, Requerido: {self.requerido}.")
+
+
+class StockInsuficiente(ValueError):
+    """
+    Se lanza cuando una o más líneas de la nota no pueden confirmarse.
+    El atributo fallos contiene la lista de FalloStock.
+    """
+    def __init__(self, fallos):
+        self.fallos = list(fallos)
+        super().__init__("\n".join(str(fallo) for fallo in self.fallos))
+
+
+def productos_por_id(session, ids_productos):
+    """
+    Carga en una sola consulta IN todos los productos referenciados.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param ids_productos: Iterable de IDs (se ignoran los repetidos).
+    :return: Diccionario {id_producto: Producto}.
+    """
+    ids = set(ids_productos)
+    if not ids:
+        return {}
+    productos = session.query(Producto).filter(Producto.id_producto.in_(ids)).all()
+    return {producto.id_producto: producto for producto in productos}
+
+
+def insertar_detalles(session, filas):
+    """
+    Inserta los detalles de nota con INSERT multi-fila en lugar de un INSERT por línea.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param filas: Lista de diccionarios con las columnas de DetalleNotaVenta.
+    """
+    tabla = DetalleNotaVenta.__table__
+    for inicio in range(0, len(filas), FILAS_POR_INSERT):
+        session.execute(insert(tabla).values(filas[inicio:inicio + FILAS_POR_INSERT]))
+
+
+def _cantidades_por_producto(id_nota):
+    # Cantidad requerida por producto (una nota puede repetir un producto en varias líneas)
+    return (
+        select(
+            DetalleNotaVenta.id_producto.label("id_producto"),
+            func.sum(DetalleNotaVenta.cantidad).label("requerido")
+        )
+        .where(DetalleNotaVenta.id_nota == id_nota)
+        .group_by(DetalleNotaVenta.id_producto)
+        .subquery()
+    )
+
+
+def obtener_fallos_stock(session, id_nota):
+    """
+    Devuelve las líneas de la nota que hoy no se podrían confirmar,
+    en una sola consulta.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param id_nota: ID de la nota de venta.
+    :return: Lista de FalloStock ordenada por id_producto.
+    """
+    requeridos = _cantidades_por_producto(id_nota)
+    filas = session.execute(
+        select(requeridos.c.id_producto, Producto.nombre, Producto.stock, requeridos.c.requerido)
+        .select_from(requeridos)
+        .outerjoin(Producto, Producto.id_producto == requeridos.c.id_producto)
+        .where(or_(
+            Producto.id_producto.is_(None),
+            Producto.stock.is_(None),
+            Producto.stock < requeridos.c.requerido
+        ))
+        .order_by(requeridos.c.id_producto)
+    ).all()
+    return [FalloStock(*fila) for fila in filas]
+
+
+def _sin_vender():
+    # Notas que todavía no se confirmaron (estado distinto de "Cancelado" o sin estado)
+    return or_(NotaVenta.estado.is_(None), NotaVenta.estado != "Cancelado")
+
+
+def confirmar_nota(session, id_nota, fecha_venta=None):
+    """
+    Confirma la venta de una nota: la marca como "Cancelado" con un UPDATE condicionado
+    a que no esté vendida y descuenta el stock de todas sus líneas con un único UPDATE
+    condicionado (solo donde stock >= cantidad). No hace commit; el llamador decide
+    cuándo confirmar la transacción.
+
+    Los cambios se hacen en un savepoint: si la nota ya estaba vendida se lanza
+    ValueError, y si alguna línea no alcanza se deshacen los descuentos parciales y se
+    lanza StockInsuficiente con la lista de fallos. En ambos casos el resto de la
+    transacción del llamador queda intacto.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param id_nota: ID de la nota de venta.
+    :param fecha_venta: Fecha de la venta (por defecto hoy).
+    :return: La nota de venta confirmada.
+    """
+    nota = session.query(NotaVenta).filter_by(id_nota=id_nota).first()
+    if not nota:
+        raise ValueError(Text_Nota_Inexistente)
+
+    fecha_venta = fecha_venta or date.today()
+    ids_productos = session.scalars(
+        select(DetalleNotaVenta.id_producto).where(DetalleNotaVenta.id_nota == id_nota).distinct()
+    ).all()
+
+    requerido = (
+        select(func.sum(DetalleNotaVenta.cantidad))
+        .where(
+            DetalleNotaVenta.id_nota == id_nota,
+            DetalleNotaVenta.id_producto == Producto.id_producto
+        )
+        .scalar_subquery()
+    )
+    with session.begin_nested() as savepoint:
+        # El UPDATE de la nota toma el bloqueo de su fila: una confirmación concurrente
+        # de la misma nota espera y, al ver la nota ya vendida, no actualiza nada
+        marcada = session.execute(
+            update(NotaVenta)
+            .where(NotaVenta.id_nota == id_nota, _sin_vender())
+            .values(estado="Cancelado", fecha_venta=fecha_venta)
+        )
+        if marcada.rowcount != 1:
+            raise ValueError(Text_Nota_Ya_Confirmada)
+
+        resultado = session.execute(
+            update(Producto)
+            .where(
+                Producto.id_producto.in_(
+                    select(DetalleNotaVenta.id_producto).where(DetalleNotaVenta.id_nota == id_nota)
+                ),
+                Producto.stock >= requerido
+            )
+            .values(stock=Producto.stock - requerido)
+            .execution_options(synchronize_session=False)
+        )
+        sin_stock = resultado.rowcount != len(ids_productos)
+        if sin_stock:
+            savepoint.rollback()
+        else:
+            fijar_costos_unitarios(session, [id_nota])
+            acumular_ventas_diarias(session, id_nota, fecha_venta)
+
+    if sin_stock:
+        # Se deshizo solo el savepoint: los fallos se leen con la nota y sus líneas
+        # todavía en la transacción del llamador
+        raise StockInsuficiente(obtener_fallos_stock(session, id_nota))
+    # El UPDATE masivo no pasa por el flush: se marca el catálogo a mano
+    marcar_catalogo_modificado(session, ids_productos)
+    return nota
+
+
+def confirmar_notas(session, ids_notas, fecha_venta=None):
+    """
+    Confirma la venta de varias notas en la transacción del llamador (no hace commit).
+    Las notas y después los productos afectados se bloquean en orden de id
+    (SELECT ... FOR UPDATE), de modo que dos cierres concurrentes los toman en el mismo
+    orden y no se bloquean en ciclo, y el segundo ve las notas que vendió el primero.
+    El stock de todas las notas aceptadas se descuenta con un único UPDATE.
+
+    Cada nota se acepta o se rechaza entera, en el orden recibido: una nota rechazada
+    no descuenta stock ni impide confirmar las demás. Las notas ya vendidas (estado
+    "Cancelado") se rechazan para no descontar dos veces.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param ids_notas: IDs de las notas a confirmar (se ignoran los repetidos).
+    :param fecha_venta: Fecha de la venta (por defecto hoy).
+    :return: Tupla (confirmadas, rechazadas): lista de NotaVenta confirmadas y diccionario
+             {id_nota: ValueError o StockInsuficiente} con el motivo de cada rechazo.
+    """
+    ids = list(dict.fromkeys(ids_notas))
+    fecha_venta = fecha_venta or date.today()
+    notas = {}
+    if ids:
+        notas = {
+            nota.id_nota: nota
+            for nota in session.query(NotaVenta)
+            .filter(NotaVenta.id_nota.in_(ids))
+            .order_by(NotaVenta.id_nota)
+            .with_for_update()
+            # Estado leído tras obtener el bloqueo, aunque la nota ya estuviera en la sesión
+            .populate_existing()
+        }
+    rechazadas = {}
+    candidatas = []
+    for id_nota in ids:
+        nota = notas.get(id_nota)
+        if nota is None:
+            rechazadas[id_nota] = ValueError(Text_Nota_Inexistente)
+        elif nota.estado == "Cancelado":
+            rechazadas[id_nota] = ValueError(Text_Nota_Ya_Confirmada)
+        else:
+            candidatas.append(id_nota)
+    if not candidatas:
+        return [], rechazadas
+
+    # Cantidad requerida por nota y producto, en una sola consulta
+    requeridos = {}
+    for id_nota, id_producto, requerido in session.execute(
+        select(DetalleNotaVenta.id_nota, DetalleNotaVenta.id_producto, func.sum(DetalleNotaVenta.cantidad))
+        .where(DetalleNotaVenta.id_nota.in_(candidatas))
+        .group_by(DetalleNotaVenta.id_nota, DetalleNotaVenta.id_producto)
+    ):
+        requeridos.setdefault(id_nota, {})[id_producto] = requerido
+
+    ids_productos = sorted({id_producto for lineas in requeridos.values() for id_producto in lineas
+                            if id_producto is not None})
+    productos = {}
+    if ids_productos:
+        productos = {
+            id_producto: (nombre, stock)
+            for id_producto, nombre, stock in session.execute(
+                select(Producto.id_producto, Producto.nombre, Producto.stock)
+                .where(Producto.id_producto.in_(ids_productos))
+                .order_by(Producto.id_producto)
+                .with_for_update()
+            )
+        }
+
+    # Asignación en memoria sobre el stock bloqueado
+    disponible = {id_producto: stock for id_producto, (_, stock) in productos.items()}
+    descuentos = {}
+    confirmadas = []
+    for id_nota in candidatas:
+        lineas = requeridos.get(id_nota, {})
+        fallos = [
+            FalloStock(id_producto, productos.get(id_producto, (None, None))[0], disponible.get(id_producto), requerido)
+            for id_producto, requerido in lineas.items()
+            if disponible.get(id_producto) is None or disponible[id_producto] < requerido
+        ]
+        if fallos:
+            fallos.sort(key=lambda fallo: (fallo.id_producto is None, fallo.id_producto or 0))
+            rechazadas[id_nota] = StockInsuficiente(fallos)
+            continue
+        for id_producto, requerido in lineas.items():
+            disponible[id_producto] -= requerido
+            descuentos[id_producto] = descuentos.get(id_producto, 0) + requerido
+        confirmadas.append(notas[id_nota])
+
+    if not confirmadas:
+        return confirmadas, rechazadas
+
+    ids_confirmadas = [nota.id_nota for nota in confirmadas]
+    # Las escrituras van en un savepoint: si fallan se deshacen solo ellas
+    with session.begin_nested():
+        # Los controles de estado y de stock de los UPDATE solo fallan si el motor
+        # no respetó los bloqueos y otra transacción vendió o descontó antes
+        marcadas = session.execute(
+            update(NotaVenta)
+            .where(NotaVenta.id_nota.in_(ids_confirmadas), _sin_vender())
+            .values(estado="Cancelado", fecha_venta=fecha_venta)
+        )
+        if marcadas.rowcount != len(ids_confirmadas):
+            raise ValueError("Las notas cambiaron durante la confirmación; vuelva a intentarlo.")
+        if descuentos:
+            descuento = case(descuentos, value=Producto.id_producto)
+            resultado = session.execute(
+                update(Producto)
+                .where(Producto.id_producto.in_(descuentos), Producto.stock >= descuento)
+                .values(stock=Producto.stock - descuento)
+                .execution_options(synchronize_session=False)
+            )
+            if resultado.rowcount != len(descuentos):
+                raise ValueError("El stock cambió durante la confirmación; vuelva a intentarlo.")
+        fijar_costos_unitarios(session, ids_confirmadas)
+        _acumular_ventas_diarias(session, ids_confirmadas, fecha_venta)
+
+    if descuentos:
+        marcar_catalogo_modificado(session, descuentos)
+    return confirmadas, rechazadas
+
+
+def costo_de_linea():
+    """
+    Costo unitario de una línea vendida: el que se guardó al confirmar la venta
+    (DetalleNotaVenta.costo_unitario) o, si la línea no lo tiene, el actual del producto.
+    Es la regla de todos los importes de costo (acumulado diario, totales en SQL y calcular_*).
+    """
+    return func.coalesce(DetalleNotaVenta.costo_unitario, Producto.costo, 0)
+
+
+def _columnas_acumuladas():
+    # Unidades, ingresos y costo de las líneas (mismas fórmulas que calcular_total y calcular_costo_total)
+    return (
+        func.sum(DetalleNotaVenta.cantidad),
+        func.sum(DetalleNotaVenta.precio_unitario * DetalleNotaVenta.cantidad),
+        func.sum(costo_de_linea() * DetalleNotaVenta.cantidad),
+    )
+
+
+def _sumar_en_ventas_diarias(session, filas):
+    tabla = VentaDiaria.__table__
+    acumulables = ("unidades", "ingresos", "costo")
+    dialecto = {"postgresql": postgresql, "sqlite": sqlite}.get(session.get_bind().dialect.name)
+    if dialecto is not None:
+        sentencia = dialecto.insert(tabla).values(filas)
+        session.execute(sentencia.on_conflict_do_update(
+            index_elements=[tabla.c.fecha_venta, tabla.c.id_producto],
+            set_={columna: tabla.c[columna] + sentencia.excluded[columna] for columna in acumulables}
+        ))
+    else:
+        # Motores sin ON CONFLICT: UPDATE y, si la fila no existía, INSERT
+        for fila in filas:
+            resultado = session.execute(
+                update(tabla)
+                .where(tabla.c.fecha_venta == fila["fecha_venta"], tabla.c.id_producto == fila["id_producto"])
+                .values({columna: tabla.c[columna] + fila[columna] for columna in acumulables})
+            )
+            if resultado.rowcount == 0:
+                session.execute(insert(tabla).values(fila))
+    # Un producto sin unidades ese día no queda en el acumulado (igual que tras reconstruir)
+    for fecha_venta in {fila["fecha_venta"] for fila in filas}:
+        session.execute(
+            delete(tabla)
+            .where(tabla.c.fecha_venta == fecha_venta,
+                   tabla.c.id_producto.in_([fila["id_producto"] for fila in filas
+                                            if fila["fecha_venta"] == fecha_venta]),
+                   tabla.c.unidades == 0)
+        )
+
+
+def acumular_ventas_diarias(session, id_nota, fecha_venta, signo=1):
+    """
+    Suma (o resta, con signo=-1) las líneas de una nota al acumulado diario
+    de ventas. Se ejecuta en la transacción del llamador.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param id_nota: ID de la nota de venta.
+    :param fecha_venta: Día de la venta al que se imputan las líneas.
+    :param signo: 1 al confirmar la venta, -1 al eliminar una nota ya vendida.
+                  Las líneas se restan con el costo_unitario que se les fijó al sumarlas.
+    """
+    _acumular_ventas_diarias(session, [id_nota], fecha_venta, signo)
+
+
+def _acumular_ventas_diarias(session, ids_notas, fecha_venta, signo=1):
+    # Una fila por producto con las líneas de todas las notas indicadas
+    if not ids_notas:
+        return
+    unidades, ingresos, costo = _columnas_acumuladas()
+    filas = [
+        {
+            "fecha_venta": fecha_venta,
+            "id_producto": id_producto,
+            "unidades": signo * unidades,
+            "ingresos": signo * ingresos,
+            "costo": signo * costo,
+        }
+        for id_producto, unidades, ingresos, costo in session.execute(
+            select(DetalleNotaVenta.id_producto, unidades, ingresos, costo)
+            .outerjoin(Producto, Producto.id_producto == DetalleNotaVenta.id_producto)
+            .where(DetalleNotaVenta.id_nota.in_(ids_notas))
+            .group_by(DetalleNotaVenta.id_producto)
+        )
+    ]
+    if filas:
+        _sumar_en_ventas_diarias(session, filas)
+
+
+def reconstruir_ventas_diarias(session, fecha_inicio=None, fecha_fin=None):
+    """
+    Recalcula el acumulado diario a partir de las notas vendidas (estado "Cancelado"),
+    opcionalmente solo para un rango de fechas, con el costo fijado en cada línea al
+    confirmar la venta (costo_de_linea). No hace commit.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param fecha_inicio: Primer día a reconstruir (inclusive).
+    :param fecha_fin: Último día a reconstruir (inclusive).
+    :return: Cantidad de filas (día, producto) generadas.
+    """
+    borrar = delete(VentaDiaria)
+    origen = (
+        select(NotaVenta.fecha_venta, DetalleNotaVenta.id_producto, *_columnas_acumuladas())
+        .join(DetalleNotaVenta, DetalleNotaVenta.id_nota == NotaVenta.id_nota)
+        .outerjoin(Producto, Producto.id_producto == DetalleNotaVenta.id_producto)
+        .where(NotaVenta.estado == "Cancelado", NotaVenta.fecha_venta.isnot(None))
+        .group_by(NotaVenta.fecha_venta, DetalleNotaVenta.id_producto)
+        .having(func.sum(DetalleNotaVenta.cantidad) != 0)
+    )
+    if fecha_inicio:
+        borrar = borrar.where(VentaDiaria.fecha_venta >= fecha_inicio)
+        origen = origen.where(NotaVenta.fecha_venta >= fecha_inicio)
+    if fecha_fin:
+        borrar = borrar.where(VentaDiaria.fecha_venta <= fecha_fin)
+        origen = origen.where(NotaVenta.fecha_venta <= fecha_fin)
+    session.execute(borrar)
+    resultado = session.execute(
+        insert(VentaDiaria.__table__).from_select(
+            ["fecha_venta", "id_producto", "unidades", "ingresos", "costo"], origen
+        )
+    )
+    return resultado.rowcount
+
+
+def _suma_en_coma_flotante(session):
+    return session.get_bind().dialect.name == "sqlite"
+
+
+def _importe(valor, coma_flotante):
+    valor = Decimal(valor)
+    if coma_flotante:
+        valor = valor.quantize(ESCALA_SUMA_REAL)
+    # Sin ceros de sobra: los costos con más de dos decimales se conservan exactos
+    centavos = valor.quantize(CENTAVO)
+    return centavos if centavos == valor else valor.normalize()
+
+
+def _importes(fila, coma_flotante):
+    fila = fila._asdict()
+    fila["total"] = _importe(fila["total"], coma_flotante)
+    fila["costo"] = _importe(fila["costo"], coma_flotante)
+    fila["ganancia"] = fila["total"] - fila["costo"]
+    return fila
+
+
+def resumen_ventas_diarias(session, fecha_inicio, fecha_fin, por_producto=False):
+    """
+    Totales de venta de un rango de fechas leídos del acumulado diario,
+    sin recorrer las notas ni sus detalles.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param fecha_inicio: Primer día del rango (inclusive).
+    :param fecha_fin: Último día del rango (inclusive).
+    :param por_producto: Si es True devuelve una fila por producto.
+    :return: Diccionario con unidades, total, costo y ganancia,
+             o una lista de diccionarios (con id_producto y producto) si por_producto.
+    """
+    columnas = [
+        func.coalesce(func.sum(VentaDiaria.unidades), 0).label("unidades"),
+        func.coalesce(func.sum(VentaDiaria.ingresos), 0).label("total"),
+        func.coalesce(func.sum(VentaDiaria.costo), 0).label("costo"),
+    ]
+    consulta = select(*columnas).where(VentaDiaria.fecha_venta.between(fecha_inicio, fecha_fin))
+    coma_flotante = _suma_en_coma_flotante(session)
+    if not por_producto:
+        return _importes(session.execute(consulta).one(), coma_flotante)
+    consulta = (
+        consulta.add_columns(VentaDiaria.id_producto, Producto.nombre.label("producto"))
+        .outerjoin(Producto, Producto.id_producto == VentaDiaria.id_producto)
+        .group_by(VentaDiaria.id_producto, Producto.nombre)
+        .order_by(VentaDiaria.id_producto)
+    )
+    return [_importes(fila, coma_flotante) for fila in session.execute(consulta)]
+
+
+def totales_ventas(session, fecha_inicio, fecha_fin, agrupar_por=None):
+    """
+    Total, costo y ganancia de las ventas confirmadas (estado "Cancelado") de un
+    rango de fechas, calculados en la base de datos en una sola consulta sobre
+    las notas y sus detalles, con el costo fijado al confirmar cada venta
+    (costo_de_linea): el mismo resultado que el acumulado diario y calcular_*.
+
+    :param session: Sesión SQLAlchemy a utilizar.
+    :param fecha_inicio: Primer día del rango (inclusive).
+    :param fecha_fin: Último día del rango (inclusive).
+    :param agrupar_por: None, "producto", "cliente" o "dia".
+    :return: Diccionario con unidades, total, costo y ganancia, o una lista de
+             diccionarios (uno por grupo, con sus columnas de agrupación) si se agrupa.
+    """
+    if agrupar_por is not None and agrupar_por not in AGRUPACIONES:
+        raise ValueError(f"Agrupación no válida: {agrupar_por}. Opciones: {', '.join(AGRUPACIONES)}")
+    unidades, ingresos, costo = _columnas_acumuladas()
+    claves = AGRUPACIONES.get(agrupar_por, ())
+    consulta = (
+        select(
+            *claves,
+            func.coalesce(unidades, 0).label("unidades"),
+            func.coalesce(ingresos, 0).label("total"),
+            func.coalesce(costo, 0).label("costo"),
+        )
+        .select_from(NotaVenta)
+        .join(DetalleNotaVenta, DetalleNotaVenta.id_nota == NotaVenta.id_nota)
+        .outerjoin(Producto, Producto.id_producto == DetalleNotaVenta.id_producto)
+        .where(NotaVenta.estado == "Cancelado", NotaVenta.fecha_venta.between(fecha_inicio, fecha_fin))
+    )
+    coma_flotante = _suma_en_coma_flotante(session)
+    if agrupar_por is None:
+        return _importes(session.execute(consulta).one(), coma_flotante)
+    if agrupar_por == "cliente":
+        consulta = consulta.outerjoin(Cliente, Cliente.id_cliente == NotaVenta.id_cliente)
+    consulta = consulta.group_by(*claves).order_by(claves[0])
+    return [_importes(fila, coma_flotante) for fila in session.execute(consulta)]